@@ -0,0 +1,170 @@
+import logging
+import math
+from collections import defaultdict
+from datetime import date as Date
+from functools import lru_cache
+
+from finance_storage import iso_date
+
+PERIODS = ("month", "week")
+
+
+def month_key(date):
+    return f"{date[6:10]}-{date[3:5]}"
+
+
+@lru_cache(maxsize=8192)
+def week_key(date):
+    year, week, _ = Date(int(date[6:10]), int(date[3:5]), int(date[0:2])).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def period_key(period, date):
+    return month_key(date) if period == "month" else week_key(date)
+
+
+class Aggregates:
+    def __init__(self, events=()):
+        self.rebuild(events)
+
+    def rebuild(self, events):
+        self.by_type = defaultdict(float)
+        self.by_category = defaultdict(float)
+        self.by_day = defaultdict(float)
+        self.by_month = defaultdict(float)
+        # (period, type, reason or None) -> {bucket: total}; every chart view
+        # is one lookup here instead of a pass over the events.
+        self.series = defaultdict(lambda: defaultdict(float))
+        self.counts = defaultdict(int)
+        self.sorted_cache = {}
+        # Events of one type, category and day land in the same buckets, so
+        # a ledger is summed per day and category first and each bucket is
+        # touched once per group instead of once per event.
+        groups = defaultdict(lambda: [0.0, 0])
+        for event in events:
+            group = groups[(event["type"], event["reason"], event["date"])]
+            group[0] += event["amount"]
+            group[1] += 1
+        for (event_type, reason, date), (amount, count) in groups.items():
+            self.apply_group(event_type, reason, date, amount, count)
+
+    def keys(self, event_type, reason, date):
+        return (
+            (self.by_type, event_type),
+            (self.by_category, (event_type, reason)),
+            (self.by_day, (event_type, iso_date(date))),
+            (self.by_month, (event_type, month_key(date))),
+        )
+
+    def series_keys(self, event_type, reason, date):
+        month = month_key(date)
+        week = week_key(date)
+        return (
+            (("month", event_type, None), month),
+            (("month", event_type, reason), month),
+            (("week", event_type, None), week),
+            (("week", event_type, reason), week),
+        )
+
+    def apply(self, event, sign):
+        self.apply_group(event["type"], event["reason"], event["date"], sign * event["amount"], sign)
+
+    def apply_group(self, event_type, reason, date, amount, count):
+        counts = self.counts
+        buckets = [(totals, key, (slot, key)) for slot, (totals, key) in enumerate(self.keys(event_type, reason, date))]
+        series_keys = self.series_keys(event_type, reason, date)
+        buckets += [(self.series[series_key], bucket, (series_key, bucket)) for series_key, bucket in series_keys]
+        for totals, key, count_key in buckets:
+            counts[count_key] += count
+            if counts[count_key] == 0:
+                # Drop emptied buckets so float residue from add/subtract
+                # doesn't linger as a tiny non-zero total.
+                del counts[count_key]
+                totals.pop(key, None)
+            else:
+                totals[key] += amount
+        if count < 0:
+            for series_key, _ in series_keys:
+                if not self.series.get(series_key, True):
+                    del self.series[series_key]
+        if self.sorted_cache:
+            self.sorted_cache.clear()
+
+    def add(self, event):
+        self.apply(event, 1)
+
+    def remove(self, event):
+        self.apply(event, -1)
+
+    @property
+    def income(self):
+        return self.by_type.get("income", 0)
+
+    @property
+    def expenses(self):
+        return self.by_type.get("expense", 0)
+
+    @property
+    def balance(self):
+        return self.income - self.expenses
+
+    def category_total(self, event_type, reason):
+        return self.by_category.get((event_type, reason), 0)
+
+    def day_total(self, event_type, date):
+        return self.by_day.get((event_type, iso_date(date)), 0)
+
+    def month_total(self, event_type, date):
+        return self.by_month.get((event_type, month_key(date)), 0)
+
+    def series_points(self, period, event_type, reason=None):
+        cache_key = (period, event_type, reason)
+        points = self.sorted_cache.get(cache_key)
+        if points is None:
+            totals = self.series.get(cache_key, {})
+            points = self.sorted_cache[cache_key] = sorted(totals.items())
+        return points
+
+    def running_balance(self, period, reason=None):
+        cache_key = ("balance", period, reason)
+        points = self.sorted_cache.get(cache_key)
+        if points is None:
+            income = dict(self.series_points(period, "income", reason))
+            expenses = dict(self.series_points(period, "expense", reason))
+            balance = 0
+            points = []
+            for bucket in sorted(income.keys() | expenses.keys()):
+                balance += income.get(bucket, 0) - expenses.get(bucket, 0)
+                points.append((bucket, balance))
+            self.sorted_cache[cache_key] = points
+        return points
+
+    def category_totals(self, event_type):
+        return sorted(
+            ((reason, total) for (kind, reason), total in self.by_category.items() if kind == event_type),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+
+    def verify(self, events):
+        expected = Aggregates(events)
+        mismatches = []
+        for name in ("by_type", "by_category", "by_day", "by_month"):
+            actual_totals = getattr(self, name)
+            expected_totals = getattr(expected, name)
+            for key in actual_totals.keys() | expected_totals.keys():
+                actual = actual_totals.get(key, 0)
+                wanted = expected_totals.get(key, 0)
+                if not math.isclose(actual, wanted, rel_tol=1e-9, abs_tol=1e-6):
+                    mismatches.append((name, key, actual, wanted))
+        for series_key in self.series.keys() | expected.series.keys():
+            actual_totals = self.series.get(series_key, {})
+            expected_totals = expected.series.get(series_key, {})
+            for bucket in actual_totals.keys() | expected_totals.keys():
+                actual = actual_totals.get(bucket, 0)
+                wanted = expected_totals.get(bucket, 0)
+                if not math.isclose(actual, wanted, rel_tol=1e-9, abs_tol=1e-6):
+                    mismatches.append(("series", (*series_key, bucket), actual, wanted))
+        for mismatch in mismatches:
+            logging.error(f"Aggregate mismatch in {mismatch[0]} for {mismatch[1]}: {mismatch[2]} != {mismatch[3]}")
+        return mismatches
@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+DEFAULT_SIZES = (1000, 100000, 1000000)
+INCOME_CATEGORIES = ("Salary", "Bonus", "Interest", "Gifts")
+EXPENSE_CATEGORIES = (
+    "Rent", "Groceries", "Restaurants", "Transport", "Utilities", "Insurance",
+    "Health", "Clothing", "Entertainment", "Travel", "Education", "Subscriptions",
+)
+# Rough mean amount and share of expense events per category.
+EXPENSE_PROFILE = {
+    "Rent": (900, 1), "Groceries": (45, 30), "Restaurants": (30, 15), "Transport": (20, 20),
+    "Utilities": (120, 2), "Insurance": (80, 1), "Health": (60, 3), "Clothing": (70, 4),
+    "Entertainment": (25, 8), "Travel": (400, 1), "Education": (150, 1), "Subscriptions": (12, 6),
+}
+MUTATIONS = 1000
+
+
+def generate_ledger(directory, count, seed=0, years=5):
+    rng = random.Random(seed)
+    categories = [{"name": name, "type": "Income", "id": i} for i, name in enumerate(INCOME_CATEGORIES, start=1)]
+    categories += [{"name": name, "type": "Expense", "id": i} for i, name in enumerate(EXPENSE_CATEGORIES, start=len(categories) + 1)]
+    ids = {category["name"]: category["id"] for category in categories}
+    names = list(EXPENSE_PROFILE)
+    weights = [EXPENSE_PROFILE[name][1] for name in names]
+
+    first_day = date(date.today().year - years, 1, 1)
+    span = years * 365
+    events = []
+    for i in range(count):
+        day = first_day + timedelta(days=span * i // count)
+        if rng.random() < 0.08:
+            reason = rng.choice(INCOME_CATEGORIES)
+            amount = round(rng.lognormvariate(7, 0.6), 2)
+            event_type = "income"
+        else:
+            reason = rng.choices(names, weights)[0]
+            amount = round(rng.lognormvariate(0, 0.5) * EXPENSE_PROFILE[reason][0], 2)
+            event_type = "expense"
+        events.append({"type": event_type, "amount": amount, "reason": reason,
+                       "date": day.strftime("%d.%m.%Y"), "category_id": ids[reason]})
+
+    income = sum(event["amount"] for event in events if event["type"] == "income")
+    expenses = sum(event["amount"] for event in events if event["type"] == "expense")
+    data_path = os.path.join(directory, "finances.json")
+    category_path = os.path.join(directory, "categories.json")
+    with open(data_path, "w", encoding="utf-8") as f:
+        json.dump({"income": income, "expenses": expenses, "events": events}, f)
+    with open(category_path, "w", encoding="utf-8") as f:
+        json.dump(categories, f, ensure_ascii=False, indent=4)
+    return data_path, category_path
+
+
+def timed(function, repeat=1, setup=None):
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - started)
+    return {"best": min(runs), "median": statistics.median(runs), "runs": runs}
+
+
+def bench_core(directory, mode, repeat):
+    from finance_ledger import Ledger
+
+    data_path = os.path.join(directory, "finances.json")
+    category_path = os.path.join(directory, "categories.json")
+    db_path = os.path.join(directory, "finances.db")
+
+    def open_ledger():
+        return Ledger.open(mode, data_path, category_path, db_path, debounce=0)
+
+    # The first SQLite open migrates the JSON files; keep that out of the timings.
+    open_ledger().close()
+    results = {}
+    ledgers = []
+    results["load"] = timed(lambda: ledgers.append(open_ledger()), repeat)
+    for ledger in ledgers[:-1]:
+        ledger.close()
+    ledger = ledgers[-1]
+    count = len(ledger.events)
+
+    results["save"] = timed(ledger.save, repeat)
+    results["totals"] = timed(lambda: ledger.aggregates, repeat, setup=ledger.reset_views)
+    results["columns"] = timed(lambda: ledger.columns, repeat, setup=ledger.reset_views)
+    ledger.columns
+    results["search_index"] = timed(lambda: ledger.search_index, repeat, setup=lambda: setattr(ledger, "_search_index", None))
+    results["query"] = timed(lambda: ledger.query(start="01.03.2022", end="30.06.2022", reason="Groceries"), repeat)
+    results["scan"] = timed(lambda: sum(1 for _ in ledger.scan(reason="Groceries", min_amount=50)), repeat)
+
+    mutations = min(MUTATIONS, count)
+    rng = random.Random(1)
+    today = date.today().strftime("%d.%m.%Y")
+    results["add"] = timed(lambda: [ledger.add(12.5, "Groceries", today) for _ in range(mutations)])
+    results["update_amount"] = timed(lambda: [ledger.update_amount(rng.randrange(len(ledger.events)), 10.0) for _ in range(mutations)])
+    results["delete"] = timed(lambda: [ledger.delete_event(rng.randrange(len(ledger.events))) for _ in range(mutations)])
+    results["flush"] = timed(ledger.flush)
+    results["close"] = timed(ledger.close)
+    for name in ("add", "update_amount", "delete"):
+        results[name]["per_op"] = results[name]["best"] / mutations
+    return results
+
+
+def bench_gui(directory, repeat):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PyQt5.QtWidgets import QApplication
+    except ImportError as e:
+        return {"skipped": str(e)}
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    cwd = os.getcwd()
+    # FinanceApp reads and writes its files relative to the working directory.
+    os.chdir(directory)
+    try:
+        import finance_calculator
+
+        results = {}
+        windows = []
+        results["app_start"] = timed(lambda: windows.append(finance_calculator.FinanceApp()))
+        window = windows[0]
+        window.show()
+        app.processEvents()
+        # Records are read in the background once the window is up.
+        results["app_loaded"] = timed(window.wait_for_load)
+
+        def load_history():
+            window.show_history_screen()
+            app.processEvents()
+
+        results["load_history"] = timed(load_history, repeat)
+        window.show_stat_screen()
+
+        for view in finance_calculator.CHART_VIEWS:
+            def render(view=view):
+                window.chart_view_combo.setCurrentIndex(finance_calculator.CHART_VIEWS.index(view))
+                window.chart_dirty = True
+                window.render_charts()
+                window.chart.canvas.draw()
+
+            render()
+            results[f"chart_{view}"] = timed(render, repeat)
+
+        window.chart_view_combo.setCurrentIndex(0)
+        results["update_labels"] = timed(window.update_labels, repeat)
+
+        def edit_amounts():
+            for i in range(100):
+                window.update_amount(i % len(window.ledger.events), float(i))
+                app.processEvents()
+
+        results["edit_amount_100"] = timed(edit_amounts)
+        results["save_data"] = timed(window.save_data, repeat)
+        results["close"] = timed(window.close)
+        return results
+    finally:
+        os.chdir(cwd)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the finance core and GUI on synthetic ledgers.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="comma-separated event counts")
+    parser.add_argument("--storage", default="journal", choices=("json", "journal", "binary", "sqlite"))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-gui", action="store_true", help="skip the Qt benchmarks")
+    parser.add_argument("--generate", metavar="DIR", help="only write a synthetic ledger of the first size to DIR")
+    parser.add_argument("--output", default="-", help="JSON results file, - for stdout")
+    args = parser.parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    if args.generate:
+        os.makedirs(args.generate, exist_ok=True)
+        generate_ledger(args.generate, sizes[0], args.seed)
+        return 0
+
+    # Picked up by FinanceApp, which opens its ledger with the default mode.
+    os.environ["FINANCE_STORAGE"] = args.storage
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "storage": args.storage,
+        "repeat": args.repeat,
+        "sizes": {},
+    }
+    for size in sizes:
+        directory = tempfile.mkdtemp(prefix=f"finance-bench-{size}-")
+        try:
+            started = time.perf_counter()
+            data_path, _ = generate_ledger(directory, size, args.seed)
+            result = {
+                "generate_seconds": time.perf_counter() - started,
+                "file_bytes": os.path.getsize(data_path),
+                "core": bench_core(directory, args.storage, args.repeat),
+            }
+            if not args.no_gui:
+                generate_ledger(directory, size, args.seed)
+                for name in ("finances.json.journal", "finances.bin", "finances.bin.journal", "finances.db", "finances.db-wal", "finances.db-shm"):
+                    if os.path.exists(os.path.join(directory, name)):
+                        os.remove(os.path.join(directory, name))
+                result["gui"] = bench_gui(directory, args.repeat)
+            report["sizes"][str(size)] = result
+            print(f"{size} events done", file=sys.stderr)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
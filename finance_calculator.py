@@ -1,16 +1,19 @@
 import sys
-import json
+import bisect
 import logging
-import os
-import matplotlib.pyplot as plt
 from PyQt5.QtWidgets import QApplication, QLabel, QPushButton, QVBoxLayout, QWidget, QLineEdit, QHBoxLayout, QMessageBox, QComboBox, QCalendarWidget, QStackedWidget, QTableWidget, QTableWidgetItem
-from PyQt5.QtCore import Qt, QDate
-from PyQt5.QtGui import QFont, QColor
+from PyQt5.QtCore import Qt, QDate, QAbstractTableModel, QModelIndex, QEvent, QTimer, QFileSystemWatcher, pyqtSignal
+from PyQt5.QtGui import QFont, QColor, QKeySequence
+from PyQt5.QtWidgets import QTableView, QStyledItemDelegate, QAbstractItemView, QFileDialog, QProgressDialog, QProgressBar
 from PyQt5.QtWidgets import QSizePolicy
 from PyQt5.QtWidgets import QHeaderView
-from PyQt5.QtWidgets import QDialog
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from PyQt5.QtWidgets import QDialog, QInputDialog, QShortcut
 from functools import partial
+from finance_charts import StatChart
+from finance_fx import currency_symbol
+from finance_ledger import Ledger
+from finance_metrics import metrics
+from finance_search import PAGE_SIZE
 
 logging.basicConfig(
     filename='ravuss_error_log.txt',  # Log will be saved in error_log.txt
@@ -18,8 +21,170 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-DATA_FILE = "finances.json"
-CATEGORY_FILE = "categories.json"
+CHART_VIEWS = ("overview", "monthly_trend", "weekly_trend", "by_category", "running_balance")
+CHART_REFRESH_MS = 50
+SEARCH_DELAY_MS = 200
+MAX_CHART_CATEGORIES = 10
+LOAD_POLL_MS = 100
+SYNC_DELAY_MS = 200
+REPORT_POLL_MS = 100
+REPORT_LEVELS = ("month", "year", "category")
+
+class HistoryModel(QAbstractTableModel):
+    amount_edited = pyqtSignal(int, float)
+    delete_requested = pyqtSignal(int)
+
+    DATE, REASON, AMOUNT, DELETE = range(4)
+
+    def __init__(self, events, getString, currency_of, parent=None):
+        super().__init__(parent)
+        self.events = events
+        self.currency_of = currency_of
+        # Event positions shown when a search is active, None for all events.
+        self.rows = None
+        self.getString = getString
+        self.headers = [getString('date'), getString('reason'), getString('amount'), getString('delete')]
+
+    def set_events(self, events):
+        self.beginResetModel()
+        self.events = events
+        self.endResetModel()
+
+    def set_rows(self, rows):
+        self.beginResetModel()
+        self.rows = rows
+        self.endResetModel()
+
+    def event_index(self, row):
+        return row if self.rows is None else self.rows[row]
+
+    def model_row(self, idx):
+        if self.rows is None:
+            return idx
+        row = bisect.bisect_left(self.rows, idx)
+        return row if row < len(self.rows) and self.rows[row] == idx else None
+
+    # While a search is active, structural changes are followed by a fresh
+    # query instead of row-by-row notifications.
+    def begin_insert_events(self, first, last):
+        if self.rows is None:
+            self.beginInsertRows(QModelIndex(), first, last)
+
+    def end_insert_events(self):
+        if self.rows is None:
+            self.endInsertRows()
+
+    def begin_remove_event(self, idx):
+        if self.rows is None:
+            self.beginRemoveRows(QModelIndex(), idx, idx)
+
+    def end_remove_event(self):
+        if self.rows is None:
+            self.endRemoveRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.events) if self.rows is None else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
+
+    def flags(self, index):
+        flags = super().flags(index)
+        if index.column() == self.AMOUNT:
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        event = self.events[self.event_index(index.row())]
+        column = index.column()
+
+        if role == Qt.DisplayRole:
+            if column == self.DATE:
+                return event["date"]
+            if column == self.REASON:
+                return event["reason"]
+            if column == self.AMOUNT:
+                return f"{event['amount']} {currency_symbol(self.currency_of(event))}"
+            if column == self.DELETE:
+                return self.getString('delete')
+        elif role == Qt.EditRole and column == self.AMOUNT:
+            return str(event["amount"])
+        elif role == Qt.ForegroundRole and column == self.AMOUNT:
+            if event["type"] == "expense":
+                return QColor("red")
+            if event["type"] == "income":
+                return QColor("#388E3C")
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.EditRole or index.column() != self.AMOUNT:
+            return False
+        event = self.events[self.event_index(index.row())]
+        try:
+            amount = float(str(value).replace(currency_symbol(self.currency_of(event)), "").strip())
+        except ValueError:
+            return False
+        self.amount_edited.emit(self.event_index(index.row()), amount)
+        return True
+
+    def row_changed(self, idx):
+        row = self.model_row(idx)
+        if row is None:
+            return
+        self.dataChanged.emit(self.index(row, 0), self.index(row, self.columnCount() - 1))
+
+
+class AmountDelegate(QStyledItemDelegate):
+    def createEditor(self, parent, option, index):
+        editor = QLineEdit(parent)
+        editor.setStyleSheet("padding: 5px; border: 1px solid #ccc; border-radius: 5px;")
+        # Keep the old live behaviour: totals follow the amount while it is typed.
+        editor.textChanged.connect(lambda text: self.commitData.emit(editor))
+        return editor
+
+    def setEditorData(self, editor, index):
+        value = index.data(Qt.EditRole)
+        # Live commits echo back through dataChanged; don't clobber the text being typed.
+        try:
+            if float(editor.text()) == float(value):
+                return
+        except ValueError:
+            pass
+        editor.setText(value)
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.text(), Qt.EditRole)
+
+
+class DeleteButtonDelegate(QStyledItemDelegate):
+    def paint(self, painter, option, index):
+        painter.save()
+        painter.setRenderHint(painter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor("#F44336"))
+        painter.drawRoundedRect(option.rect.adjusted(2, 2, -2, -2), 5, 5)
+        font = QFont(option.font)
+        font.setBold(True)
+        painter.setFont(font)
+        painter.setPen(QColor("white"))
+        painter.drawText(option.rect, Qt.AlignCenter, index.data())
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton:
+            model.delete_requested.emit(model.event_index(index.row()))
+            return True
+        return False
+
 
 class FinanceApp(QWidget):
     def __init__(self):
@@ -27,11 +192,10 @@ class FinanceApp(QWidget):
         self.setWindowTitle("Simple Personal Finance Manager")
         self.setGeometry(300, 300, 800, 600)
 
-        self.finances = {"income": 0, "expenses": 0, "events": []}
-        self.categories = []
+        self.ledger = Ledger.open(load=False)
+        self.history_page = 0
 
         self.strings = {
-            "currency": "$",
             "statistics": "Statistics",
             "add_income_expenses": "Add income/expenses",
             "chronology": "Chronology",
@@ -60,17 +224,90 @@ class FinanceApp(QWidget):
             "expense_added": "Expense added!",
             "error": "Error",
             "success": "Success",
-            "save_changes": "Save changes"
+            "save_changes": "Save changes",
+            "import_statement": "Import statement",
+            "statement_files": "Bank statements (*.csv *.ofx *.qfx)",
+            "importing": "Importing...",
+            "cancel": "Cancel",
+            "imported": "Imported",
+            "rejected": "Rejected",
+            "overview": "Overview",
+            "monthly_trend": "Monthly trend",
+            "weekly_trend": "Weekly trend",
+            "by_category": "By category",
+            "running_balance": "Running balance",
+            "all_categories": "All categories",
+            "balance": "Balance",
+            "search": "Search reason",
+            "all_types": "All types",
+            "from_date": "From (dd.MM.yyyy)",
+            "to_date": "To (dd.MM.yyyy)",
+            "min_amount": "Min amount",
+            "max_amount": "Max amount",
+            "previous": "Previous",
+            "next": "Next",
+            "page": "Page",
+            "results": "results",
+            "rename_category": "Rename category",
+            "diagnostics": "Diagnostics",
+            "metric": "Metric",
+            "count": "Count",
+            "mean_ms": "Mean (ms)",
+            "p50_ms": "p50 (ms)",
+            "p95_ms": "p95 (ms)",
+            "max_ms": "Max (ms)",
+            "gauge": "Gauge",
+            "value": "Value",
+            "refresh": "Refresh",
+            "reset": "Reset",
+            "export_metrics": "Export JSON",
+            "start_profile": "Start profiling",
+            "stop_profile": "Stop profiling",
+            "memory_snapshot": "Memory snapshot",
+            "json_files": "JSON files (*.json)",
+            "profile_files": "Profile stats (*.prof)",
+            "snapshot_files": "tracemalloc snapshots (*.tracemalloc)",
+            "saved_to": "Saved to",
+            "year_end_report": "Year-end report",
+            "report_level": "Report",
+            "month_report": "By month and category",
+            "year_report": "By year",
+            "category_report": "By year and category",
+            "report_files": "CSV files (*.csv);;JSON files (*.json)",
+            "building_report": "Building report...",
+            "rows_written": "rows written to",
+            "repeat": "Repeat",
+            "once": "Once",
+            "daily": "Daily",
+            "weekly": "Weekly",
+            "monthly": "Monthly",
+            "end_date": "End date (dd.MM.yyyy, optional)",
+            "recurring_added": "Recurring transaction added!",
+            "monthly_budget": "Monthly budget",
+            "budgets": "Budgets this month",
+            "over_budget": "over budget",
+            "account": "Account",
+            "all_accounts": "All accounts",
+            "add_account": "Add account",
+            "account_name": "Account name",
+            "currency": "Currency (ISO code, e.g. EUR)",
+            "reporting_currency": "Show totals in",
+            "no_rate": "No exchange rate for",
+            "delete_selected": "Delete selected",
+            "change_category": "Change category",
+            "shift_dates": "Shift dates",
+            "days": "Days (negative moves back)",
+            "undo": "Undo",
+            "redo": "Redo"
         }
 
 
         
 
-        self.load_categories()
-        self.load_data()
         self.reason_combo = QComboBox()
 
         self.init_ui()
+        self.start_loading()
 
     def init_ui(self):
 
@@ -98,12 +335,100 @@ class FinanceApp(QWidget):
         self.stacked_widget.addWidget(self.history_screen)
         self.stacked_widget.addWidget(self.categories_screen) 
 
+        if metrics.enabled:
+            self.diagnostics_screen = QWidget()
+            self.create_diagnostics_screen()
+            self.stacked_widget.addWidget(self.diagnostics_screen)
+
+        self.load_progress = QProgressBar()
+        self.load_progress.setRange(0, 100)
+        self.load_progress.hide()
+
         layout.addLayout(self.button_layout)
+        layout.addWidget(self.load_progress)
         layout.addWidget(self.stacked_widget)
 
         self.setLayout(layout)
         self.setStyleSheet("background-color: #f4f4f4;")
 
+    def start_loading(self):
+        # The window comes up straight away and the records follow once the
+        # worker thread has read them; until then nothing can be edited.
+        self.ledger.load_in_background()
+        self.set_editable(False)
+        self.load_progress.setValue(0)
+        self.load_progress.show()
+        self.load_timer = QTimer(self)
+        self.load_timer.setInterval(LOAD_POLL_MS)
+        self.load_timer.timeout.connect(self.poll_loading)
+        self.load_timer.start()
+        # Changes another window (or a sync tool) saves to the same files
+        # are merged in shortly after, by event id; the paths are watched
+        # once the records are loaded.
+        self.watcher = QFileSystemWatcher(self)
+        self.sync_timer = QTimer(self)
+        self.sync_timer.setSingleShot(True)
+        self.sync_timer.setInterval(SYNC_DELAY_MS)
+        self.sync_timer.timeout.connect(self.sync_external)
+        self.watcher.fileChanged.connect(lambda path: self.sync_timer.start())
+
+    def poll_loading(self):
+        task = self.ledger.load_task
+        if task is None:
+            return
+        self.load_progress.setValue(int(task.fraction * 100))
+        if not task.done:
+            return
+        self.load_timer.stop()
+        self.load_progress.hide()
+        try:
+            self.ledger.finish_load()
+        except (OSError, ValueError) as e:
+            # Stay read-only, so the unreadable file is never overwritten.
+            logging.error(f"Loading finances failed: {e}")
+            self.show_error(str(e))
+            return
+        self.set_editable(True)
+        self.history_model.set_events(self.ledger.events)
+        self.search_history(self.history_page)
+        self.load_recurring_table()
+        self.load_accounts()
+        self.update_labels()
+        self.watch_files()
+
+    def watch_files(self):
+        # The watcher drops files that were replaced, so this runs again
+        # after every sync.
+        missing = set(self.ledger.storage.watch_paths()) - set(self.watcher.files())
+        if missing:
+            self.watcher.addPaths(sorted(missing))
+
+    def sync_external(self):
+        try:
+            changed = self.ledger.sync_external()
+        except (OSError, ValueError) as e:
+            logging.error(f"Merging outside changes failed: {e}")
+            return
+        if changed is None:
+            # Busy, or still reading the files; try again shortly.
+            self.sync_timer.start()
+            return
+        self.watch_files()
+        if changed:
+            self.load_history()
+            self.load_recurring_table()
+            self.load_accounts()
+
+    def wait_for_load(self):
+        if self.ledger.load_task is not None:
+            self.ledger.load_task.wait()
+            self.poll_loading()
+
+    def set_editable(self, enabled):
+        self.input_screen.setEnabled(enabled)
+        self.categories_screen.setEnabled(enabled)
+        self.history_table.setEnabled(enabled)
+
     def getString(self, key):
         return self.strings.get(key, f"Translation not found for {key}")
 
@@ -129,6 +454,13 @@ class FinanceApp(QWidget):
         self.button_layout.addWidget(history_button)
         self.button_layout.addWidget(categories_button)
 
+        # Only offered when started with FINANCE_METRICS=1.
+        if metrics.enabled:
+            diagnostics_button = QPushButton(self.getString("diagnostics"))
+            diagnostics_button.setStyleSheet("font-size: 16px; padding: 10px 20px; background-color: #607D8B; color: white; border: none; border-radius: 5px;")
+            diagnostics_button.clicked.connect(self.show_diagnostics_screen)
+            self.button_layout.addWidget(diagnostics_button)
+
     def create_categories_screen(self):
         categories_layout = QVBoxLayout()
 
@@ -137,11 +469,12 @@ class FinanceApp(QWidget):
         categories_layout.addWidget(title_label)
 
         self.categories_table = QTableWidget()
-        self.categories_table.setColumnCount(3)
-        self.categories_table.setHorizontalHeaderLabels([(self.getString("category")), (self.getString("type")), (self.getString("action"))])
+        self.categories_table.setColumnCount(4)
+        self.categories_table.setHorizontalHeaderLabels([(self.getString("category")), (self.getString("type")), (self.getString("monthly_budget")), (self.getString("action"))])
         self.categories_table.setEditTriggers(QTableWidget.NoEditTriggers) 
 
         self.categories_table.horizontalHeader().setStretchLastSection(True)
+        self.categories_table.cellDoubleClicked.connect(self.rename_category)
 
         categories_layout.addWidget(self.categories_table)
 
@@ -176,110 +509,360 @@ class FinanceApp(QWidget):
         layout.addWidget(add_button)
 
         category_dialog.setLayout(layout)
-        self.load_categories()
+        self.ledger.refresh_categories()
         category_dialog.exec_()
 
-    def load_categories(self):
-
-        try:
-            if not os.path.exists("categories.json"):
-                raise FileNotFoundError("categories.json file not found. Creating a new one.")
-            
-            with open("categories.json", "r", encoding="utf-8") as f:
-                self.categories = json.load(f)
-        except FileNotFoundError:
-            logging.error("categories.json file not found. Creating a new one.")
-            self.categories = []
-            self.save_categories() 
-        except json.JSONDecodeError as e:
-            logging.error("Error loading JSON")
-            self.categories = []  
-
     def load_categories_into_table(self):
         self.categories_table.setRowCount(0)
 
         # if not self.categories:
         #     self.show_error("No category data") 
 
-        for row, category in enumerate(self.categories):
+        for row, category in enumerate(self.ledger.categories):
             name_item = QTableWidgetItem(category["name"])
             type_item = QTableWidgetItem(category["type"])
 
             self.categories_table.setItem(row, 0, name_item)
             self.categories_table.setItem(row, 1, type_item)
+            self.categories_table.setItem(row, 2, QTableWidgetItem(self.budget_text(category)))
 
             delete_button = QPushButton(self.getString("delete"))
             delete_button.clicked.connect(partial(self.delete_category, row))
             self.update_categories_table()
-            self.categories_table.setCellWidget(row, 2, delete_button)
+            self.categories_table.setCellWidget(row, 3, delete_button)
 
     def update_categories_table(self):
         self.categories_table.setRowCount(0)
 
-        for category in self.categories:
+        for category in self.ledger.categories:
             row_position = self.categories_table.rowCount()
             self.categories_table.insertRow(row_position)
 
             self.categories_table.setItem(row_position, 0, QTableWidgetItem(category["name"]))
             self.categories_table.setItem(row_position, 1, QTableWidgetItem(category["type"]))
+            self.categories_table.setItem(row_position, 2, QTableWidgetItem(self.budget_text(category)))
 
             delete_button = QPushButton(self.getString("delete"))
             delete_button.clicked.connect(lambda checked, row=row_position: self.delete_category(row))
-            self.categories_table.setCellWidget(row_position, 2, delete_button)
+            self.categories_table.setCellWidget(row_position, 3, delete_button)
 
+    def budget_text(self, category):
+        budget = self.ledger.budgets.get(str(category["id"]))
+        return f"{budget:.2f}" if budget else ""
 
-    def save_categories(self):
-        with open(CATEGORY_FILE, "w", encoding="utf-8") as file:
-            json.dump(self.categories, file, ensure_ascii=False, indent=4)
 
     def delete_category(self, row):
-        del self.categories[row]
-        self.save_categories()
+        self.ledger.delete_category(row)
         self.load_categories_into_table()
 
+    def rename_category(self, row, column):
+        if column == 2:
+            self.edit_budget(row)
+            return
+        if column != 0:
+            return
+        category = self.ledger.categories[row]
+        name, ok = QInputDialog.getText(self, self.getString("rename_category"), self.getString("category_name") + ":", text=category["name"])
+        name = name.strip()
+        if not ok or not name or name == category["name"]:
+            return
+        self.ledger.rename_category(category["id"], name)
+        self.update_categories_table()
+        self.history_model.set_events(self.ledger.events)
+        self.update_labels()
+
+    def edit_budget(self, row):
+        category = self.ledger.categories[row]
+        budget = self.ledger.budgets.get(str(category["id"]), 0)
+        amount, ok = QInputDialog.getDouble(self, self.getString("monthly_budget"), category["name"] + ":", budget, 0, 1e12, 2)
+        if not ok:
+            return
+        self.ledger.set_budget(category["id"], amount)
+        self.update_categories_table()
+        self.update_labels()
+
     def save_category(self, category_dialog, category_name_input, category_type_combo):
         category_name = category_name_input.text()
         category_type = category_type_combo.currentText()
 
-        self.categories.append({"name": category_name, "type": category_type})
-
-        self.save_categories()
+        self.ledger.add_category(category_name, category_type)
 
         self.update_categories_table()
         category_dialog.accept()
 
+    def create_diagnostics_screen(self):
+        diagnostics_layout = QVBoxLayout()
+
+        title_label = QLabel(self.getString("diagnostics"))
+        title_label.setFont(QFont("Arial", 18))
+        diagnostics_layout.addWidget(title_label)
+
+        self.timings_table = QTableWidget()
+        self.timings_table.setColumnCount(6)
+        self.timings_table.setHorizontalHeaderLabels([self.getString(key) for key in ("metric", "count", "mean_ms", "p50_ms", "p95_ms", "max_ms")])
+        self.timings_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.timings_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        diagnostics_layout.addWidget(self.timings_table)
+
+        self.gauges_table = QTableWidget()
+        self.gauges_table.setColumnCount(2)
+        self.gauges_table.setHorizontalHeaderLabels([self.getString("gauge"), self.getString("value")])
+        self.gauges_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.gauges_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        diagnostics_layout.addWidget(self.gauges_table)
+
+        buttons_layout = QHBoxLayout()
+        refresh_button = QPushButton(self.getString("refresh"))
+        refresh_button.clicked.connect(self.load_diagnostics)
+        reset_button = QPushButton(self.getString("reset"))
+        reset_button.clicked.connect(self.reset_diagnostics)
+        export_button = QPushButton(self.getString("export_metrics"))
+        export_button.clicked.connect(self.export_diagnostics)
+        self.profile_button = QPushButton(self.getString("start_profile"))
+        self.profile_button.clicked.connect(self.toggle_profile)
+        memory_button = QPushButton(self.getString("memory_snapshot"))
+        memory_button.clicked.connect(self.dump_memory_snapshot)
+        for button in (refresh_button, reset_button, export_button, self.profile_button, memory_button):
+            buttons_layout.addWidget(button)
+        diagnostics_layout.addLayout(buttons_layout)
+
+        self.diagnostics_screen.setLayout(diagnostics_layout)
+
+    def load_diagnostics(self):
+        self.ledger.update_gauges()
+        metrics.gauge("history_rows", self.history_model.rowCount())
+        snapshot = metrics.snapshot()
+
+        self.timings_table.setRowCount(len(snapshot["timings"]))
+        for row, (name, timing) in enumerate(snapshot["timings"].items()):
+            values = [name, str(timing["count"])] + [f"{timing[key]:.2f}" for key in ("mean_ms", "p50_ms", "p95_ms", "max_ms")]
+            for column, value in enumerate(values):
+                self.timings_table.setItem(row, column, QTableWidgetItem(value))
+
+        self.gauges_table.setRowCount(len(snapshot["gauges"]))
+        for row, (name, value) in enumerate(snapshot["gauges"].items()):
+            self.gauges_table.setItem(row, 0, QTableWidgetItem(name))
+            self.gauges_table.setItem(row, 1, QTableWidgetItem(str(value)))
+
+    def reset_diagnostics(self):
+        metrics.reset()
+        self.load_diagnostics()
+
+    def export_diagnostics(self):
+        path, _ = QFileDialog.getSaveFileName(self, self.getString('export_metrics'), "finance-metrics.json", self.getString('json_files'))
+        if not path:
+            return
+        self.load_diagnostics()
+        try:
+            metrics.export(path)
+        except OSError as e:
+            logging.error(f"Metrics export to {path} failed: {e}")
+            self.show_error(str(e))
+            return
+        self.show_success(f"{self.getString('saved_to')} {path}")
+
+    def toggle_profile(self):
+        if metrics.profiler is None:
+            metrics.start_profile()
+            self.profile_button.setText(self.getString("stop_profile"))
+            return
+        path, _ = QFileDialog.getSaveFileName(self, self.getString('stop_profile'), "finance.prof", self.getString('profile_files'))
+        if not path:
+            return
+        try:
+            metrics.stop_profile(path)
+        except OSError as e:
+            logging.error(f"Profile dump to {path} failed: {e}")
+            self.show_error(str(e))
+            return
+        self.profile_button.setText(self.getString("start_profile"))
+        self.show_success(f"{self.getString('saved_to')} {path}")
+
+    def dump_memory_snapshot(self):
+        path, _ = QFileDialog.getSaveFileName(self, self.getString('memory_snapshot'), "finance.tracemalloc", self.getString('snapshot_files'))
+        if not path:
+            return
+        try:
+            metrics.dump_tracemalloc(path)
+        except (OSError, RuntimeError) as e:
+            logging.error(f"Memory snapshot to {path} failed: {e}")
+            self.show_error(str(e))
+            return
+        self.show_success(f"{self.getString('saved_to')} {path}")
+
     def create_stat_screen(self):
         stat_layout = QVBoxLayout()
 
-        self.income_label = QLabel(f"{self.getString('income')}: {self.finances['income']} {self.getString('currency')}")
+        account_layout = QHBoxLayout()
+        self.account_filter = QComboBox()
+        self.account_filter.currentIndexChanged.connect(lambda: self.update_labels())
+        self.reporting_combo = QComboBox()
+        self.reporting_combo.currentIndexChanged.connect(self.change_reporting_currency)
+        account_layout.addWidget(self.account_filter)
+        account_layout.addWidget(QLabel(self.getString('reporting_currency') + ":"))
+        account_layout.addWidget(self.reporting_combo)
+        for widget in (self.account_filter, self.reporting_combo):
+            widget.setStyleSheet("padding: 5px; border: 1px solid #ccc; border-radius: 5px;")
+        stat_layout.addLayout(account_layout)
+
+        self.income_label = QLabel()
         self.income_label.setFont(QFont("Arial", 14))
         stat_layout.addWidget(self.income_label)
 
-        self.expenses_label = QLabel(f"{self.getString('expenses')}: {self.finances['expenses']} {self.getString('currency')}")
+        self.expenses_label = QLabel()
         self.expenses_label.setFont(QFont("Arial", 14))
         stat_layout.addWidget(self.expenses_label)
 
-        self.balance_label = QLabel(f"{self.getString('total_balance')}: {self.finances['income'] - self.finances['expenses']} {self.getString('currency')}")
+        self.balance_label = QLabel()
         self.balance_label.setFont(QFont("Arial", 14))
         stat_layout.addWidget(self.balance_label)
 
-        self.canvas = FigureCanvas(plt.figure(figsize=(6, 4)))
-        stat_layout.addWidget(self.canvas)
-        self.plot_charts() 
+        self.rate_label = QLabel()
+        self.rate_label.setStyleSheet("color: #F44336;")
+        self.rate_label.hide()
+        stat_layout.addWidget(self.rate_label)
+
+        self.budget_label = QLabel()
+        self.budget_label.setFont(QFont("Arial", 12))
+        self.budget_label.setWordWrap(True)
+        stat_layout.addWidget(self.budget_label)
+
+        view_layout = QHBoxLayout()
+        self.chart_view_combo = QComboBox()
+        for view in CHART_VIEWS:
+            self.chart_view_combo.addItem(self.getString(view), view)
+        self.chart_view_combo.setStyleSheet("padding: 5px; border: 1px solid #ccc; border-radius: 5px;")
+        self.chart_view_combo.currentIndexChanged.connect(self.plot_charts)
+        view_layout.addWidget(self.chart_view_combo)
+
+        self.chart_category_combo = QComboBox()
+        self.chart_category_combo.setStyleSheet("padding: 5px; border: 1px solid #ccc; border-radius: 5px;")
+        self.load_chart_categories()
+        self.chart_category_combo.currentIndexChanged.connect(self.plot_charts)
+        view_layout.addWidget(self.chart_category_combo)
+        stat_layout.addLayout(view_layout)
+
+        report_button = QPushButton(self.getString('year_end_report'))
+        report_button.setStyleSheet("background-color: #2196F3; color: white; font-weight: bold; padding: 10px 20px; border-radius: 5px;")
+        report_button.clicked.connect(self.export_report)
+        stat_layout.addWidget(report_button)
+        self.report_job = None
+
+        # The chart (and matplotlib) is created on the first render, once
+        # the Statistics screen is actually on screen.
+        self.chart = None
+        self.chart_dirty = True
+        self.chart_timer = QTimer(self)
+        self.chart_timer.setSingleShot(True)
+        self.chart_timer.setInterval(CHART_REFRESH_MS)
+        self.chart_timer.timeout.connect(self.render_charts)
+        self.load_accounts()
+        self.update_labels()
 
+        self.stat_layout = stat_layout
         self.stat_screen.setLayout(stat_layout)
 
+    def export_report(self):
+        if self.report_job is not None:
+            return
+        labels = [self.getString(f"{level}_report") for level in REPORT_LEVELS]
+        label, ok = QInputDialog.getItem(self, self.getString('year_end_report'), self.getString('report_level'), labels, 0, False)
+        if not ok:
+            return
+        path, selected_filter = QFileDialog.getSaveFileName(self, self.getString('year_end_report'), "", self.getString('report_files'))
+        if not path:
+            return
+        fmt = "json" if path.endswith(".json") or "json" in selected_filter.lower() else "csv"
+        self.report_job = self.ledger.start_report(path, REPORT_LEVELS[labels.index(label)], fmt)
+
+        # Not modal: the report runs in the background and the window stays usable.
+        self.report_progress = QProgressDialog(self.getString('building_report'), self.getString('cancel'), 0, 100, self)
+        self.report_progress.canceled.connect(self.report_job.cancel)
+        self.report_progress.show()
+        self.report_timer = QTimer(self)
+        self.report_timer.setInterval(REPORT_POLL_MS)
+        self.report_timer.timeout.connect(self.poll_report)
+        self.report_timer.start()
+
+    def poll_report(self):
+        job = self.report_job
+        if not job.done:
+            self.report_progress.setValue(int(job.fraction * 100))
+            return
+        self.report_timer.stop()
+        # Read before closing: closing the dialog emits canceled too.
+        cancelled = job.cancelled.is_set()
+        self.report_progress.close()
+        self.report_job = None
+        if job.error is not None:
+            logging.error(f"Report {job.path} failed: {job.error}")
+            self.show_error(str(job.error))
+        elif not cancelled:
+            self.show_success(f"{job.rows_written} {self.getString('rows_written')} {job.path}")
+
+    def load_chart_categories(self):
+        selected = self.chart_category_combo.currentData()
+        self.chart_category_combo.blockSignals(True)
+        self.chart_category_combo.clear()
+        self.chart_category_combo.addItem(self.getString('all_categories'), None)
+        for category in self.ledger.categories:
+            self.chart_category_combo.addItem(category["name"], category["name"])
+        index = self.chart_category_combo.findData(selected)
+        self.chart_category_combo.setCurrentIndex(max(index, 0))
+        self.chart_category_combo.blockSignals(False)
+
+    def load_accounts(self):
+        # The account pickers on the Statistics and Add screens, and the
+        # currencies that have rates.
+        selected = self.account_filter.currentData()
+        self.account_filter.blockSignals(True)
+        self.account_filter.clear()
+        self.account_filter.addItem(self.getString('all_accounts'), None)
+        for account in self.ledger.accounts:
+            self.account_filter.addItem(f"{account['name']} ({account['currency']})", account["name"])
+        self.account_filter.setCurrentIndex(max(self.account_filter.findData(selected), 0))
+        self.account_filter.blockSignals(False)
+
+        self.reporting_combo.blockSignals(True)
+        self.reporting_combo.clear()
+        for currency in self.ledger.currencies():
+            self.reporting_combo.addItem(currency, currency)
+        self.reporting_combo.setCurrentIndex(max(self.reporting_combo.findData(self.ledger.reporting_currency), 0))
+        self.reporting_combo.blockSignals(False)
+
+        if hasattr(self, "account_combo"):
+            selected = self.account_combo.currentData()
+            self.account_combo.clear()
+            for account in self.ledger.accounts:
+                self.account_combo.addItem(f"{account['name']} ({account['currency']})", account["name"])
+            self.account_combo.setCurrentIndex(max(self.account_combo.findData(selected), 0))
+
+    def change_reporting_currency(self):
+        currency = self.reporting_combo.currentData()
+        if currency is None or currency == self.ledger.reporting_currency:
+            return
+        self.ledger.set_reporting_currency(currency)
+        self.update_labels()
+
+    def add_account(self):
+        name, ok = QInputDialog.getText(self, self.getString('add_account'), self.getString('account_name') + ":")
+        if not ok or not name.strip():
+            return
+        currency, ok = QInputDialog.getText(self, self.getString('add_account'), self.getString('currency') + ":", text=self.ledger.reporting_currency)
+        if not ok:
+            return
+        try:
+            account = self.ledger.add_account(name, currency)
+        except ValueError as e:
+            self.show_error(str(e))
+            return
+        self.load_accounts()
+        self.account_combo.setCurrentIndex(self.account_combo.findData(account["name"]))
+
     def load_categories_adding(self):
         self.reason_combo.clear()
-        try:
-            with open('categories.json', 'r', encoding='utf-8') as file:
-                categories = json.load(file)
-                for category in categories:
-                    self.reason_combo.addItem(category["name"])
-        except FileNotFoundError:
-            logging.error("Categories file not found.")
-        except json.JSONDecodeError:
-            logging.error("Error reading the categories file.")
+        for category in self.ledger.refresh_categories():
+            self.reason_combo.addItem(category["name"])
 
     def create_input_screen(self):
         input_layout = QVBoxLayout()
@@ -293,6 +876,16 @@ class FinanceApp(QWidget):
         self.reason_combo.setStyleSheet("padding: 5px; border: 1px solid #ccc; border-radius: 5px;")
         input_layout.addWidget(self.reason_combo)
 
+        account_layout = QHBoxLayout()
+        self.account_combo = QComboBox()
+        self.account_combo.setStyleSheet("padding: 5px; border: 1px solid #ccc; border-radius: 5px;")
+        account_layout.addWidget(self.account_combo)
+        add_account_button = QPushButton(self.getString('add_account'))
+        add_account_button.clicked.connect(self.add_account)
+        account_layout.addWidget(add_account_button)
+        input_layout.addLayout(account_layout)
+        self.load_accounts()
+
         self.calendar = QCalendarWidget(self)
         self.calendar.setGridVisible(True)
         self.calendar.setStyleSheet("""
@@ -311,52 +904,303 @@ class FinanceApp(QWidget):
         """)
         input_layout.addWidget(self.calendar)
 
+        repeat_layout = QHBoxLayout()
+        self.repeat_combo = QComboBox()
+        self.repeat_combo.addItem(self.getString('once'), None)
+        for frequency in ("daily", "weekly", "monthly"):
+            self.repeat_combo.addItem(self.getString(frequency), frequency)
+        self.end_date_input = QLineEdit()
+        self.end_date_input.setPlaceholderText(self.getString('end_date'))
+        for widget in (self.repeat_combo, self.end_date_input):
+            widget.setStyleSheet("padding: 5px; border: 1px solid #ccc; border-radius: 5px;")
+            repeat_layout.addWidget(widget)
+        input_layout.addLayout(repeat_layout)
+
         self.add_button = QPushButton(self.getString('add'))
         self.add_button.setStyleSheet("background-color: #388E3C; color: white; font-weight: bold; padding: 10px 20px; border-radius: 5px;")
         self.add_button.clicked.connect(self.add_income_or_expense)
         input_layout.addWidget(self.add_button)
 
+        import_button = QPushButton(self.getString('import_statement'))
+        import_button.setStyleSheet("background-color: #2196F3; color: white; font-weight: bold; padding: 10px 20px; border-radius: 5px;")
+        import_button.clicked.connect(self.import_statement)
+        input_layout.addWidget(import_button)
+
         exit_button = QPushButton(self.getString('exit'))
         exit_button.setStyleSheet("background-color: #FF9800; color: white; font-weight: bold; padding: 10px 20px; border-radius: 5px;")
         exit_button.clicked.connect(self.close)
         input_layout.addWidget(exit_button)
 
+        self.recurring_table = QTableWidget()
+        self.recurring_table.setColumnCount(5)
+        self.recurring_table.setHorizontalHeaderLabels([self.getString(key) for key in ("category", "amount", "repeat", "next", "action")])
+        self.recurring_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.recurring_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        input_layout.addWidget(self.recurring_table)
+        self.load_recurring_table()
+
         self.input_screen.setLayout(input_layout)
 
     def create_history_screen(self):
         history_layout = QVBoxLayout()
 
-        self.history_table = QTableWidget()
-        self.history_table.setColumnCount(4)
-        self.history_table.setHorizontalHeaderLabels([self.getString('date'), self.getString('reason'), self.getString('amount'), self.getString('delete')])
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY_MS)
+        self.search_timer.timeout.connect(lambda: self.search_history(0))
+
+        filter_layout = QHBoxLayout()
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText(self.getString('search'))
+        self.type_filter = QComboBox()
+        self.type_filter.addItem(self.getString('all_types'), None)
+        self.type_filter.addItem(self.getString('income'), "income")
+        self.type_filter.addItem(self.getString('expense'), "expense")
+        self.category_filter = QComboBox()
+        self.load_history_categories()
+        self.from_date_input = QLineEdit()
+        self.from_date_input.setPlaceholderText(self.getString('from_date'))
+        self.to_date_input = QLineEdit()
+        self.to_date_input.setPlaceholderText(self.getString('to_date'))
+        self.min_amount_input = QLineEdit()
+        self.min_amount_input.setPlaceholderText(self.getString('min_amount'))
+        self.max_amount_input = QLineEdit()
+        self.max_amount_input.setPlaceholderText(self.getString('max_amount'))
+        for line_edit in (self.search_input, self.from_date_input, self.to_date_input, self.min_amount_input, self.max_amount_input):
+            line_edit.setStyleSheet("padding: 5px; border: 1px solid #ccc; border-radius: 5px;")
+            line_edit.textChanged.connect(lambda text: self.search_timer.start())
+            filter_layout.addWidget(line_edit)
+        for combo in (self.type_filter, self.category_filter):
+            combo.setStyleSheet("padding: 5px; border: 1px solid #ccc; border-radius: 5px;")
+            combo.currentIndexChanged.connect(lambda index: self.search_timer.start())
+            filter_layout.addWidget(combo)
+        history_layout.addLayout(filter_layout)
+
+        self.history_model = HistoryModel(self.ledger.events, self.getString, self.ledger.currency_of, self)
+        self.history_model.amount_edited.connect(self.update_amount)
+        self.history_model.delete_requested.connect(self.delete_event)
+
+        self.history_table = QTableView()
+        self.history_table.setModel(self.history_model)
+        self.history_table.setItemDelegateForColumn(HistoryModel.AMOUNT, AmountDelegate(self.history_table))
+        self.history_table.setItemDelegateForColumn(HistoryModel.DELETE, DeleteButtonDelegate(self.history_table))
+        self.history_table.setEditTriggers(QAbstractItemView.AllEditTriggers)
+        self.history_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.history_table.setSelectionMode(QAbstractItemView.ExtendedSelection)
 
         self.history_table.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
-        
+
+        # Fixed row heights and sampled column widths keep layout cost
+        # independent of the number of events.
+        self.history_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         header = self.history_table.horizontalHeader()
+        header.setResizeContentsPrecision(100)
         header.setSectionResizeMode(0, QHeaderView.ResizeToContents)
         header.setSectionResizeMode(1, QHeaderView.Stretch)
         header.setSectionResizeMode(2, QHeaderView.Stretch)
         header.setSectionResizeMode(3, QHeaderView.ResizeToContents)
 
         history_layout.addWidget(self.history_table)
+
+        batch_layout = QHBoxLayout()
+        delete_selected_button = QPushButton(self.getString('delete_selected'))
+        delete_selected_button.clicked.connect(self.delete_selected)
+        category_button = QPushButton(self.getString('change_category'))
+        category_button.clicked.connect(self.recategorize_selected)
+        shift_button = QPushButton(self.getString('shift_dates'))
+        shift_button.clicked.connect(self.shift_selected)
+        self.undo_button = QPushButton(self.getString('undo'))
+        self.undo_button.clicked.connect(self.undo)
+        self.redo_button = QPushButton(self.getString('redo'))
+        self.redo_button.clicked.connect(self.redo)
+        for button in (delete_selected_button, category_button, shift_button, self.undo_button, self.redo_button):
+            batch_layout.addWidget(button)
+        history_layout.addLayout(batch_layout)
+        QShortcut(QKeySequence.Undo, self, self.undo)
+        QShortcut(QKeySequence.Redo, self, self.redo)
+        self.update_undo_buttons()
+
+        page_layout = QHBoxLayout()
+        self.previous_page_button = QPushButton(self.getString('previous'))
+        self.previous_page_button.clicked.connect(lambda: self.search_history(self.history_page - 1))
+        self.page_label = QLabel()
+        self.page_label.setAlignment(Qt.AlignCenter)
+        self.next_page_button = QPushButton(self.getString('next'))
+        self.next_page_button.clicked.connect(lambda: self.search_history(self.history_page + 1))
+        page_layout.addWidget(self.previous_page_button)
+        page_layout.addWidget(self.page_label)
+        page_layout.addWidget(self.next_page_button)
+        history_layout.addLayout(page_layout)
         
         self.history_screen.setLayout(history_layout)
 
+    def selected_ids(self):
+        rows = sorted({index.row() for index in self.history_table.selectionModel().selectedRows()})
+        return self.ledger.event_ids(self.history_model.event_index(row) for row in rows)
+
+    # Each batch is one change in the ledger, so one write and one refresh
+    # here however many rows were selected.
+    def delete_selected(self):
+        ids = self.selected_ids()
+        if ids:
+            self.ledger.delete_events(ids)
+            self.after_batch()
+
+    def recategorize_selected(self):
+        ids = self.selected_ids()
+        if not ids:
+            return
+        names = [category["name"] for category in self.ledger.categories if not category.get("deleted")]
+        name, ok = QInputDialog.getItem(self, self.getString('change_category'), self.getString('category') + ":", names, 0, False)
+        if not ok:
+            return
+        self.ledger.recategorize(ids, name)
+        self.after_batch()
+
+    def shift_selected(self):
+        ids = self.selected_ids()
+        if not ids:
+            return
+        days, ok = QInputDialog.getInt(self, self.getString('shift_dates'), self.getString('days') + ":", 1, -36500, 36500)
+        if not ok or not days:
+            return
+        self.ledger.shift_dates(ids, days)
+        self.after_batch()
+
+    def undo(self):
+        if self.ledger.undo() is not None:
+            self.after_batch()
+
+    def redo(self):
+        if self.ledger.redo() is not None:
+            self.after_batch()
+
+    def after_batch(self):
+        self.history_table.clearSelection()
+        self.load_history()
+
+    def update_undo_buttons(self):
+        self.undo_button.setEnabled(self.ledger.can_undo)
+        self.redo_button.setEnabled(self.ledger.can_redo)
+
+    def load_history_categories(self):
+        selected = self.category_filter.currentData()
+        self.category_filter.blockSignals(True)
+        self.category_filter.clear()
+        self.category_filter.addItem(self.getString('all_categories'), None)
+        for category in self.ledger.categories:
+            self.category_filter.addItem(category["name"], category["name"])
+        index = self.category_filter.findData(selected)
+        self.category_filter.setCurrentIndex(max(index, 0))
+        self.category_filter.blockSignals(False)
+
+    def history_filters(self):
+        # Half-typed dates and amounts are ignored until they parse.
+        filters = {}
+        text = self.search_input.text().strip()
+        if text:
+            filters["text"] = text
+        if self.type_filter.currentData() is not None:
+            filters["event_type"] = self.type_filter.currentData()
+        if self.category_filter.currentData() is not None:
+            filters["reason"] = self.category_filter.currentData()
+        for key, line_edit in (("start", self.from_date_input), ("end", self.to_date_input)):
+            date = QDate.fromString(line_edit.text().strip(), "dd.MM.yyyy")
+            if date.isValid():
+                filters[key] = date.toString("dd.MM.yyyy")
+        for key, line_edit in (("min_amount", self.min_amount_input), ("max_amount", self.max_amount_input)):
+            try:
+                filters[key] = float(line_edit.text())
+            except ValueError:
+                pass
+        return filters
+
+    @metrics.timed("history_search")
+    def search_history(self, page):
+        filters = self.history_filters()
+        if not filters:
+            self.history_page = 0
+            if self.history_model.rows is not None:
+                self.history_model.set_rows(None)
+            self.page_label.setText(f"{len(self.ledger.events)} {self.getString('results')}")
+            self.previous_page_button.setEnabled(False)
+            self.next_page_button.setEnabled(False)
+            return
+
+        total, rows = self.ledger.query(page * PAGE_SIZE, PAGE_SIZE, **filters)
+        pages = max(1, -(-total // PAGE_SIZE))
+        if page >= pages:
+            page = pages - 1
+            total, rows = self.ledger.query(page * PAGE_SIZE, PAGE_SIZE, **filters)
+        self.history_page = max(page, 0)
+        self.history_model.set_rows(rows)
+        self.page_label.setText(f"{self.getString('page')} {self.history_page + 1} / {pages} ({total} {self.getString('results')})")
+        self.previous_page_button.setEnabled(self.history_page > 0)
+        self.next_page_button.setEnabled(self.history_page < pages - 1)
+
     def show_stat_screen(self):
+        self.load_chart_categories()
         self.stacked_widget.setCurrentIndex(0)
+        self.plot_charts()
 
     def show_input_screen(self):
         self.load_categories_adding()
+        self.load_recurring_table()
         self.stacked_widget.setCurrentIndex(1)
 
+    def load_recurring_table(self):
+        rules = self.ledger.rules
+        self.recurring_table.setRowCount(len(rules))
+        for row, rule in enumerate(rules):
+            self.recurring_table.setItem(row, 0, QTableWidgetItem(rule["reason"]))
+            self.recurring_table.setItem(row, 1, QTableWidgetItem(f"{rule['amount']:.2f}"))
+            self.recurring_table.setItem(row, 2, QTableWidgetItem(self.getString(rule["frequency"])))
+            self.recurring_table.setItem(row, 3, QTableWidgetItem(rule["next"] or "-"))
+            delete_button = QPushButton(self.getString("delete"))
+            delete_button.clicked.connect(partial(self.delete_rule, rule["id"]))
+            self.recurring_table.setCellWidget(row, 4, delete_button)
+
+    def delete_rule(self, rule_id):
+        self.ledger.delete_rule(rule_id)
+        self.load_recurring_table()
+
+    def add_recurring(self):
+        try:
+            amount = float(self.amount_input.text())
+        except ValueError:
+            self.show_error(self.getString('please_enter_valid_amount'))
+            return
+        start = self.calendar.selectedDate().toString("dd.MM.yyyy")
+        end = self.end_date_input.text().strip() or None
+        try:
+            self.ledger.add_rule(amount, self.reason_combo.currentText(), self.repeat_combo.currentData(), start, end, account=self.account_combo.currentData())
+        except (OSError, ValueError) as e:
+            self.show_error(str(e))
+            return
+        # Occurrences up to today were appended in one batch; a model reset
+        # is simpler than announcing each of them.
+        self.history_model.set_events(self.ledger.events)
+        self.refresh_history()
+        self.update_labels()
+        self.load_recurring_table()
+        self.amount_input.clear()
+        self.end_date_input.clear()
+        self.show_success(self.getString('recurring_added'))
+
     def show_history_screen(self):
+        self.load_history_categories()
         self.stacked_widget.setCurrentIndex(2)
         self.load_history()
 
     def show_categories_screen(self):
+        self.ledger.refresh_categories()
         self.stacked_widget.setCurrentIndex(3)
         self.load_categories_into_table()
 
+    def show_diagnostics_screen(self):
+        self.stacked_widget.setCurrentWidget(self.diagnostics_screen)
+        self.load_diagnostics()
+
     def add_income_or_expense(self):
         selected_category = self.reason_combo.currentText()
         
@@ -366,16 +1210,17 @@ class FinanceApp(QWidget):
             print("Please, enter amount.")
             return
 
-        category_type = None
-        for category in self.categories:
-            if category['name'] == selected_category:
-                category_type = category['type']
-                break
+        category = self.ledger.category(selected_category)
+        category_type = category['type'] if category is not None else None
 
         if category_type is None:
             print(f"Category {selected_category} not valid.")
             return
 
+        if self.repeat_combo.currentData() is not None:
+            self.add_recurring()
+            return
+
         if category_type == self.getString('income'):
             self.add_income()
             print(f"Added income: {selected_category}, {self.getString('amount')}: {amount}")
@@ -386,129 +1231,187 @@ class FinanceApp(QWidget):
             print(f"Invalid category: {category_type}")
 
     def add_income(self):
-        try:
-            amount = float(self.amount_input.text())
-            reason = self.reason_combo.currentText()
-            date = self.calendar.selectedDate().toString("dd.MM.yyyy")
-            self.finances["income"] += amount
-            self.finances["events"].append({"type": "income", "amount": amount, "reason": reason, "date": date})
-            self.update_labels()
-            self.amount_input.clear()
-            self.save_data()
-            self.show_success(self.getString('income_added'))
-        
-        except ValueError:
-            self.show_error(self.getString('please_enter_valid_amount'))
+        self.add_event('income_added')
 
     def add_expenses(self):
+        self.add_event('expense_added')
+
+    def add_event(self, message):
         try:
             amount = float(self.amount_input.text())
-            reason = self.reason_combo.currentText()
-            date = self.calendar.selectedDate().toString("dd.MM.yyyy")
-            self.finances["expenses"] += amount
-            self.finances["events"].append({"type": "expense", "amount": amount, "reason": reason, "date": date})
-            self.update_labels()
-            self.amount_input.clear()
-            self.save_data()
-            self.show_success(self.getString('expense_added'))
-        
         except ValueError:
             self.show_error(self.getString('please_enter_valid_amount'))
+            return
+        date = self.calendar.selectedDate().toString("dd.MM.yyyy")
+        try:
+            event = self.ledger.make_event(amount, self.reason_combo.currentText(), date, self.account_combo.currentData())
+            self.append_event(event)
+        except (OSError, ValueError) as e:
+            # OSError: such as a TimeoutError while another instance holds the lock.
+            self.show_error(str(e))
+            return
+        self.amount_input.clear()
+        self.show_success(self.getString(message))
 
-    def load_history(self):
-        self.history_table.setRowCount(len(self.finances["events"]))
-        
-        for row, event in enumerate(self.finances["events"]):
-            date_item = QTableWidgetItem(event["date"])
-            reason_item = QTableWidgetItem(event["reason"])
-
-            amount_item = QLineEdit(f"{event['amount']} {self.getString('currency')}")
-            amount_item.setStyleSheet("padding: 5px; border: 1px solid #ccc; border-radius: 5px;")
-            amount_item.textChanged.connect(lambda text, idx=row: self.update_amount(text, idx))
-
-            if event["type"] == "expense":
-                amount_item.setStyleSheet("color: red; padding: 5px; border: 1px solid #ccc; border-radius: 5px;")
-            elif event["type"] == "income":
-                amount_item.setStyleSheet("color: #388E3C; padding: 5px; border: 1px solid #ccc; border-radius: 5px;")
-
-            self.history_table.setItem(row, 0, date_item)
-            self.history_table.setItem(row, 1, reason_item)
-            self.history_table.setCellWidget(row, 2, amount_item)
-
-            delete_button = QPushButton(self.getString('delete'))
-            delete_button.setStyleSheet("background-color: #F44336; color: white; font-weight: bold; padding: 5px; border-radius: 5px;")
-            # delete_button.clicked.connect(partial(self.delete_event, idx=row))
-            delete_button.clicked.connect(partial(self.delete_event, row))
-            self.history_table.setCellWidget(row, 3, delete_button)
-
+    def append_event(self, event):
+        self.append_events([event])
         self.update_labels()
 
-    def delete_event(self, idx):
-        del self.finances["events"][idx]
-        self.load_history()
-        self.save_data()
+    def append_events(self, events):
+        with self.ledger.lock:
+            row = len(self.ledger.events)
+            self.history_model.begin_insert_events(row, row + len(events) - 1)
+            try:
+                self.ledger.append_events(events)
+            finally:
+                self.history_model.end_insert_events()
+                if len(self.ledger.events) == row:
+                    # Nothing was added after all.
+                    self.history_model.set_events(self.ledger.events)
+        self.refresh_history()
+
+    def import_statement(self):
+        path, _ = QFileDialog.getOpenFileName(self, self.getString('import_statement'), "", self.getString('statement_files'))
+        if not path:
+            return
 
+        progress_dialog = QProgressDialog(self.getString('importing'), self.getString('cancel'), 0, 100, self)
+        progress_dialog.setWindowModality(Qt.WindowModal)
 
-    def update_amount(self, text, idx):
-        try:
-            new_amount = float(text.replace(" {self.getString('currency')}", "").strip())
+        def progress(report):
+            progress_dialog.setValue(int(report.fraction * 100))
+            QApplication.processEvents()
+            return not progress_dialog.wasCanceled()
 
-            self.finances["events"][idx]["amount"] = new_amount
-            self.save_data()
+        try:
+            report = self.ledger.import_statement(path, self.append_events, progress=progress)
+        except (OSError, ValueError) as e:
+            logging.error(f"Import of {path} failed: {e}")
+            self.show_error(str(e))
+            return
+        finally:
+            progress_dialog.close()
+            self.update_labels()
 
-            item = self.history_table.item(idx, 2)
-            if item is None:
-                item = QTableWidgetItem(f"{new_amount} {self.getString('currency')}")
-                self.history_table.setItem(idx, 2, item)
-            else:
-                item.setText(f"{new_amount} {self.getString('currency')}")
+        details = "\n".join(f"{line}: {reason}" for line, reason in report.rejected_sample)
+        self.show_success(f"{self.getString('imported')}: {report.imported}\n{self.getString('rejected')}: {report.rejected}\n{details}".strip())
 
-            self.update_labels()
+    @metrics.timed("history_rebuild")
+    def load_history(self):
+        self.history_model.set_events(self.ledger.events)
+        self.search_history(self.history_page)
+        self.update_labels()
 
-        except ValueError:
-            pass
+    def refresh_history(self):
+        self.search_history(self.history_page)
 
-    def update_labels(self):
-        income = sum(event['amount'] for event in self.finances["events"] if event['type'] == 'income')
-        expenses = sum(event['amount'] for event in self.finances["events"] if event['type'] == 'expense')
+    def delete_event(self, idx):
+        with self.ledger.lock:
+            self.history_model.begin_remove_event(idx)
+            self.ledger.delete_event(idx)
+            self.history_model.end_remove_event()
+        self.refresh_history()
+        self.update_labels()
 
-        self.income_label.setText(f"{self.getString('income')}: {income} {self.getString('currency')}")
-        self.expenses_label.setText(f"{self.getString('expenses')}: {expenses} {self.getString('currency')}")
-        self.balance_label.setText(f"{self.getString('total_balance')}: {income - expenses} {self.getString('currency')}")
+    def update_amount(self, idx, new_amount):
+        self.ledger.update_amount(idx, new_amount)
+        self.history_model.row_changed(idx)
+        self.update_labels()
 
-        self.finances["income"] = income
-        self.finances["expenses"] = expenses
+    @metrics.timed("update_labels")
+    def update_labels(self):
+        # Totals in the reporting currency, for one account or all of them.
+        totals = self.ledger.currency_totals
+        account = self.account_filter.currentData()
+        income = totals.total("income", account)
+        expenses = totals.total("expense", account)
+        symbol = currency_symbol(totals.reporting)
+
+        self.income_label.setText(f"{self.getString('income')}: {income:.2f} {symbol}")
+        self.expenses_label.setText(f"{self.getString('expenses')}: {expenses:.2f} {symbol}")
+        self.balance_label.setText(f"{self.getString('total_balance')}: {income - expenses:.2f} {symbol}")
+        self.rate_label.setText(f"{self.getString('no_rate')} {', '.join(sorted(totals.missing))}")
+        self.rate_label.setVisible(bool(totals.missing))
+        self.update_budget_label()
+        # Created with the Chronology screen, after the first call.
+        if hasattr(self, "undo_button"):
+            self.update_undo_buttons()
 
         self.plot_charts()
 
+    def update_budget_label(self):
+        status = self.ledger.budget_status()
+        parts = []
+        for budget in status:
+            text = f"{budget['category']} {budget['actual']:.2f} / {budget['budget']:.2f}"
+            if budget["remaining"] < 0:
+                text += f" ({self.getString('over_budget')})"
+            parts.append(text)
+        over = any(budget["remaining"] < 0 for budget in status)
+        self.budget_label.setStyleSheet("color: #F44336;" if over else "")
+        self.budget_label.setText(f"{self.getString('budgets')}: " + ", ".join(parts) if parts else "")
+        self.budget_label.setVisible(bool(parts))
+
     def plot_charts(self):
-        self.canvas.figure.clf()
-        ax = self.canvas.figure.add_subplot(111)
+        # Many changes (every keystroke, every import batch) collapse into
+        # one render per timer tick.
+        self.chart_dirty = True
+        if not self.chart_timer.isActive():
+            self.chart_timer.start()
+
+    @metrics.timed("chart_update")
+    def render_charts(self):
+        if not self.chart_dirty or not self.isVisible() or self.stacked_widget.currentWidget() is not self.stat_screen:
+            return
+        self.chart_dirty = False
+        if self.chart is None:
+            self.chart = StatChart()
+            self.stat_layout.addWidget(self.chart.canvas)
+
+        view = self.chart_view_combo.currentData()
+        reason = self.chart_category_combo.currentData()
+        if view == "monthly_trend":
+            self.plot_trend("month", reason)
+        elif view == "weekly_trend":
+            self.plot_trend("week", reason)
+        elif view == "by_category":
+            self.plot_categories()
+        elif view == "running_balance":
+            self.chart.show_lines([(self.getString('balance'), self.ledger.aggregates.running_balance("month", reason), "#2196F3")])
+        else:
+            self.plot_overview()
 
-        income = sum(event['amount'] for event in self.finances["events"] if event['type'] == 'income')
-        expenses = sum(event['amount'] for event in self.finances["events"] if event['type'] == 'expense')
+    def plot_trend(self, period, reason):
+        self.chart.show_lines([
+            (self.getString('incomes'), self.ledger.aggregates.series_points(period, "income", reason), "#4CAF50"),
+            (self.getString('expenses'), self.ledger.aggregates.series_points(period, "expense", reason), "#F44336"),
+        ])
 
-        if income == 0 and expenses == 0:
-            self.canvas.draw() 
-            return
+    def plot_categories(self):
+        rows = [(reason, total, "#F44336") for reason, total in self.ledger.aggregates.category_totals("expense")[:MAX_CHART_CATEGORIES]]
+        rows += [(reason, total, "#4CAF50") for reason, total in self.ledger.aggregates.category_totals("income")[:MAX_CHART_CATEGORIES]]
+        self.chart.show_bars(rows)
 
-        labels = [self.getString('incomes'), self.getString('expenses')]
-        values = [income, expenses]
+    def plot_overview(self):
+        aggregates = self.ledger.aggregates
+        income, expenses = aggregates.income, aggregates.expenses
 
-        ax.pie(values, labels=labels, autopct="%1.1f%%", colors=["#4CAF50", "#F44336"], startangle=90)
-        ax.axis("equal")
-        self.canvas.draw()
+        labels = [self.getString('incomes'), self.getString('expenses')]
+        self.chart.show_pie(labels, [income, expenses], ["#4CAF50", "#F44336"])
 
     def save_data(self):
-        with open(DATA_FILE, "w") as f:
-            json.dump(self.finances, f)
+        self.ledger.save()
 
     def load_data(self):
-        try:
-            with open(DATA_FILE, "r") as f:
-                self.finances = json.load(f)
-        except FileNotFoundError:
-            self.finances = {"income": 0, "expenses": 0, "events": []}
+        self.ledger.load()
+        self.history_model.set_events(self.ledger.events)
+        self.update_labels()
+
+    def closeEvent(self, event):
+        self.watcher.blockSignals(True)
+        self.sync_timer.stop()
+        self.ledger.close()
+        super().closeEvent(event)
 
     def show_error(self, message):
         QMessageBox.critical(self, self.getString('error'), message)
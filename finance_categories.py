@@ -0,0 +1,83 @@
+import json
+import logging
+
+
+class CategoryRegistry:
+    def __init__(self, storage):
+        self.storage = storage
+        # Deleted categories stay behind as tombstones so their ids are never
+        # handed out again and old events can still be named.
+        self.all = []
+        self.categories = []
+        self.by_name = {}
+        self.by_id = {}
+        self.version = None
+        self.load()
+
+    def load(self):
+        try:
+            self.all = self.storage.load_categories()
+        except FileNotFoundError:
+            logging.error("categories.json file not found. Creating a new one.")
+            self.all = []
+            self.save()
+        except json.JSONDecodeError:
+            logging.error("Error loading JSON")
+            self.all = []
+
+        # Categories saved before ids existed get them on first load.
+        next_id = self.next_id()
+        missing = [category for category in self.all if "id" not in category]
+        for category in missing:
+            category["id"] = next_id
+            next_id += 1
+        self.reindex()
+        if missing:
+            self.save()
+        self.version = self.storage.categories_version()
+
+    def reindex(self):
+        self.categories = [category for category in self.all if not category.get("deleted")]
+        self.by_name = {category["name"]: category for category in self.categories}
+        self.by_id = {category["id"]: category for category in self.all if "id" in category}
+
+    def next_id(self):
+        return max((category["id"] for category in self.all if "id" in category), default=0) + 1
+
+    def save(self):
+        self.storage.save_categories(self.all)
+        self.version = self.storage.categories_version()
+
+    def refresh(self):
+        # Cheap enough to call on every navigation: only a changed file (or
+        # a commit from another connection) triggers a reload.
+        if self.storage.categories_version() == self.version:
+            return False
+        self.load()
+        return True
+
+    def get(self, name):
+        return self.by_name.get(name)
+
+    def name(self, category_id):
+        category = self.by_id.get(category_id)
+        return category["name"] if category is not None else None
+
+    def add(self, name, category_type):
+        category = {"name": name, "type": category_type, "id": self.next_id()}
+        self.all.append(category)
+        self.reindex()
+        self.save()
+        return category
+
+    def delete(self, index):
+        category = self.categories[index]
+        category["deleted"] = True
+        self.reindex()
+        self.save()
+        return category
+
+    def rename(self, category_id, name):
+        self.by_id[category_id]["name"] = name
+        self.reindex()
+        self.save()
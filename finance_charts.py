@@ -0,0 +1,110 @@
+import math
+
+from finance_metrics import metrics
+
+MAX_TICKS = 12
+PIE_START_ANGLE = 90
+
+
+class StatChart:
+    def __init__(self, figsize=(6, 4)):
+        # Imported here so that starting the app doesn't pay for matplotlib
+        # until the Statistics screen is first shown.
+        from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+        from matplotlib.figure import Figure
+
+        self.figure = Figure(figsize=figsize)
+        self.canvas = FigureCanvas(self.figure)
+        if metrics.enabled:
+            # draw_idle only schedules a paint; the real rendering happens in
+            # canvas.draw, so that is what gets timed.
+            self.canvas.draw = metrics.timed("chart_draw")(self.canvas.draw)
+        self.ax = self.figure.add_subplot(111)
+        self.kind = None
+        self.shape = None
+        self.artists = {}
+
+    def reset(self, kind, shape):
+        # Rebuilding artists is only needed when the view or its shape
+        # (series, bar names) changes; everything else is updated in place.
+        if self.kind == kind and self.shape == shape:
+            return False
+        self.ax.clear()
+        self.kind = kind
+        self.shape = shape
+        self.artists = {}
+        return True
+
+    def show_empty(self):
+        if self.reset("empty", None):
+            self.ax.set_axis_off()
+        self.canvas.draw_idle()
+
+    def show_pie(self, labels, values, colors):
+        total = sum(values)
+        if not total:
+            self.show_empty()
+            return
+        if self.reset("pie", tuple(labels)):
+            self.ax.set_axis_on()
+            wedges, texts, autotexts = self.ax.pie(
+                [1] * len(values), labels=labels, autopct="%1.1f%%", colors=colors, startangle=PIE_START_ANGLE
+            )
+            self.ax.axis("equal")
+            self.artists = {"wedges": wedges, "texts": texts, "autotexts": autotexts}
+
+        theta = PIE_START_ANGLE
+        for wedge, text, autotext, value in zip(self.artists["wedges"], self.artists["texts"], self.artists["autotexts"], values):
+            share = value / total
+            end = theta + 360 * share
+            wedge.set_theta1(theta)
+            wedge.set_theta2(end)
+            middle = math.radians((theta + end) / 2)
+            visible = share > 0
+            text.set_position((1.1 * math.cos(middle), 1.1 * math.sin(middle)))
+            text.set_horizontalalignment("left" if math.cos(middle) >= 0 else "right")
+            autotext.set_position((0.6 * math.cos(middle), 0.6 * math.sin(middle)))
+            autotext.set_text(f"{share * 100:1.1f}%")
+            for artist in (wedge, text, autotext):
+                artist.set_visible(visible)
+            theta = end
+        self.canvas.draw_idle()
+
+    def show_lines(self, series):
+        buckets = sorted({bucket for _, points, _ in series for bucket, _ in points})
+        if not buckets:
+            self.show_empty()
+            return
+        if self.reset("lines", tuple(label for label, _, _ in series)):
+            self.ax.set_axis_on()
+            for label, _, color in series:
+                self.artists[label], = self.ax.plot([], [], marker=".", label=label, color=color)
+            self.ax.legend()
+            self.ax.grid(True, alpha=0.3)
+            self.figure.subplots_adjust(bottom=0.2)
+
+        position = {bucket: x for x, bucket in enumerate(buckets)}
+        for label, points, _ in series:
+            self.artists[label].set_data([position[bucket] for bucket, _ in points], [total for _, total in points])
+        step = max(1, len(buckets) // MAX_TICKS)
+        self.ax.set_xticks(range(0, len(buckets), step))
+        self.ax.set_xticklabels(buckets[::step], rotation=45, ha="right", fontsize=8)
+        self.ax.relim()
+        self.ax.autoscale_view()
+        self.canvas.draw_idle()
+
+    def show_bars(self, rows):
+        if not rows:
+            self.show_empty()
+            return
+        names = tuple(name for name, _, _ in rows)
+        if self.reset("bars", names):
+            self.ax.set_axis_on()
+            self.artists["bars"] = self.ax.barh(names, [0] * len(rows), color=[color for _, _, color in rows])
+            self.ax.invert_yaxis()
+            self.figure.tight_layout()
+
+        for bar, (_, total, _) in zip(self.artists["bars"], rows):
+            bar.set_width(total)
+        self.ax.set_xlim(0, max(total for _, total, _ in rows) * 1.05 or 1)
+        self.canvas.draw_idle()
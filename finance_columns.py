@@ -0,0 +1,177 @@
+from datetime import date
+from itertools import islice
+
+import numpy as np
+
+TYPES = ("income", "expense")
+INITIAL_CAPACITY = 1024
+REBUILD_CHUNK = 10000
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def day_number(text):
+    # "dd.MM.yyyy" -> days since 1970-01-01, which numpy reads as datetime64[D].
+    return date(int(text[6:10]), int(text[3:5]), int(text[0:2])).toordinal() - EPOCH_ORDINAL
+
+
+class EventColumns:
+    def __init__(self, events=(), categories=()):
+        self.codes = {}
+        self.names = []
+        for category in categories:
+            self.intern(category["name"])
+        self.day_cache = {}
+        self.rebuild(events)
+
+    def rebuild(self, events):
+        self.length = 0
+        self.allocate(max(len(events), INITIAL_CAPACITY))
+        # Chunked so a SQLite-backed event sequence is streamed, not copied.
+        iterator = iter(events)
+        while True:
+            chunk = list(islice(iterator, REBUILD_CHUNK))
+            if not chunk:
+                break
+            self.extend(chunk)
+
+    def allocate(self, capacity):
+        self.amount_column = np.zeros(capacity, dtype=np.float64)
+        self.day_column = np.zeros(capacity, dtype=np.int32)
+        self.type_column = np.zeros(capacity, dtype=np.int8)
+        self.reason_column = np.zeros(capacity, dtype=np.int16)
+
+    def reserve(self, count):
+        capacity = len(self.amount_column)
+        if self.length + count <= capacity:
+            return
+        while capacity < self.length + count:
+            capacity *= 2
+        for name in ("amount_column", "day_column", "type_column", "reason_column"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.length] = old[:self.length]
+            setattr(self, name, new)
+
+    def intern(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            code = len(self.names)
+            self.codes[name] = code
+            self.names.append(name)
+        return code
+
+    def day(self, text):
+        number = self.day_cache.get(text)
+        if number is None:
+            number = self.day_cache[text] = day_number(text)
+        return number
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def amounts(self):
+        return self.amount_column[:self.length]
+
+    @property
+    def days(self):
+        return self.day_column[:self.length]
+
+    @property
+    def types(self):
+        return self.type_column[:self.length]
+
+    @property
+    def reasons(self):
+        return self.reason_column[:self.length]
+
+    @property
+    def nbytes(self):
+        return self.amounts.nbytes + self.days.nbytes + self.types.nbytes + self.reasons.nbytes
+
+    def append(self, event):
+        self.extend((event,))
+
+    def extend(self, events):
+        count = len(events)
+        self.reserve(count)
+        end = self.length + count
+        self.amount_column[self.length:end] = [event["amount"] for event in events]
+        self.day_column[self.length:end] = [self.day(event["date"]) for event in events]
+        self.type_column[self.length:end] = [TYPES.index(event["type"]) for event in events]
+        self.reason_column[self.length:end] = [self.intern(event["reason"]) for event in events]
+        self.length = end
+
+    def delete(self, index):
+        for column in (self.amount_column, self.day_column, self.type_column, self.reason_column):
+            column[index:self.length - 1] = column[index + 1:self.length]
+        self.length -= 1
+
+    def insert(self, index, event):
+        self.reserve(1)
+        for column in (self.amount_column, self.day_column, self.type_column, self.reason_column):
+            column[index + 1:self.length + 1] = column[index:self.length]
+        self.length += 1
+        self.update(index, event)
+
+    def update(self, index, fields):
+        if "amount" in fields:
+            self.amount_column[index] = fields["amount"]
+        if "date" in fields:
+            self.day_column[index] = self.day(fields["date"])
+        if "type" in fields:
+            self.type_column[index] = TYPES.index(fields["type"])
+        if "reason" in fields:
+            self.reason_column[index] = self.intern(fields["reason"])
+
+    def mask(self, event_type=None, start=None, end=None, reason=None):
+        selected = np.ones(self.length, dtype=bool)
+        if event_type is not None:
+            selected &= self.types == TYPES.index(event_type)
+        if start is not None:
+            selected &= self.days >= self.day(start)
+        if end is not None:
+            selected &= self.days <= self.day(end)
+        if reason is not None:
+            code = self.codes.get(reason)
+            if code is None:
+                return np.zeros(self.length, dtype=bool)
+            selected &= self.reasons == code
+        return selected
+
+    def total(self, **filters):
+        return float(self.amounts[self.mask(**filters)].sum())
+
+    def group_codes(self, key, selected):
+        if key == "type":
+            return self.types[selected], list(TYPES)
+        if key == "reason":
+            return self.reasons[selected], self.names
+        if key == "day":
+            unit = "D"
+        elif key == "month":
+            unit = "M"
+        elif key == "year":
+            unit = "Y"
+        else:
+            raise ValueError(f"Unknown group key: {key}")
+        periods = self.days[selected].astype("datetime64[D]").astype(f"datetime64[{unit}]")
+        labels, codes = np.unique(periods, return_inverse=True)
+        return codes, [str(label) for label in labels]
+
+    def sum_by(self, key, **filters):
+        selected = self.mask(**filters)
+        codes, labels = self.group_codes(key, selected)
+        sums = np.bincount(codes, weights=self.amounts[selected], minlength=len(labels))
+        counts = np.bincount(codes, minlength=len(labels))
+        return {labels[code]: float(sums[code]) for code in np.flatnonzero(counts)}
+
+    def top(self, n, key="reason", **filters):
+        selected = self.mask(**filters)
+        codes, labels = self.group_codes(key, selected)
+        sums = np.bincount(codes, weights=self.amounts[selected], minlength=len(labels))
+        present = np.flatnonzero(np.bincount(codes, minlength=len(labels)))
+        if len(present) > n:
+            present = present[np.argpartition(-sums[present], n - 1)[:n]]
+        ordered = present[np.argsort(-sums[present], kind="stable")]
+        return [(labels[code], float(sums[code])) for code in ordered]
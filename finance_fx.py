@@ -0,0 +1,143 @@
+import bisect
+import csv
+import functools
+import logging
+import os
+from collections import defaultdict
+
+from finance_storage import iso_date
+
+RATES_FILE = "rates.csv"
+# Rates are units of each currency per one unit of the pivot, the way
+# central banks publish them (the ECB's reference rates are per euro).
+FX_PIVOT = os.environ.get("FINANCE_FX_PIVOT", "EUR")
+FX_CACHE_SIZE = 8192
+CURRENCY_SYMBOLS = {"USD": "$", "EUR": "€", "GBP": "£", "JPY": "¥", "CHF": "CHF", "PLN": "zł", "INR": "₹"}
+
+
+def valid_currency(code):
+    return len(code) == 3 and code.isalpha() and code.isupper()
+
+
+def currency_symbol(code):
+    return CURRENCY_SYMBOLS.get(code, code)
+
+
+def rate_day(text):
+    # The file may use either yyyy-MM-dd (as downloaded) or dd.MM.yyyy.
+    return text if "-" in text else iso_date(text)
+
+
+class RateTable:
+    def __init__(self, pivot=FX_PIVOT):
+        self.pivot = pivot
+        self.days = {}
+        self.values = {}
+        # Bounded per table, so a reload starts from an empty cache.
+        self.rate = functools.lru_cache(maxsize=FX_CACHE_SIZE)(self.lookup)
+
+    @classmethod
+    def load(cls, path=RATES_FILE, pivot=FX_PIVOT):
+        table = cls(pivot)
+        try:
+            f = open(path, "r", encoding="utf-8", newline="")
+        except FileNotFoundError:
+            return table
+        with f:
+            rows = defaultdict(list)
+            for line_number, row in enumerate(csv.DictReader(f), start=2):
+                try:
+                    currency = row["currency"].strip().upper()
+                    rows[currency].append((rate_day(row["date"].strip()), float(row["rate"])))
+                except (KeyError, AttributeError, ValueError):
+                    logging.error(f"Skipping bad exchange rate on line {line_number} of {path}")
+        for currency, points in rows.items():
+            points.sort()
+            table.days[currency] = [day for day, _ in points]
+            table.values[currency] = [value for _, value in points]
+        return table
+
+    @property
+    def currencies(self):
+        return sorted(set(self.days) | {self.pivot})
+
+    def lookup(self, currency, date):
+        # The latest rate on or before date ("dd.MM.yyyy"); dates before the
+        # first known rate use the first one.
+        if currency == self.pivot:
+            return 1.0
+        days = self.days.get(currency)
+        if not days:
+            return None
+        i = bisect.bisect_right(days, iso_date(date)) - 1
+        return self.values[currency][max(i, 0)]
+
+    def factor(self, source, target, date):
+        if source == target:
+            return 1.0
+        source_rate = self.rate(source, date)
+        target_rate = self.rate(target, date)
+        if source_rate is None or target_rate is None:
+            return None
+        return target_rate / source_rate
+
+
+class CurrencyTotals:
+    # Native amounts are kept per (account, type, currency, date), and
+    # (account, type) totals in the reporting currency are updated with
+    # every change. A new reporting currency converts each bucket once,
+    # not each event.
+    def __init__(self, rates, reporting, account_of, currency_of, events=()):
+        self.rates = rates
+        self.reporting = reporting
+        self.account_of = account_of
+        self.currency_of = currency_of
+        self.buckets = defaultdict(float)
+        self.counts = defaultdict(int)
+        for event in events:
+            key = self.key(event)
+            self.buckets[key] += event["amount"]
+            self.counts[key] += 1
+        self.set_reporting(reporting)
+
+    def key(self, event):
+        return self.account_of(event), event["type"], self.currency_of(event), event["date"]
+
+    def convert(self, amount, currency, date):
+        factor = self.rates.factor(currency, self.reporting, date)
+        if factor is None:
+            self.missing.add(currency if self.rates.rate(currency, date) is None else self.reporting)
+            return 0.0
+        return amount * factor
+
+    def set_reporting(self, reporting):
+        self.reporting = reporting
+        self.missing = set()
+        self.totals = defaultdict(float)
+        for (account, event_type, currency, date), amount in self.buckets.items():
+            self.totals[(account, event_type)] += self.convert(amount, currency, date)
+
+    def apply(self, event, sign):
+        key = self.key(event)
+        amount = sign * event["amount"]
+        self.counts[key] += sign
+        if self.counts[key] == 0:
+            del self.counts[key]
+            self.buckets.pop(key, None)
+        else:
+            self.buckets[key] += amount
+        self.totals[key[:2]] += self.convert(amount, key[2], key[3])
+
+    def add(self, event):
+        self.apply(event, 1)
+
+    def remove(self, event):
+        self.apply(event, -1)
+
+    def total(self, event_type, account=None):
+        if account is not None:
+            return self.totals.get((account, event_type), 0.0)
+        return sum(total for (_, kind), total in self.totals.items() if kind == event_type)
+
+    def balance(self, account=None):
+        return self.total("income", account) - self.total("expense", account)
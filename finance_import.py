@@ -0,0 +1,285 @@
+import argparse
+import csv
+import math
+import os
+import re
+import sys
+from datetime import datetime
+
+from finance_ledger import CATEGORY_FILE, DATA_FILE, DB_FILE, STORAGE_MODE, Ledger
+
+BATCH_SIZE = 10000
+REJECT_SAMPLE_SIZE = 20
+OFX_CHUNK_SIZE = 1 << 16
+
+DATE_COLUMNS = ("date", "booking date", "transaction date", "posted", "value date")
+AMOUNT_COLUMNS = ("amount", "value", "sum", "total")
+CATEGORY_COLUMNS = ("category", "reason", "description", "payee", "name", "memo")
+DATE_FORMATS = ("%d.%m.%Y", "%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y", "%Y%m%d")
+
+OFX_TAG = re.compile(r"<(/?)([A-Za-z0-9_.]+)>([^<]*)")
+
+
+class RejectedRow(ValueError):
+    pass
+
+
+class ImportReport:
+    def __init__(self, total_bytes=0):
+        self.total_bytes = total_bytes
+        self.bytes_read = 0
+        self.rows_read = 0
+        self.imported = 0
+        self.rejected = 0
+        self.rejected_sample = []
+        self.cancelled = False
+
+    @property
+    def fraction(self):
+        if not self.total_bytes:
+            return 0
+        return min(self.bytes_read / self.total_bytes, 1)
+
+    def summary(self):
+        return f"Read {self.rows_read} rows: {self.imported} imported, {self.rejected} rejected"
+
+
+class CategoryMapper:
+    def __init__(self, categories, default_income=None, default_expense=None):
+        self.by_name = {category["name"].casefold(): category for category in categories}
+        self.default_income = self.find(default_income) if default_income else None
+        self.default_expense = self.find(default_expense) if default_expense else None
+
+    def find(self, name):
+        category = self.by_name.get(name.strip().casefold())
+        if category is None:
+            raise RejectedRow(f"unknown category: {name}")
+        return category
+
+    def map(self, name, amount):
+        category = self.by_name.get(name.strip().casefold())
+        if category is None:
+            category = self.default_expense if amount < 0 else self.default_income
+        if category is None:
+            raise RejectedRow(f"unknown category: {name}")
+        return category
+
+
+class DateParser:
+    def __init__(self, date_format=None):
+        self.formats = (date_format,) if date_format else DATE_FORMATS
+        # Statements repeat the same few hundred dates; parse each one once.
+        self.cache = {}
+
+    def parse(self, text):
+        text = text.strip()
+        date = self.cache.get(text)
+        if date is None:
+            for date_format in self.formats:
+                try:
+                    date = datetime.strptime(text, date_format).strftime("%d.%m.%Y")
+                    break
+                except ValueError:
+                    continue
+            else:
+                raise RejectedRow(f"invalid date: {text}")
+            self.cache[text] = date
+        return date
+
+
+def parse_amount(text):
+    cleaned = re.sub(r"[^0-9,.\-+]", "", text)
+    if "," in cleaned and "." in cleaned:
+        cleaned = cleaned.replace(",", "")
+    else:
+        cleaned = cleaned.replace(",", ".")
+    try:
+        amount = float(cleaned)
+    except ValueError:
+        raise RejectedRow(f"invalid amount: {text}")
+    if not math.isfinite(amount) or amount == 0:
+        raise RejectedRow(f"invalid amount: {text}")
+    return amount
+
+
+def make_event(mapper, dates, raw_date, raw_amount, reason):
+    amount = parse_amount(raw_amount)
+    category = mapper.map(reason, amount)
+    event_type = "income" if category["type"].casefold() == "income" else "expense"
+    event = {"type": event_type, "amount": abs(amount), "reason": category["name"], "date": dates.parse(raw_date)}
+    if "id" in category:
+        event["category_id"] = category["id"]
+    return event
+
+
+def pick_column(header, requested, candidates):
+    names = {name.strip().casefold(): name for name in header}
+    if requested:
+        if requested.casefold() not in names:
+            raise ValueError(f"Column {requested!r} not found in {header}")
+        return names[requested.casefold()]
+    for candidate in candidates:
+        if candidate in names:
+            return names[candidate]
+    raise ValueError(f"None of the columns {candidates} found in {header}")
+
+
+def counted_lines(f, report):
+    for line in f:
+        report.bytes_read += len(line)
+        yield line
+
+
+def read_csv(path, report, date_column=None, amount_column=None, category_column=None, delimiter=None):
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        lines = counted_lines(f, report)
+        first = next(lines, "")
+        if delimiter is None:
+            delimiter = max(",;\t", key=first.count)
+        header = next(csv.reader([first], delimiter=delimiter), [])
+        columns = [
+            header.index(pick_column(header, date_column, DATE_COLUMNS)),
+            header.index(pick_column(header, amount_column, AMOUNT_COLUMNS)),
+            header.index(pick_column(header, category_column, CATEGORY_COLUMNS)),
+        ]
+        for line_number, row in enumerate(csv.reader(lines, delimiter=delimiter), start=2):
+            if not row:
+                continue
+            try:
+                yield line_number, [row[column] for column in columns], row
+            except IndexError:
+                yield line_number, None, row
+
+
+def ofx_tags(f, report):
+    buffer = ""
+    while True:
+        chunk = f.read(OFX_CHUNK_SIZE)
+        report.bytes_read += len(chunk)
+        buffer += chunk
+        # Hold back the last, possibly incomplete, tag until the next chunk.
+        last = max(buffer.rfind("<"), 0) if chunk else len(buffer)
+        for match in OFX_TAG.finditer(buffer, 0, last):
+            yield match.group(1) == "/", match.group(2).upper(), match.group(3).strip()
+        if not chunk:
+            break
+        buffer = buffer[last:]
+
+
+def read_ofx(path, report):
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        transaction = None
+        number = 0
+        for closing, tag, value in ofx_tags(f, report):
+            if tag == "STMTTRN":
+                if not closing:
+                    transaction = {}
+                elif transaction is not None:
+                    number += 1
+                    reason = transaction.get("NAME") or transaction.get("MEMO") or ""
+                    fields = [transaction.get("DTPOSTED", "")[:8], transaction.get("TRNAMT", ""), reason]
+                    yield number, fields, list(transaction.values())
+                    transaction = None
+            elif transaction is not None and not closing:
+                transaction[tag] = value
+
+
+def is_ofx(path):
+    return os.path.splitext(path)[1].lower() in (".ofx", ".qfx")
+
+
+def import_statement(path, categories, append_batch, batch_size=BATCH_SIZE, progress=None, rejects=None,
+                     default_income=None, default_expense=None, date_format=None, **csv_options):
+    report = ImportReport(os.path.getsize(path))
+    mapper = CategoryMapper(categories, default_income, default_expense)
+    if is_ofx(path):
+        rows = read_ofx(path, report)
+        dates = DateParser("%Y%m%d")
+    else:
+        rows = read_csv(path, report, **csv_options)
+        dates = DateParser(date_format)
+    reject_writer = csv.writer(rejects) if rejects is not None else None
+    batch = []
+
+    for line_number, fields, raw in rows:
+        report.rows_read += 1
+        try:
+            if fields is None:
+                raise RejectedRow("missing columns")
+            batch.append(make_event(mapper, dates, *fields))
+        except RejectedRow as e:
+            report.rejected += 1
+            if len(report.rejected_sample) < REJECT_SAMPLE_SIZE:
+                report.rejected_sample.append((line_number, str(e)))
+            if reject_writer is not None:
+                reject_writer.writerow([line_number, str(e), *raw])
+
+        if len(batch) >= batch_size:
+            append_batch(batch)
+            report.imported += len(batch)
+            batch = []
+            if progress is not None and progress(report) is False:
+                report.cancelled = True
+                return report
+
+    if batch:
+        append_batch(batch)
+        report.imported += len(batch)
+    if progress is not None:
+        progress(report)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import CSV or OFX bank statements into the finance ledger.")
+    parser.add_argument("statements", nargs="+", help="CSV, OFX or QFX files to import")
+    parser.add_argument("--storage", default=STORAGE_MODE, choices=("json", "journal", "binary", "sqlite"))
+    parser.add_argument("--data", default=DATA_FILE)
+    parser.add_argument("--categories", default=CATEGORY_FILE)
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--date-format", help="strptime format of the date column, e.g. %%d.%%m.%%Y")
+    parser.add_argument("--date-column")
+    parser.add_argument("--amount-column")
+    parser.add_argument("--category-column")
+    parser.add_argument("--delimiter")
+    parser.add_argument("--default-income", help="category for unmatched positive amounts")
+    parser.add_argument("--default-expense", help="category for unmatched negative amounts")
+    parser.add_argument("--rejects", help="write rejected rows to this CSV file")
+    args = parser.parse_args(argv)
+
+    # Through the ledger, like an import from the window, so events get
+    # ids and writes take the file lock.
+    ledger = Ledger.open(args.storage, args.data, args.categories, args.db)
+    rejects = open(args.rejects, "w", encoding="utf-8", newline="") if args.rejects else None
+    exit_code = 0
+    try:
+        for path in args.statements:
+            def progress(report):
+                print(f"\r{path}: {report.fraction:6.1%} {report.summary()}", end="", file=sys.stderr, flush=True)
+
+            try:
+                report = ledger.import_statement(
+                    path, batch_size=args.batch_size, progress=progress, rejects=rejects,
+                    default_income=args.default_income, default_expense=args.default_expense, date_format=args.date_format,
+                    date_column=args.date_column, amount_column=args.amount_column,
+                    category_column=args.category_column, delimiter=args.delimiter,
+                )
+            except (OSError, ValueError) as e:
+                print(f"\n{path}: {e}", file=sys.stderr)
+                exit_code = 1
+                continue
+            print(file=sys.stderr)
+            for line_number, reason in report.rejected_sample:
+                print(f"  line {line_number}: {reason}", file=sys.stderr)
+            if report.rejected > len(report.rejected_sample):
+                print(f"  ... and {report.rejected - len(report.rejected_sample)} more", file=sys.stderr)
+    finally:
+        if rejects is not None:
+            rejects.close()
+        ledger.close()
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1198 @@
+import argparse
+import bisect
+import copy
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import date as Date, datetime, timedelta
+
+from finance_aggregates import PERIODS, Aggregates
+from finance_categories import CategoryRegistry
+from finance_fx import RATES_FILE, CurrencyTotals, RateTable, valid_currency
+from finance_metrics import metrics
+from finance_recurring import FREQUENCIES, due, make_rule, month_key, parse_date, resume, rule_key, upcoming
+from finance_storage import WriteBehindWriter, apply_record, create_storage, empty_finances, find_positions, iso_date, merge_by_id, update_fields
+
+DATA_FILE = "finances.json"
+CATEGORY_FILE = "categories.json"
+DB_FILE = "finances.db"
+STORAGE_MODE = os.environ.get("FINANCE_STORAGE", "journal")
+WRITE_DEBOUNCE = float(os.environ.get("FINANCE_WRITE_DEBOUNCE", "0.5"))
+DEFAULT_ACCOUNT = "Main"
+DEFAULT_CURRENCY = os.environ.get("FINANCE_CURRENCY", "USD")
+UNDO_LIMIT = 100
+# Batches up to this size patch the columns and search index row by row;
+# larger ones drop them to be rebuilt on next use.
+VIEW_PATCH_LIMIT = 32
+# Ids reserved at a time from the counter instances on the same files share.
+ID_BLOCK = 100
+EXPORT_FIELDS = ("date", "type", "reason", "amount", "account", "currency")
+
+
+def category_event_type(category):
+    # categories.json stores the display strings "Income"/"Expense".
+    category_type = category["type"].casefold()
+    if category_type not in ("income", "expense"):
+        raise ValueError(f"Invalid category type: {category['type']}")
+    return category_type
+
+
+def event_matches(event, start=None, end=None, min_amount=None, max_amount=None, event_type=None, reason=None, text=None):
+    # The same filters as EventIndex.search, for one-off scans that would
+    # not pay back building the index.
+    if start is not None and iso_date(event["date"]) < iso_date(start):
+        return False
+    if end is not None and iso_date(event["date"]) > iso_date(end):
+        return False
+    if min_amount is not None and event["amount"] < min_amount:
+        return False
+    if max_amount is not None and event["amount"] > max_amount:
+        return False
+    if event_type is not None and event["type"] != event_type:
+        return False
+    if reason is not None and event["reason"] != reason:
+        return False
+    if text and text.casefold() not in event["reason"].casefold():
+        return False
+    return True
+
+
+class LoadTask:
+    # Reads the storage on a worker thread; the owner polls done and
+    # fraction, then installs the result with Ledger.finish_load. prepare,
+    # if given, also runs on the worker with what was read.
+    def __init__(self, storage, prepare=None):
+        self.storage = storage
+        self.prepare = prepare
+        self.fraction = 0.0
+        self.finances = None
+        self.prepared = None
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name="finance-loader", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        started = time.perf_counter()
+        try:
+            self.finances = self.storage.load(self.set_fraction)
+            if self.prepare is not None:
+                self.prepared = self.prepare(self.finances)
+        except Exception as e:
+            self.error = e
+        metrics.observe("load_read", time.perf_counter() - started)
+
+    def set_fraction(self, fraction):
+        self.fraction = fraction
+
+    @property
+    def done(self):
+        return not self.thread.is_alive()
+
+    def wait(self):
+        self.thread.join()
+
+
+class IdTask:
+    # Reserves a block of event ids on a thread of its own, so the window
+    # never waits for another instance to release the file lock to add an
+    # event.
+    def __init__(self, storage, count, floor):
+        self.count = count
+        self.start = None
+        self.error = None
+        self.thread = threading.Thread(target=self.run, args=(storage, floor), name="finance-ids", daemon=True)
+        self.thread.start()
+
+    def run(self, storage, floor):
+        try:
+            self.start = storage.reserve_ids(self.count, floor)
+        except Exception as e:
+            self.error = e
+
+    def wait(self):
+        self.thread.join()
+
+
+class Ledger:
+    def __init__(self, storage, debounce=WRITE_DEBOUNCE, load=True, rates_path=RATES_FILE):
+        self.storage = storage
+        self.rates_path = rates_path
+        self._rates = None
+        self.registry = CategoryRegistry(storage)
+        self.finances = empty_finances()
+        # Derived views are built on first use, so a one-off query from the
+        # command line pays neither for them nor for importing numpy.
+        self._aggregates = None
+        self._columns = None
+        self._search_index = None
+        self._currency_totals = None
+        self.next_id = 1
+        self.id_limit = 0
+        self.id_task = None
+        # Entries are {"label", "change", "serial"}; change is the operation
+        # that reverts the step.
+        self.undo_stack = []
+        self.redo_stack = []
+        self.undo_serial = 0
+        self.load_task = None
+        self.resync_task = None
+        self.resync_written = 0
+        self.writer = WriteBehindWriter(storage, self.finances, debounce)
+        # Held by the GUI around a mutation so its model notifications and
+        # the change itself are seen by the writer as one step.
+        self.lock = self.writer.lock
+        if load:
+            self.load()
+
+    @classmethod
+    def open(cls, mode=STORAGE_MODE, data_path=DATA_FILE, category_path=CATEGORY_FILE, db_path=DB_FILE, debounce=WRITE_DEBOUNCE, load=True,
+             rates_path=RATES_FILE):
+        return cls(create_storage(mode, data_path, category_path, db_path), debounce, load, rates_path)
+
+    @property
+    def events(self):
+        return self.finances["events"]
+
+    @property
+    def categories(self):
+        return self.registry.categories
+
+    @property
+    def rules(self):
+        return self.finances.get("recurring", [])
+
+    @property
+    def budgets(self):
+        # category id (as a string, like every JSON key) -> monthly amount
+        return self.finances.get("budgets", {})
+
+    @property
+    def accounts(self):
+        # Events without an account belong to the first one.
+        return self.finances.get("accounts") or [{"name": DEFAULT_ACCOUNT, "currency": DEFAULT_CURRENCY}]
+
+    @property
+    def reporting_currency(self):
+        return self.finances.get("reporting_currency") or self.accounts[0]["currency"]
+
+    @property
+    def rates(self):
+        if self._rates is None:
+            self._rates = RateTable.load(self.rates_path)
+        return self._rates
+
+    @property
+    def currency_totals(self):
+        if self._currency_totals is None:
+            with metrics.time("currency_totals"):
+                self._currency_totals = CurrencyTotals(self.rates, self.reporting_currency, self.account_of, self.currency_of, self.events)
+        return self._currency_totals
+
+    @property
+    def aggregates(self):
+        if self._aggregates is None:
+            self._aggregates = Aggregates(self.events)
+            self.sync_totals()
+        return self._aggregates
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            from finance_columns import EventColumns
+            self._columns = EventColumns(self.events, self.categories)
+        return self._columns
+
+    @property
+    def search_index(self):
+        if self._search_index is None:
+            from finance_search import EventIndex
+            self._search_index = EventIndex(self.columns)
+        return self._search_index
+
+    def refresh_categories(self):
+        self.registry.refresh()
+        return self.categories
+
+    def add_category(self, name, category_type):
+        return self.registry.add(name, category_type)
+
+    def delete_category(self, index):
+        return self.registry.delete(index)
+
+    def rename_category(self, category_id, name):
+        # Events keep their category_id, so only the registry is saved; the
+        # in-memory names and derived views are brought up to date here.
+        with self.lock:
+            self.registry.rename(category_id, name)
+            if isinstance(self.events, list):
+                for event in self.events:
+                    if event.get("category_id") == category_id:
+                        event["reason"] = name
+            else:
+                self.events.invalidate()
+            self.reset_views()
+
+    def category(self, name):
+        return self.registry.get(name)
+
+    def account(self, name):
+        return next((account for account in self.accounts if account["name"] == name), None)
+
+    def account_of(self, event):
+        return event.get("account") or self.accounts[0]["name"]
+
+    def currency_of(self, event):
+        # set_account stores both, so only older events need a lookup.
+        currency = event.get("currency")
+        if currency is None:
+            account = self.account(event["account"]) if event.get("account") else None
+            currency = (account or self.accounts[0])["currency"]
+        return currency
+
+    def add_account(self, name, currency):
+        name = name.strip()
+        currency = currency.strip().upper()
+        if not name:
+            raise ValueError("Account name is empty.")
+        if self.account(name) is not None:
+            raise ValueError(f"Account {name} already exists.")
+        if not valid_currency(currency):
+            raise ValueError(f"Invalid currency code: {currency}")
+        account = {"name": name, "currency": currency}
+        self.update_settings({"accounts": self.accounts + [account]})
+        return account
+
+    def currencies(self):
+        return sorted(set(self.rates.currencies) | {account["currency"] for account in self.accounts})
+
+    def set_reporting_currency(self, currency):
+        if currency not in self.currencies():
+            raise ValueError(f"No exchange rates for {currency}.")
+        self.update_settings({"reporting_currency": currency})
+        if self._currency_totals is not None:
+            with metrics.time("currency_switch"):
+                self._currency_totals.set_reporting(currency)
+
+    def reload_rates(self):
+        self._rates = None
+        self._currency_totals = None
+
+    def account_balances(self):
+        # Per account totals in the reporting currency, then the consolidated
+        # ones under the account name None.
+        totals = self.currency_totals
+        rows = []
+        for account in self.accounts + [{"name": None, "currency": None}]:
+            income = totals.total("income", account["name"])
+            expenses = totals.total("expense", account["name"])
+            rows.append({"account": account["name"], "currency": account["currency"], "income": income, "expenses": expenses, "balance": income - expenses})
+        return rows
+
+    def load(self, progress=None):
+        with metrics.time("load"):
+            self.install(self.storage.load(progress))
+        return self.finances
+
+    def load_in_background(self):
+        # Nothing may be changed until finish_load: the records would be
+        # journaled against rows that aren't loaded yet.
+        self.load_task = LoadTask(self.storage, self.prepare_views)
+        return self.load_task
+
+    def prepare_views(self, finances):
+        # The totals of a large ledger take a while to build; built with
+        # the load, the first change made in the window doesn't wait for
+        # them.
+        events = finances["events"]
+        if isinstance(events, list):
+            self.resolve_names(events)
+        else:
+            # So are the SQLite ids the window pages by.
+            events.read_ids()
+        with metrics.time("aggregates_build"):
+            return Aggregates(events)
+
+    def finish_load(self):
+        task = self.load_task
+        task.wait()
+        self.load_task = None
+        if task.error is not None:
+            raise task.error
+        with metrics.time("load_install"):
+            self.install(task.finances, task.prepared)
+        self.reserve_ahead()
+
+    def install(self, finances, aggregates=None):
+        # aggregates come from prepare_views, which resolved the names too.
+        self.finances = finances
+        if isinstance(self.events, list) and aggregates is None:
+            self.resolve_names(self.events)
+        self.reset_views()
+        if aggregates is not None:
+            self._aggregates = aggregates
+            self.sync_totals()
+        self.undo_stack = []
+        self.redo_stack = []
+        self.writer.set_finances(self.finances)
+        self.assign_ids()
+        self.materialize()
+        self.update_gauges()
+
+    def sync_external(self):
+        # Merges what other instances wrote since the last call, by event
+        # id. Returns whether anything changed, or None when that can't be
+        # told yet (a write of ours is in flight, another instance holds the
+        # lock, or a re-read is under way) and it should be called again.
+        with self.lock:
+            if self.load_task is not None or self.writer.flushing:
+                return None
+            if self.resync_task is not None:
+                return self.finish_resync()
+            records = self.storage.poll()
+            if records is None:
+                return None
+            with metrics.time("sync_external"):
+                if records and not self.merge_records(records):
+                    self.storage.resync = True
+            if self.storage.resync:
+                return self.start_resync()
+            return bool(records)
+
+    def merge_records(self, records):
+        # Journal records of other instances, with any of this one's that
+        # were journaled after them, then the changes still queued here:
+        # each instance ends up with the change that was written last.
+        # Index-based records from before events had ids can't be placed,
+        # and return False.
+        for record in records + self.writer.queue:
+            op = record["op"]
+            if op in ("add", "extend", "restore"):
+                events = [record["event"]] if op == "add" else record["events"]
+                if any("id" not in event for event in events):
+                    return False
+                self.apply_change({"op": "restore", "events": events}, submit=False)
+                self.note_ids(events)
+            elif op in ("remove", "edit"):
+                self.apply_change(record, submit=False)
+            elif op != "settings":
+                return False
+            if "settings" in record:
+                self.finances.update(record["settings"])
+        return True
+
+    def start_resync(self):
+        if not isinstance(self.events, list):
+            # SQLite reads events on demand; only the views are stale.
+            self.events.refresh()
+            self.finances.update(self.storage.load_settings())
+            self.reset_views()
+            self.storage.resync = False
+            return True
+        # A copy reads the files in the background, while this one keeps
+        # its position for writes.
+        self.resync_written = self.storage.written
+        self.resync_task = LoadTask(copy.copy(self.storage))
+        return None
+
+    def finish_resync(self):
+        task = self.resync_task
+        if not task.done:
+            return None
+        self.resync_task = None
+        if task.error is not None:
+            logging.error(f"Reading changes of another instance failed: {task.error}")
+            return False
+        if self.storage.written != self.resync_written:
+            # A write of ours landed while it was read.
+            return self.start_resync()
+        finances = task.finances
+        # Changes of ours still waiting for the writer aren't in the files.
+        for record in self.writer.queue:
+            apply_record(finances, record)
+        with metrics.time("sync_external"):
+            self.merge_snapshot(finances)
+        self.storage.adopt(task.storage)
+        return True
+
+    def merge_snapshot(self, finances):
+        # Turns the difference between the events read and those in memory
+        # into a remove, a restore and an edit, so only what another
+        # instance changed is touched.
+        events = finances.pop("events")
+        for key in ("income", "expenses"):
+            finances.pop(key, None)
+        if any("id" not in event for event in events):
+            # Saved by a version without ids; nothing to match them by.
+            self.install(dict(finances, events=events))
+            return
+        self.finances.update(finances)
+        current = {event["id"]: event for event in self.events}
+        incoming = {event["id"]: event for event in events}
+        removed = [event_id for event_id in current if event_id not in incoming]
+        added = [event for event_id, event in incoming.items() if event_id not in current]
+        changes = [
+            [event_id, {key: event.get(key) for key in event.keys() | current[event_id].keys()}]
+            for event_id, event in incoming.items() if event_id in current and event != current[event_id]
+        ]
+        if removed:
+            self.apply_change({"op": "remove", "ids": removed}, submit=False)
+        if added:
+            self.apply_change({"op": "restore", "events": added}, submit=False)
+            self.note_ids(added)
+        if changes:
+            self.apply_change({"op": "edit", "changes": changes}, submit=False)
+
+    def assign_ids(self):
+        if not isinstance(self.events, list):
+            return
+        self.next_id = max((event["id"] for event in self.events if "id" in event), default=0) + 1
+        self.id_limit = 0
+        missing = [event for event in self.events if "id" not in event]
+        if not missing:
+            return
+        # Events saved before ids existed get them once, and are written
+        # straight back so the ids stay the same in the next session.
+        with metrics.time("assign_ids"):
+            self.take_ids(missing)
+            self.storage.save(self.finances)
+
+    def take_ids(self, events):
+        # SQLite numbers events as it inserts them. Otherwise ids come in
+        # blocks reserved through the storage, above every id in the list,
+        # so events are appended in id order and no other instance on the
+        # same files hands out the same ones.
+        if not isinstance(self.events, list):
+            return
+        if self.id_limit - self.next_id < len(events):
+            self.take_reserved(len(events))
+        if self.id_limit - self.next_id < len(events):
+            block = max(ID_BLOCK, len(events))
+            self.next_id = self.storage.reserve_ids(block, self.next_id)
+            self.id_limit = self.next_id + block
+        for event in events:
+            event["id"] = self.next_id
+            self.next_id += 1
+        if self.id_limit - self.next_id < ID_BLOCK // 2:
+            self.reserve_ahead()
+
+    def reserve_ahead(self):
+        # The window asks for the next block before it needs it; the command
+        # line, which adds a record or two, reserves when it does.
+        if self.id_task is None and isinstance(self.events, list):
+            self.id_task = IdTask(self.storage, ID_BLOCK, max(self.next_id, self.id_limit))
+
+    def take_reserved(self, count):
+        task = self.id_task
+        if task is None or task.count < count:
+            return
+        self.id_task = None
+        task.wait()
+        if task.error is not None:
+            logging.error(f"Reserving event ids failed: {task.error}")
+        elif task.start >= self.next_id:
+            # Otherwise ids merged from another instance went past it.
+            self.next_id = task.start
+            self.id_limit = task.start + task.count
+
+    def note_ids(self, events):
+        # Merged events from another instance may lie above the current
+        # block; the next one is reserved past them.
+        highest = max((event["id"] for event in events), default=0)
+        if highest >= self.next_id:
+            self.next_id = highest + 1
+            self.id_limit = 0
+
+    def resolve_names(self, events):
+        # Events saved before a rename still carry the old name.
+        for event in events:
+            category_id = event.get("category_id")
+            if category_id is not None:
+                name = self.registry.name(category_id)
+                if name is not None and name != event["reason"]:
+                    event["reason"] = name
+
+    def reset_views(self):
+        self._aggregates = None
+        self._columns = None
+        self._search_index = None
+        self._currency_totals = None
+
+    def sync_totals(self):
+        self.finances["income"] = self._aggregates.income
+        self.finances["expenses"] = self._aggregates.expenses
+
+    def add(self, amount, reason, date, account=None):
+        event = self.make_event(amount, reason, date, account)
+        self.append_event(event)
+        return event
+
+    def make_event(self, amount, reason, date, account=None):
+        category = self.category(reason)
+        if category is None:
+            raise ValueError(f"Category {reason} not valid.")
+        datetime.strptime(date, "%d.%m.%Y")
+        event = {"type": category_event_type(category), "amount": amount, "reason": reason, "date": date, "category_id": category["id"]}
+        if account is not None:
+            self.set_account(event, account)
+        return event
+
+    def set_account(self, event, name):
+        account = self.account(name)
+        if account is None:
+            raise ValueError(f"Account {name} not valid.")
+        event["account"] = account["name"]
+        event["currency"] = account["currency"]
+        return event
+
+    def append_event(self, event):
+        with self.lock:
+            # Built first: built afterwards it would count the event twice.
+            aggregates = self.aggregates
+            row = len(self.events)
+            self.take_ids((event,))
+            self.events.append(event)
+            aggregates.add(event)
+            if self._currency_totals is not None:
+                self._currency_totals.add(event)
+            if self._columns is not None:
+                self._columns.append(event)
+            if self._search_index is not None:
+                self._search_index.extend(row)
+            self.sync_totals()
+            self.writer.submit({"op": "add", "event": event})
+            self.push_undo("add", {"op": "remove", "ids": [event["id"]]})
+
+    def append_events(self, events, settings=None):
+        # With settings (recurring occurrences and their rule state) the
+        # step is not undoable: the rules would materialize it again.
+        with self.lock:
+            aggregates = self.aggregates
+            row = len(self.events)
+            self.take_ids(events)
+            self.events.extend(events)
+            if settings is not None:
+                self.finances.update(settings)
+            for event in events:
+                aggregates.add(event)
+            if self._currency_totals is not None:
+                for event in events:
+                    self._currency_totals.add(event)
+            if self._columns is not None:
+                self._columns.extend(events)
+            if self._search_index is not None:
+                self._search_index.extend(row)
+            self.sync_totals()
+            record = {"op": "extend", "events": events}
+            if settings is not None:
+                record["settings"] = settings
+            self.writer.submit(record)
+            if settings is None:
+                self.push_undo("add", {"op": "remove", "ids": [event["id"] for event in events]})
+
+    def delete_event(self, index):
+        with self.lock:
+            event = self.events[index]
+            self.delete_events([event["id"]])
+        return event
+
+    def update_amount(self, index, amount):
+        with self.lock:
+            event_id = self.events[index]["id"]
+            inverse = self.apply_change({"op": "edit", "changes": [[event_id, {"amount": amount}]]})
+            # Typing an amount commits every keystroke; they undo as one step,
+            # and the writer merges them into one record.
+            top = self.undo_stack[-1] if self.undo_stack else None
+            if top is None or top["label"] != "amount" or top["change"]["changes"][0][0] != event_id:
+                self.push_undo("amount", inverse)
+            return self.events[index]
+
+    def positions(self, ids):
+        # id -> (position, event) for the ids that exist.
+        if not isinstance(self.events, list):
+            return self.events.find(ids)
+        return {found: (i, self.events[i]) for found, i in find_positions(self.events, ids).items()}
+
+    def event_ids(self, indexes):
+        return [self.events[index]["id"] for index in indexes]
+
+    def delete_events(self, ids):
+        return self.change("delete", {"op": "remove", "ids": list(ids)})
+
+    def recategorize(self, ids, reason):
+        category = self.category(reason)
+        if category is None:
+            raise ValueError(f"Category {reason} not valid.")
+        fields = {"type": category_event_type(category), "reason": category["name"], "category_id": category["id"]}
+        return self.change("recategorize", {"op": "edit", "changes": [[event_id, fields] for event_id in ids]})
+
+    def shift_dates(self, ids, days):
+        changes = []
+        for event_id, (_, event) in self.positions(ids).items():
+            shifted = datetime.strptime(event["date"], "%d.%m.%Y") + timedelta(days=days)
+            changes.append([event_id, {"date": shifted.strftime("%d.%m.%Y")}])
+        return self.change("shift", {"op": "edit", "changes": changes})
+
+    def change(self, label, operation):
+        # A batch is one step: one record for the writer (one journal line,
+        # one SQLite transaction) and one undo entry.
+        with self.lock:
+            inverse = self.apply_change(operation)
+            if inverse is not None:
+                self.push_undo(label, inverse)
+        return inverse is not None
+
+    def push_undo(self, label, change):
+        self.undo_serial += 1
+        self.undo_stack.append({"label": label, "change": change, "serial": self.undo_serial})
+        del self.undo_stack[:-UNDO_LIMIT]
+        self.redo_stack = []
+
+    def squash_undo(self, since, label):
+        # Folds the "add" steps pushed after serial since into one step
+        # labelled label, or into the one folded before.
+        steps = [step for step in self.undo_stack if step["serial"] > since]
+        if not steps or any(step["label"] not in ("add", label) for step in steps):
+            return
+        del self.undo_stack[-len(steps):]
+        ids = steps[0]["change"]["ids"]
+        for step in steps[1:]:
+            ids.extend(step["change"]["ids"])
+        self.undo_stack.append({"label": label, "change": {"op": "remove", "ids": ids}, "serial": steps[-1]["serial"]})
+
+    @property
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    @property
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def undo(self):
+        with self.lock:
+            if not self.undo_stack:
+                return None
+            step = self.undo_stack.pop()
+            inverse = self.apply_change(step["change"])
+            if inverse is not None:
+                self.redo_stack.append(dict(step, change=inverse))
+        return step["label"]
+
+    def redo(self):
+        with self.lock:
+            if not self.redo_stack:
+                return None
+            step = self.redo_stack.pop()
+            inverse = self.apply_change(step["change"])
+            if inverse is not None:
+                self.undo_stack.append(dict(step, change=inverse))
+        return step["label"]
+
+    def apply_change(self, operation, submit=True):
+        # Applies a remove, restore or edit operation by event id and
+        # returns the operation that reverts it, or None if no event matched.
+        # Changes merged from another instance are already saved (submit).
+        op = operation["op"]
+        with self.lock, metrics.time(f"change:{op}"):
+            # Built first, as in append_event.
+            self.aggregates
+            if op == "restore":
+                # Another instance may have put some back already.
+                present = self.positions([event["id"] for event in operation["events"]])
+                events = [event for event in operation["events"] if event["id"] not in present]
+                if not events:
+                    return None
+                operation = {"op": op, "events": events}
+                inverse = self.restore_events(events)
+            else:
+                found = self.positions([change[0] for change in operation["changes"]] if op == "edit" else operation["ids"])
+                if not found:
+                    return None
+                if op == "remove":
+                    operation = {"op": op, "ids": list(found)}
+                    inverse = self.remove_events(found)
+                else:
+                    operation = {"op": op, "changes": [change for change in operation["changes"] if change[0] in found]}
+                    inverse = self.edit_events(found, operation["changes"])
+            self.sync_totals()
+            if submit:
+                self.writer.submit(operation)
+        return inverse
+
+    def patch_views(self, count):
+        if count > VIEW_PATCH_LIMIT:
+            self._columns = None
+            self._search_index = None
+            return False
+        return True
+
+    def remove_events(self, found):
+        removed = sorted(found.values(), key=lambda item: item[0])
+        for _, event in removed:
+            self.aggregates.remove(event)
+            if self._currency_totals is not None:
+                self._currency_totals.remove(event)
+        patch = self.patch_views(len(removed))
+        if not isinstance(self.events, list):
+            self.events.remove(list(found))
+        elif patch:
+            for position, _ in reversed(removed):
+                del self.events[position]
+        else:
+            ids = set(found)
+            self.events[:] = [event for event in self.events if event["id"] not in ids]
+        if patch:
+            for position, _ in reversed(removed):
+                if self._search_index is not None:
+                    self._search_index.delete(position)
+                if self._columns is not None:
+                    self._columns.delete(position)
+        return {"op": "restore", "events": [event for _, event in removed]}
+
+    def restore_events(self, events):
+        events = sorted(events, key=lambda event: event["id"])
+        patch = self.patch_views(len(events))
+        if isinstance(self.events, list):
+            if patch:
+                for event in events:
+                    position = bisect.bisect_left(self.events, event["id"], key=lambda item: item["id"])
+                    self.events.insert(position, event)
+                    self.insert_view_row(position, event)
+            else:
+                self.events[:] = merge_by_id(self.events, events)
+        else:
+            self.events.restore(events)
+            if patch:
+                for event_id, (position, event) in sorted(self.events.find([event["id"] for event in events]).items()):
+                    self.insert_view_row(position, event)
+        for event in events:
+            self.aggregates.add(event)
+            if self._currency_totals is not None:
+                self._currency_totals.add(event)
+        return {"op": "remove", "ids": [event["id"] for event in events]}
+
+    def insert_view_row(self, position, event):
+        if self._columns is not None:
+            self._columns.insert(position, event)
+        if self._search_index is not None:
+            self._search_index.insert_row(position)
+
+    def edit_events(self, found, changes):
+        patch = self.patch_views(len(changes))
+        reverted = []
+        for changed_id, fields in changes:
+            position, event = found[changed_id]
+            reverted.append([changed_id, {key: event.get(key) for key in fields}])
+            self.aggregates.remove(event)
+            if self._currency_totals is not None:
+                self._currency_totals.remove(event)
+            update_fields(event, fields)
+            self.aggregates.add(event)
+            if self._currency_totals is not None:
+                self._currency_totals.add(event)
+            if patch:
+                if self._search_index is not None:
+                    self._search_index.update(position, fields)
+                if self._columns is not None:
+                    self._columns.update(position, event)
+        if not isinstance(self.events, list):
+            self.events.edit(changes)
+        return {"op": "edit", "changes": reverted}
+
+    def update_settings(self, settings):
+        with self.lock:
+            self.finances.update(settings)
+            self.writer.submit({"op": "settings", "settings": settings})
+
+    def add_rule(self, amount, reason, frequency, start, end=None, interval=1, account=None):
+        category = self.category(reason)
+        if category is None:
+            raise ValueError(f"Category {reason} not valid.")
+        rule_id = max((rule["id"] for rule in self.rules), default=0) + 1
+        rule = make_rule(rule_id, category, category_event_type(category), amount, frequency, start, end, interval)
+        if account is not None:
+            self.set_account(rule, account)
+        self.update_settings({"recurring": self.rules + [rule]})
+        self.materialize()
+        # materialize replaces rules with copies whose next date moved on.
+        return next(rule for rule in self.rules if rule["id"] == rule_id)
+
+    def delete_rule(self, rule_id):
+        # Occurrences already in the ledger stay; only future ones stop.
+        self.update_settings({"recurring": [rule for rule in self.rules if rule["id"] != rule_id]})
+
+    def materialize(self, until=None):
+        # Rules are expanded lazily, never past today: all occurrences due
+        # since the last run are appended together with the advanced rule
+        # state as one journal record.
+        today = Date.today()
+        until = today if until is None else min(until, today)
+        with self.lock:
+            if not any(rule.get("next") is not None and parse_date(rule["next"]) <= until for rule in self.rules):
+                return []
+            with metrics.time("materialize"):
+                expanded = []
+
+                def expand(progress):
+                    # Runs with the storage locked, from wherever any
+                    # instance got to: two opened at once don't both add
+                    # the same occurrences.
+                    expanded[:] = due(resume(self.rules, progress), until)
+                    return dict(progress, **{rule_key(rule): rule.get("next") for rule in expanded[1]})
+
+                self.storage.update_rule_progress(expand)
+                events, rules = expanded
+                self.resolve_names(events)
+                if events:
+                    self.append_events(events, {"recurring": rules})
+                elif rules != self.rules:
+                    self.update_settings({"recurring": rules})
+        return events
+
+    def upcoming(self, start, end):
+        return upcoming(self.rules, parse_date(start), parse_date(end))
+
+    def set_budget(self, category_id, amount):
+        budgets = dict(self.budgets)
+        if amount:
+            budgets[str(category_id)] = amount
+        else:
+            budgets.pop(str(category_id), None)
+        self.update_settings({"budgets": budgets})
+
+    def budget_status(self, month=None):
+        # One lookup per budget in the month series Aggregates keeps up to
+        # date on every change.
+        month = month or month_key(Date.today())
+        status = []
+        for category_id, budget in self.budgets.items():
+            category = self.registry.by_id.get(int(category_id))
+            if category is None or category.get("deleted"):
+                continue
+            series = self.aggregates.series.get(("month", category_event_type(category), category["name"]))
+            actual = series.get(month, 0.0) if series is not None else 0.0
+            status.append({"category": category["name"], "budget": budget, "actual": actual, "remaining": budget - actual})
+        return status
+
+    def query(self, offset=0, limit=None, **filters):
+        from finance_search import PAGE_SIZE
+        if filters.get("end"):
+            self.materialize(parse_date(filters["end"]))
+        limit = PAGE_SIZE if limit is None else limit
+        if not isinstance(self.events, list):
+            # SQLite pages through its own indexes rather than loading every
+            # event into the in-memory search index.
+            total, ids = self.storage.query(offset=offset, limit=limit, **self.category_filters(**filters))
+            return total, self.events.positions(ids)
+        total, positions = self.search_index.query(offset, limit, **filters)
+        return total, positions.tolist()
+
+    def category_filters(self, reason=None, text=None, **filters):
+        # reason/text -> the ids and names of the matching categories,
+        # deleted ones included since their events keep the id.
+        if reason is None and not text:
+            return filters
+        names = [reason] if reason is not None else [category["name"] for category in self.registry.all]
+        if text:
+            needle = text.casefold()
+            names = [name for name in names if needle in name.casefold()]
+        filters["category_ids"] = [category["id"] for category in self.registry.all
+                                   if category["name"] in names and "id" in category]
+        filters["reasons"] = names
+        return filters
+
+    def scan(self, **filters):
+        if filters.get("end"):
+            self.materialize(parse_date(filters["end"]))
+        for index, event in enumerate(self.events):
+            if event_matches(event, **filters):
+                yield index, event
+
+    def import_statement(self, path, append=None, **options):
+        # append adds each batch; the window passes one that also tells its
+        # table model about the new rows.
+        from finance_import import import_statement
+        append = append or self.append_events
+        since = self.undo_serial
+
+        def append_batch(events):
+            # Each batch is folded in as it lands: left for the end, the
+            # batches of a long import would push its first ones (and every
+            # older step) off the stack.
+            with self.lock:
+                append(events)
+                self.squash_undo(since, "import")
+
+        return import_statement(path, self.categories, append_batch, **options)
+
+    def start_report(self, path, level="month", fmt="csv", workers=None, start=None, end=None):
+        from finance_reports import ReportJob
+        # The job copies the columns it needs, so later edits don't race it.
+        with self.lock:
+            return ReportJob(self.columns, path, level, fmt, workers, start, end)
+
+    def flush(self):
+        self.writer.flush()
+
+    def save(self):
+        with metrics.time("save"):
+            self.writer.flush()
+            self.storage.save(self.finances)
+        self.update_gauges()
+
+    def update_gauges(self):
+        if not metrics.enabled:
+            return
+        metrics.gauge("events", len(self.events))
+        metrics.gauge("categories", len(self.categories))
+        if self.writer is not None:
+            for name, value in self.writer.stats().items():
+                metrics.gauge(f"write_{name}", value)
+        for path, size in self.storage.file_sizes().items():
+            metrics.gauge(f"file_bytes:{os.path.basename(path)}", size)
+
+    def close(self):
+        if self.load_task is not None:
+            # Closing over a half-loaded ledger could compact the empty
+            # placeholder over the real snapshot.
+            self.load_task.wait()
+            if self.load_task.error is None:
+                self.finish_load()
+        if self.id_task is not None:
+            # Not cut off halfway through writing the stamp.
+            self.id_task.wait()
+        self.writer.close()
+
+
+def add_filter_arguments(parser):
+    parser.add_argument("--from", dest="start", help="first date, dd.MM.yyyy")
+    parser.add_argument("--to", dest="end", help="last date, dd.MM.yyyy")
+    parser.add_argument("--min", dest="min_amount", type=float)
+    parser.add_argument("--max", dest="max_amount", type=float)
+    parser.add_argument("--type", dest="event_type", choices=("income", "expense"))
+    parser.add_argument("--category", dest="reason")
+    parser.add_argument("--text", help="substring of the reason, case-insensitive")
+
+
+def filters_from_args(args):
+    names = ("start", "end", "min_amount", "max_amount", "event_type", "reason", "text")
+    return {name: getattr(args, name) for name in names if getattr(args, name) is not None}
+
+
+def format_event(event):
+    return f"{event.get('id', '-')}\t{event['date']}\t{event['type']}\t{event['reason']}\t{event['amount']}"
+
+
+def format_rule(rule):
+    every = rule["frequency"] if rule["interval"] == 1 else f"every {rule['interval']} {rule['frequency']}"
+    return f"{rule['id']}\t{rule['reason']}\t{rule['amount']}\t{every}\t{rule['start']}\t{rule['end'] or ''}\tnext {rule['next'] or '-'}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Add, query, report and export finance records without the GUI.")
+    parser.add_argument("--storage", default=STORAGE_MODE, choices=("json", "journal", "binary", "sqlite"))
+    parser.add_argument("--data", default=DATA_FILE)
+    parser.add_argument("--categories", default=CATEGORY_FILE)
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--metrics", metavar="FILE", help="write timings and gauges as JSON to FILE")
+    parser.add_argument("--profile", metavar="FILE", help="run under cProfile and write the stats to FILE")
+    parser.add_argument("--rates", default=RATES_FILE, help="exchange rates CSV with date,currency,rate columns")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = commands.add_parser("add", help="record an income or expense")
+    add_parser.add_argument("amount", type=float)
+    add_parser.add_argument("category")
+    add_parser.add_argument("--date", default=Date.today().strftime("%d.%m.%Y"), help="dd.MM.yyyy, default today")
+    add_parser.add_argument("--account", help="default: the first account")
+
+    delete_parser = commands.add_parser("delete", help="delete records by id")
+    delete_parser.add_argument("ids", type=int, nargs="+")
+
+    recategorize_parser = commands.add_parser("recategorize", help="move records to another category")
+    recategorize_parser.add_argument("category")
+    recategorize_parser.add_argument("ids", type=int, nargs="+")
+
+    shift_parser = commands.add_parser("shift", help="move the dates of records by a number of days")
+    shift_parser.add_argument("days", type=int)
+    shift_parser.add_argument("ids", type=int, nargs="+")
+
+    query_parser = commands.add_parser("query", help="list matching records")
+    add_filter_arguments(query_parser)
+    query_parser.add_argument("--offset", type=int, default=0)
+    query_parser.add_argument("--limit", type=int, default=100)
+
+    report_parser = commands.add_parser("report", help="totals by category and period")
+    report_parser.add_argument("--period", choices=PERIODS, default="month")
+
+    recur_parser = commands.add_parser("recur", help="add a recurring income or expense")
+    recur_parser.add_argument("amount", type=float)
+    recur_parser.add_argument("category")
+    recur_parser.add_argument("--every", dest="frequency", choices=FREQUENCIES, default="monthly")
+    recur_parser.add_argument("--interval", type=int, default=1, help="every N days, weeks or months")
+    recur_parser.add_argument("--start", default=Date.today().strftime("%d.%m.%Y"), help="dd.MM.yyyy, default today")
+    recur_parser.add_argument("--end", help="last possible date, dd.MM.yyyy")
+    recur_parser.add_argument("--account", help="default: the first account")
+
+    rules_parser = commands.add_parser("rules", help="list recurring rules")
+    rules_parser.add_argument("--upcoming", metavar="DATE", help="also list occurrences due until DATE, dd.MM.yyyy")
+
+    unrecur_parser = commands.add_parser("unrecur", help="stop a recurring rule")
+    unrecur_parser.add_argument("rule_id", type=int)
+
+    budget_parser = commands.add_parser("budget", help="set a monthly budget for a category, 0 to remove it")
+    budget_parser.add_argument("category")
+    budget_parser.add_argument("amount", type=float)
+
+    budgets_parser = commands.add_parser("budgets", help="budgets against actual totals for a month")
+    budgets_parser.add_argument("--month", help="yyyy-MM, default this month")
+
+    accounts_parser = commands.add_parser("accounts", help="per-account and consolidated totals")
+    accounts_parser.add_argument("--currency", help="report in this currency and keep it as the default")
+
+    account_parser = commands.add_parser("account", help="add an account")
+    account_parser.add_argument("name")
+    account_parser.add_argument("currency", help="ISO 4217 code, e.g. EUR")
+
+    export_parser = commands.add_parser("export", help="write matching records as CSV or JSON")
+    add_filter_arguments(export_parser)
+    export_parser.add_argument("output", help="output file, - for stdout")
+    export_parser.add_argument("--format", choices=("csv", "json"), default="csv")
+
+    args = parser.parse_args(argv)
+    if args.metrics:
+        metrics.enabled = True
+    if args.profile:
+        metrics.start_profile()
+    try:
+        with metrics.time(f"command:{args.command}"):
+            return run_command(args)
+    finally:
+        if args.profile:
+            metrics.stop_profile(args.profile)
+        if args.metrics:
+            metrics.export(args.metrics)
+
+
+def run_command(args):
+    ledger = Ledger.open(args.storage, args.data, args.categories, args.db, rates_path=args.rates)
+    try:
+        if args.command == "add":
+            try:
+                event = ledger.add(args.amount, args.category, args.date, args.account)
+            except ValueError as e:
+                print(e, file=sys.stderr)
+                return 1
+            print(format_event(event))
+
+        elif args.command in ("delete", "recategorize", "shift"):
+            # Each is one change, written once, however many ids it names.
+            try:
+                if args.command == "delete":
+                    changed = ledger.delete_events(args.ids)
+                elif args.command == "recategorize":
+                    changed = ledger.recategorize(args.ids, args.category)
+                else:
+                    changed = ledger.shift_dates(args.ids, args.days)
+            except ValueError as e:
+                print(e, file=sys.stderr)
+                return 1
+            if not changed:
+                print("No records with these ids.", file=sys.stderr)
+                return 1
+
+        elif args.command == "query":
+            total = 0
+            for _, event in ledger.scan(**filters_from_args(args)):
+                if args.offset <= total < args.offset + args.limit:
+                    print(format_event(event))
+                total += 1
+            print(f"{total} matching records", file=sys.stderr)
+
+        elif args.command == "report":
+            aggregates = ledger.aggregates
+            print(f"Income\t{aggregates.income}")
+            print(f"Expenses\t{aggregates.expenses}")
+            print(f"Balance\t{aggregates.balance}")
+            for event_type in ("income", "expense"):
+                print(f"\n{event_type.capitalize()} by category")
+                for reason, total in aggregates.category_totals(event_type):
+                    print(f"{reason}\t{total}")
+            print(f"\nBy {args.period}\tincome\texpense\tbalance")
+            income = dict(aggregates.series_points(args.period, "income"))
+            expenses = dict(aggregates.series_points(args.period, "expense"))
+            for bucket, balance in aggregates.running_balance(args.period):
+                print(f"{bucket}\t{income.get(bucket, 0)}\t{expenses.get(bucket, 0)}\t{balance}")
+
+        elif args.command == "recur":
+            try:
+                rule = ledger.add_rule(args.amount, args.category, args.frequency, args.start, args.end, args.interval, args.account)
+            except ValueError as e:
+                print(e, file=sys.stderr)
+                return 1
+            print(format_rule(rule))
+
+        elif args.command == "rules":
+            for rule in ledger.rules:
+                print(format_rule(rule))
+            if args.upcoming:
+                for event in ledger.upcoming(Date.today().strftime("%d.%m.%Y"), args.upcoming):
+                    print(format_event(event))
+
+        elif args.command == "unrecur":
+            ledger.delete_rule(args.rule_id)
+
+        elif args.command == "budget":
+            category = ledger.category(args.category)
+            if category is None:
+                print(f"Category {args.category} not valid.", file=sys.stderr)
+                return 1
+            ledger.set_budget(category["id"], args.amount)
+
+        elif args.command == "budgets":
+            for status in ledger.budget_status(args.month):
+                print(f"{status['category']}\t{status['budget']}\t{status['actual']}\t{status['remaining']}")
+
+        elif args.command == "accounts":
+            if args.currency:
+                try:
+                    ledger.set_reporting_currency(args.currency.upper())
+                except ValueError as e:
+                    print(e, file=sys.stderr)
+                    return 1
+            print(f"Account\tcurrency\tincome\texpenses\tbalance ({ledger.reporting_currency})")
+            for row in ledger.account_balances():
+                print(f"{row['account'] or 'All'}\t{row['currency'] or ''}\t{row['income']:.2f}\t{row['expenses']:.2f}\t{row['balance']:.2f}")
+            for currency in sorted(ledger.currency_totals.missing):
+                print(f"No exchange rate for {currency}; its amounts are left out.", file=sys.stderr)
+
+        elif args.command == "account":
+            try:
+                ledger.add_account(args.name, args.currency)
+            except ValueError as e:
+                print(e, file=sys.stderr)
+                return 1
+
+        elif args.command == "export":
+            events = (dict(event, account=ledger.account_of(event), currency=ledger.currency_of(event))
+                      for _, event in ledger.scan(**filters_from_args(args)))
+            output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+            try:
+                if args.format == "csv":
+                    writer = csv.writer(output)
+                    writer.writerow(EXPORT_FIELDS)
+                    writer.writerows([event[field] for field in EXPORT_FIELDS] for event in events)
+                else:
+                    json.dump([{field: event[field] for field in EXPORT_FIELDS} for event in events], output, ensure_ascii=False)
+            finally:
+                if output is not sys.stdout:
+                    output.close()
+    finally:
+        ledger.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# Upper bucket bounds in milliseconds; the last bucket catches everything.
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+TRACEMALLOC_FRAMES = 10
+
+
+def env_enabled(name):
+    return os.environ.get(name, "").strip().lower() not in ("", "0", "false", "no")
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS_MS)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, ms):
+        for i, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.total += ms
+        self.min = min(self.min, ms)
+        self.max = max(self.max, ms)
+
+    def percentile(self, q):
+        # Bucket resolution is plenty to tell a 5 ms path from a 500 ms one.
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for count, bound in zip(self.buckets, BUCKETS_MS):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total,
+            "mean_ms": self.total / self.count if self.count else 0.0,
+            "min_ms": self.min if self.count else 0.0,
+            "max_ms": self.max,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "buckets": {str(bound): count for bound, count in zip(BUCKETS_MS, self.buckets) if count},
+        }
+
+
+class Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class Metrics:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        # The write-behind thread records too.
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.gauges = {}
+        self.profiler = None
+
+    def time(self, name):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return Timer(self, name)
+
+    def timed(self, name):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.time(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds * 1000)
+
+    def gauge(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.gauges[name] = value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "timestamp": time.time(),
+                "timings": {name: histogram.to_dict() for name, histogram in sorted(self.histograms.items())},
+                "gauges": dict(sorted(self.gauges.items())),
+                "profiling": self.profiler is not None,
+                "tracemalloc": tracemalloc.is_tracing(),
+            }
+
+    def export(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.gauges = {}
+
+    def start_profile(self):
+        import cProfile
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop_profile(self, path):
+        # The result opens with pstats or snakeviz.
+        if self.profiler is None:
+            raise RuntimeError("Profiling is not running")
+        self.profiler.disable()
+        self.profiler.dump_stats(path)
+        self.profiler = None
+
+    def dump_tracemalloc(self, path):
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running; start with FINANCE_TRACEMALLOC=1")
+        tracemalloc.take_snapshot().dump(path)
+
+
+metrics = Metrics(env_enabled("FINANCE_METRICS"))
+if env_enabled("FINANCE_TRACEMALLOC"):
+    tracemalloc.start(TRACEMALLOC_FRAMES)
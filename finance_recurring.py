@@ -0,0 +1,130 @@
+import calendar
+from datetime import date, datetime, timedelta
+
+FREQUENCIES = ("daily", "weekly", "monthly")
+
+
+def parse_date(text):
+    try:
+        return datetime.strptime(text, "%d.%m.%Y").date()
+    except ValueError:
+        raise ValueError(f"Invalid date {text}, expected dd.MM.yyyy") from None
+
+
+def format_date(day):
+    return f"{day.day:02d}.{day.month:02d}.{day.year}"
+
+
+def month_key(day):
+    return f"{day.year}-{day.month:02d}"
+
+
+def occurrences(rule, first, last):
+    # Dates of rule from first to last inclusive. Monthly rules keep the
+    # day of month they started on, falling back to the last day of
+    # shorter months.
+    start = parse_date(rule["start"])
+    end = parse_date(rule["end"]) if rule.get("end") else None
+    if end is not None and end < last:
+        last = end
+    interval = rule.get("interval", 1)
+    if rule["frequency"] == "monthly":
+        months = max(0, (first.year - start.year) * 12 + first.month - start.month)
+        months -= months % interval
+        while True:
+            year, month = divmod(start.month - 1 + months, 12)
+            year += start.year
+            day = date(year, month + 1, min(start.day, calendar.monthrange(year, month + 1)[1]))
+            if day > last:
+                return
+            if day >= first:
+                yield day
+            months += interval
+    else:
+        step = interval * (7 if rule["frequency"] == "weekly" else 1)
+        skipped = max(0, (first - start).days)
+        day = start + timedelta(days=-(-skipped // step) * step)
+        while day <= last:
+            yield day
+            day += timedelta(days=step)
+
+
+def rule_event(rule, day):
+    event = {"type": rule["type"], "amount": rule["amount"], "reason": rule["reason"], "date": format_date(day)}
+    if rule.get("category_id") is not None:
+        event["category_id"] = rule["category_id"]
+    if rule.get("account") is not None:
+        event["account"] = rule["account"]
+        event["currency"] = rule["currency"]
+    return event
+
+
+def due(rules, until):
+    # Events for every occurrence up to until that hasn't been materialized
+    # yet, and the rules with their next date moved past it. The input rules
+    # are left alone, so the caller can publish both in one write.
+    events = []
+    updated = []
+    for rule in rules:
+        if rule.get("next") is None:
+            updated.append(rule)
+            continue
+        first = parse_date(rule["next"])
+        last_day = None
+        for day in occurrences(rule, first, until):
+            events.append(rule_event(rule, day))
+            last_day = day
+        if last_day is None:
+            updated.append(rule)
+            continue
+        following = next(occurrences(rule, last_day + timedelta(days=1), date.max), None)
+        updated.append(dict(rule, next=format_date(following) if following is not None else None))
+    return events, updated
+
+
+def rule_key(rule):
+    return f"{rule['id']}:{rule['start']}"
+
+
+def resume(rules, progress):
+    # Rules with next moved on to wherever any instance expanded them to;
+    # progress maps rule_key to that date, or to None once a rule ended.
+    resumed = []
+    for rule in rules:
+        key = rule_key(rule)
+        if rule.get("next") is not None and key in progress:
+            reached = progress[key]
+            if reached is None or parse_date(reached) > parse_date(rule["next"]):
+                rule = dict(rule, next=reached)
+        resumed.append(rule)
+    return resumed
+
+
+def upcoming(rules, first, last):
+    # Projected occurrences that are not in the ledger yet, without
+    # changing anything.
+    events = []
+    for rule in rules:
+        if rule.get("next") is None:
+            continue
+        start = max(first, parse_date(rule["next"]))
+        events.extend(rule_event(rule, day) for day in occurrences(rule, start, last))
+    events.sort(key=lambda event: parse_date(event["date"]))
+    return events
+
+
+def make_rule(rule_id, category, event_type, amount, frequency, start, end=None, interval=1):
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"Invalid frequency: {frequency}")
+    if interval < 1:
+        raise ValueError(f"Invalid interval: {interval}")
+    if amount <= 0:
+        raise ValueError(f"Invalid amount: {amount}")
+    first = parse_date(start)
+    if end is not None and parse_date(end) < first:
+        raise ValueError(f"End date {end} is before the start date {start}")
+    return {
+        "id": rule_id, "type": event_type, "amount": amount, "reason": category["name"],
+        "category_id": category.get("id"), "frequency": frequency, "interval": interval,
+        "start": start, "end": end, "next": start,
+    }
@@ -0,0 +1,259 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from finance_columns import TYPES
+from finance_metrics import metrics
+
+LEVELS = ("month", "year", "category")
+FIELDS = {
+    "month": ("month", "type", "category", "total", "count"),
+    "year": ("year", "income", "expenses", "balance", "count"),
+    "category": ("year", "type", "category", "total", "count"),
+}
+FORMATS = ("csv", "json")
+PARTITION_ROWS = 250000
+# Aggregating the columns costs about 0.1 us per row, so below this a
+# worker pool takes longer to start than it saves.
+PARALLEL_THRESHOLD = 5000000
+# Room for every int16 reason code in a packed key.
+REASON_SPAN = 1 << 16
+
+
+def month_numbers(days):
+    # Days since 1970-01-01 -> months since 1970-01.
+    return days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+
+def reduce_keys(keys, totals, counts):
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=totals, minlength=len(unique)), np.bincount(inverse, weights=counts, minlength=len(unique))
+
+
+def aggregate_partition(amounts, days, types, reasons):
+    # Runs in a worker process: totals and counts per (month, type, reason),
+    # packed into one int64 key so merging is a sort and a bincount.
+    keys = (month_numbers(days) * len(TYPES) + types) * REASON_SPAN + reasons
+    return reduce_keys(keys, amounts, np.ones(len(keys)))
+
+
+def partitions(years, partition_rows=PARTITION_ROWS):
+    # Row indexes grouped by year; long years are split further so the
+    # workers get similar amounts of work.
+    order = np.argsort(years, kind="stable")
+    bounds = np.flatnonzero(np.diff(years[order])) + 1
+    for group in np.split(order, bounds):
+        for start in range(0, len(group), partition_rows):
+            yield group[start:start + partition_rows]
+
+
+class ReportSummary:
+    # Merged totals per (period, type, reason); periods are months or years
+    # since 1970.
+    def __init__(self, keys, totals, counts, names, period="month"):
+        self.periods = keys // REASON_SPAN // len(TYPES)
+        self.types = keys // REASON_SPAN % len(TYPES)
+        self.reasons = keys % REASON_SPAN
+        self.totals = totals
+        self.counts = counts.astype(np.int64)
+        self.names = names
+        self.period = period
+
+    def by_year(self):
+        keys = ((self.periods // 12) * len(TYPES) + self.types) * REASON_SPAN + self.reasons
+        return ReportSummary(*reduce_keys(keys, self.totals, self.counts), self.names, "year")
+
+    def label(self, period):
+        if self.period == "year":
+            return str(1970 + period)
+        year, month = divmod(period, 12)
+        return f"{1970 + year}-{month + 1:02d}"
+
+    def rows(self, level):
+        if level == "year":
+            return self.by_year().year_rows()
+        if level == "category":
+            return self.by_year().category_rows()
+        return self.category_rows()
+
+    def category_rows(self):
+        # Period, then income before expense, then category name.
+        rank = np.argsort(np.argsort(self.names)) if self.names else np.zeros(0, dtype=np.int64)
+        for i in np.lexsort((rank[self.reasons], self.types, self.periods)):
+            yield {
+                self.period: self.label(int(self.periods[i])),
+                "type": TYPES[self.types[i]],
+                "category": self.names[self.reasons[i]],
+                "total": round(float(self.totals[i]), 2),
+                "count": int(self.counts[i]),
+            }
+
+    def year_rows(self):
+        income_type = TYPES.index("income")
+        for period in np.unique(self.periods):
+            selected = self.periods == period
+            income = float(self.totals[selected & (self.types == income_type)].sum())
+            expenses = float(self.totals[selected & (self.types != income_type)].sum())
+            yield {
+                "year": self.label(int(period)),
+                "income": round(income, 2),
+                "expenses": round(expenses, 2),
+                "balance": round(income - expenses, 2),
+                "count": int(self.counts[selected].sum()),
+            }
+
+
+def write_rows(rows, output, fmt, fields):
+    # One row at a time, so a report never exists in memory as a whole.
+    if fmt == "csv":
+        writer = csv.writer(output)
+        writer.writerow(fields)
+        for row in rows:
+            writer.writerow([row[field] for field in fields])
+        return
+    output.write("[")
+    separator = "\n"
+    for row in rows:
+        output.write(separator + json.dumps(row, ensure_ascii=False))
+        separator = ",\n"
+    output.write("\n]\n")
+
+
+class ReportJob:
+    # Builds a report on a background thread from a snapshot of the ledger
+    # columns; the owner polls fraction and done, and may cancel().
+    def __init__(self, columns, path, level="month", fmt="csv", workers=None, start=None, end=None):
+        if level not in LEVELS:
+            raise ValueError(f"Unknown report level: {level}")
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown report format: {fmt}")
+        selected = columns.mask(start=start, end=end)
+        self.amounts = columns.amounts[selected]
+        self.days = columns.days[selected]
+        self.types = columns.types[selected]
+        self.reasons = columns.reasons[selected]
+        self.names = list(columns.names)
+        self.path = path
+        self.level = level
+        self.fmt = fmt
+        if workers is None:
+            workers = (os.cpu_count() or 1) if len(self.amounts) >= PARALLEL_THRESHOLD else 1
+        self.workers = workers
+        self.fraction = 0.0
+        self.rows_written = 0
+        self.error = None
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="finance-report", daemon=True)
+        self.thread.start()
+
+    @property
+    def done(self):
+        return not self.thread.is_alive()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def wait(self):
+        self.thread.join()
+
+    def run(self):
+        started = time.perf_counter()
+        try:
+            summary = self.summarize()
+            if summary is not None:
+                self.write(summary)
+        except Exception as e:
+            self.error = e
+        metrics.observe("report", time.perf_counter() - started)
+
+    def summarize(self):
+        parts = list(partitions(month_numbers(self.days) // 12))
+        arguments = [(self.amounts[part], self.days[part], self.types[part], self.reasons[part]) for part in parts]
+        results = []
+        if self.workers <= 1:
+            for i, argument in enumerate(arguments):
+                if self.cancelled.is_set():
+                    return None
+                results.append(aggregate_partition(*argument))
+                self.fraction = 0.9 * (i + 1) / len(arguments)
+        else:
+            # spawn rather than fork: the GUI process has Qt and writer
+            # threads that a forked child must not inherit.
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(min(self.workers, len(arguments)), mp_context=context) as executor:
+                pending = {executor.submit(aggregate_partition, *argument) for argument in arguments}
+                while pending:
+                    finished, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                    results.extend(future.result() for future in finished)
+                    self.fraction = 0.9 * len(results) / len(arguments)
+                    if self.cancelled.is_set():
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        return None
+        if not results:
+            return ReportSummary(np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0), self.names)
+        keys, totals, counts = reduce_keys(*(np.concatenate(column) for column in zip(*results)))
+        return ReportSummary(keys, totals, counts, self.names)
+
+    def write(self, summary):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+                write_rows(self.counted(summary.rows(self.level)), f, self.fmt, FIELDS[self.level])
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if self.cancelled.is_set():
+            os.remove(tmp_path)
+            return
+        os.replace(tmp_path, self.path)
+        self.fraction = 1.0
+
+    def counted(self, rows):
+        for row in rows:
+            if self.cancelled.is_set():
+                return
+            self.rows_written += 1
+            yield row
+
+
+def main(argv=None):
+    from finance_ledger import CATEGORY_FILE, DATA_FILE, DB_FILE, STORAGE_MODE, Ledger
+
+    parser = argparse.ArgumentParser(description="Write per-month, per-year or per-category statements as CSV or JSON.")
+    parser.add_argument("output", help="output file")
+    parser.add_argument("--level", choices=LEVELS, default="month")
+    parser.add_argument("--format", choices=FORMATS, help="default: from the output file extension")
+    parser.add_argument("--workers", type=int, help="worker processes, default: one per CPU for very large ledgers")
+    parser.add_argument("--from", dest="start", help="first date, dd.MM.yyyy")
+    parser.add_argument("--to", dest="end", help="last date, dd.MM.yyyy")
+    parser.add_argument("--storage", default=STORAGE_MODE, choices=("json", "journal", "binary", "sqlite"))
+    parser.add_argument("--data", default=DATA_FILE)
+    parser.add_argument("--categories", default=CATEGORY_FILE)
+    parser.add_argument("--db", default=DB_FILE)
+    args = parser.parse_args(argv)
+    fmt = args.format or ("json" if args.output.endswith(".json") else "csv")
+
+    ledger = Ledger.open(args.storage, args.data, args.categories, args.db)
+    try:
+        job = ledger.start_report(args.output, args.level, fmt, args.workers, args.start, args.end)
+        job.wait()
+    finally:
+        ledger.close()
+    if job.error is not None:
+        print(job.error, file=sys.stderr)
+        return 1
+    print(f"{job.rows_written} rows written to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+import numpy as np
+
+from finance_columns import TYPES
+
+PAGE_SIZE = 500
+
+
+def merge_sorted(positions, keys, new_positions, new_keys):
+    order = np.argsort(new_keys, kind="stable")
+    # side="right" keeps equal keys in position order, since new positions
+    # are appended after the existing ones.
+    at = np.searchsorted(keys, new_keys[order], side="right")
+    return np.insert(positions, at, new_positions[order]), np.insert(keys, at, new_keys[order])
+
+
+def locate(positions, keys, key, position):
+    # Equal keys are kept in position order, so (key, position) is found by
+    # binary search within the run of equal keys.
+    low = np.searchsorted(keys, key, "left")
+    high = np.searchsorted(keys, key, "right")
+    return low + np.searchsorted(positions[low:high], position)
+
+
+def move(positions, keys, position, old_key, new_key):
+    # Shifts only the entries between the old and the new slot.
+    at = locate(positions, keys, old_key, position)
+    to = locate(positions, keys, new_key, position)
+    if to > at:
+        to -= 1
+        positions[at:to] = positions[at + 1:to + 1]
+        keys[at:to] = keys[at + 1:to + 1]
+    else:
+        positions[to + 1:at + 1] = positions[to:at]
+        keys[to + 1:at + 1] = keys[to:at]
+    positions[to] = position
+    keys[to] = new_key
+
+
+class EventIndex:
+    def __init__(self, columns):
+        self.columns = columns
+        self.rebuild()
+
+    def rebuild(self):
+        columns = self.columns
+        self.by_day = np.argsort(columns.days, kind="stable")
+        self.day_keys = columns.days[self.by_day]
+        self.by_amount = np.argsort(columns.amounts, kind="stable")
+        self.amount_keys = columns.amounts[self.by_amount]
+        self.postings = {}
+        self.add_postings(np.arange(len(columns)))
+
+    def add_postings(self, positions):
+        codes = self.columns.reasons[positions]
+        for code in np.unique(codes):
+            new = positions[codes == code]
+            posting = self.postings.get(int(code))
+            if posting is None:
+                self.postings[int(code)] = new
+            else:
+                self.postings[int(code)] = np.insert(posting, np.searchsorted(posting, new), new)
+
+    def insert(self, positions):
+        columns = self.columns
+        self.by_day, self.day_keys = merge_sorted(self.by_day, self.day_keys, positions, columns.days[positions])
+        self.by_amount, self.amount_keys = merge_sorted(self.by_amount, self.amount_keys, positions, columns.amounts[positions])
+        self.add_postings(positions)
+
+    def remove_posting(self, code, position):
+        posting = self.postings.get(code)
+        if posting is None:
+            return
+        at = np.searchsorted(posting, position)
+        if at < len(posting) and posting[at] == position:
+            posting = np.delete(posting, at)
+            if len(posting):
+                self.postings[code] = posting
+            else:
+                del self.postings[code]
+
+    def extend(self, start):
+        # Events from start to the end of the columns were just appended.
+        self.insert(np.arange(start, len(self.columns)))
+
+    def delete(self, position):
+        # Called before the columns drop the row at position.
+        columns = self.columns
+        at = locate(self.by_day, self.day_keys, columns.days[position], position)
+        self.by_day, self.day_keys = np.delete(self.by_day, at), np.delete(self.day_keys, at)
+        at = locate(self.by_amount, self.amount_keys, columns.amounts[position], position)
+        self.by_amount, self.amount_keys = np.delete(self.by_amount, at), np.delete(self.amount_keys, at)
+        self.remove_posting(int(columns.reasons[position]), position)
+        # Subtracting the comparison itself avoids a masked scatter.
+        for positions in (self.by_day, self.by_amount, *self.postings.values()):
+            positions -= positions > position
+
+    def insert_row(self, position):
+        # Called after the columns got a new row at position.
+        columns = self.columns
+        for positions in (self.by_day, self.by_amount, *self.postings.values()):
+            positions += positions >= position
+        day, amount = columns.days[position], columns.amounts[position]
+        at = locate(self.by_day, self.day_keys, day, position)
+        self.by_day, self.day_keys = np.insert(self.by_day, at, position), np.insert(self.day_keys, at, day)
+        at = locate(self.by_amount, self.amount_keys, amount, position)
+        self.by_amount, self.amount_keys = np.insert(self.by_amount, at, position), np.insert(self.amount_keys, at, amount)
+        self.add_postings(np.array([position]))
+
+    def update(self, position, fields):
+        # Called before the columns take fields for position: only the
+        # orders whose key changes are touched.
+        columns = self.columns
+        if "date" in fields:
+            move(self.by_day, self.day_keys, position, columns.days[position], columns.day(fields["date"]))
+        if "amount" in fields:
+            move(self.by_amount, self.amount_keys, position, columns.amounts[position], fields["amount"])
+        if "reason" in fields:
+            code, new_code = int(columns.reasons[position]), columns.intern(fields["reason"])
+            if new_code != code:
+                self.remove_posting(code, position)
+                posting = self.postings.get(new_code)
+                if posting is None:
+                    self.postings[new_code] = np.array([position])
+                else:
+                    self.postings[new_code] = np.insert(posting, np.searchsorted(posting, position), position)
+
+    def search(self, start=None, end=None, min_amount=None, max_amount=None, event_type=None, reason=None, text=None):
+        columns = self.columns
+        candidates = []
+        if start is not None or end is not None:
+            low = np.searchsorted(self.day_keys, columns.day(start), "left") if start is not None else 0
+            high = np.searchsorted(self.day_keys, columns.day(end), "right") if end is not None else len(self.day_keys)
+            candidates.append(self.by_day[low:high])
+        if min_amount is not None or max_amount is not None:
+            low = np.searchsorted(self.amount_keys, min_amount, "left") if min_amount is not None else 0
+            high = np.searchsorted(self.amount_keys, max_amount, "right") if max_amount is not None else len(self.amount_keys)
+            candidates.append(self.by_amount[low:high])
+        codes = None
+        if reason is not None:
+            codes = [columns.codes[reason]] if reason in columns.codes else []
+        if text:
+            needle = text.casefold()
+            matching = [code for name, code in columns.codes.items() if needle in name.casefold()]
+            codes = matching if codes is None else [code for code in codes if code in matching]
+        if codes is not None:
+            postings = [self.postings[code] for code in codes if code in self.postings]
+            candidates.append(np.concatenate(postings) if postings else np.array([], dtype=np.int64))
+
+        if not candidates and event_type is None:
+            return np.arange(len(columns))
+        # Start from the smallest candidate set and check the rest per row.
+        positions = min(candidates, key=len) if candidates else np.arange(len(columns))
+        selected = np.ones(len(positions), dtype=bool)
+        if start is not None:
+            selected &= columns.days[positions] >= columns.day(start)
+        if end is not None:
+            selected &= columns.days[positions] <= columns.day(end)
+        if min_amount is not None:
+            selected &= columns.amounts[positions] >= min_amount
+        if max_amount is not None:
+            selected &= columns.amounts[positions] <= max_amount
+        if event_type is not None:
+            selected &= columns.types[positions] == TYPES.index(event_type)
+        if codes is not None:
+            selected &= np.isin(columns.reasons[positions], codes)
+        return np.sort(positions[selected])
+
+    def query(self, offset=0, limit=PAGE_SIZE, **filters):
+        positions = self.search(**filters)
+        return len(positions), positions[offset:offset + limit]
@@ -0,0 +1,1435 @@
+import argparse
+import bisect
+import heapq
+import json
+import logging
+import os
+import re
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from finance_metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+JOURNAL_SUFFIX = ".journal"
+COMPACT_EVERY = 1000
+WRITE_DEBOUNCE = 0.5
+WRITE_MAX_DELAY = 2.0
+LOAD_CHUNK = 1 << 20
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+NUMBER_START = frozenset("-0123456789")
+NUMBER_END = frozenset(" \t\n\r,]}")
+BINARY_SUFFIX = ".bin"
+BINARY_MAGIC = b"FINSNAP3"
+# amount, type, reason, date, category_id, account, currency, id; -1 marks
+# a missing category_id, account, currency or id.
+BINARY_COLUMNS = ("d", "i", "i", "i", "i", "i", "i", "q")
+# Older snapshots have a prefix of the columns: before events had ids, and
+# before they had accounts.
+BINARY_VERSIONS = {BINARY_MAGIC: 8, b"FINSNAP2": 7, b"FINSNAP1": 5}
+EVENT_KEYS = frozenset(("type", "amount", "reason", "date"))
+OPTIONAL_KEYS = frozenset(("category_id", "account", "currency", "id"))
+LOCK_SUFFIX = ".lock"
+LOCK_TIMEOUT = 10.0
+LOAD_ATTEMPTS = 3
+
+
+def empty_finances():
+    return {"income": 0, "expenses": 0, "events": []}
+
+
+def fsync_dir(path):
+    # Make the rename itself durable; not every platform can open a directory.
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write_json(path, data, **kwargs):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, **kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_dir(path)
+
+
+class FileLock:
+    # An advisory lock on a side file, shared by every instance (and every
+    # thread) using the same data. The file also holds the stamp: the latest
+    # version any instance wrote, how many times the snapshot was compacted
+    # and the version the last compaction folded in, and the next free event
+    # id. Nested use on one thread is allowed.
+    def __init__(self, path, timeout=LOCK_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def acquire(self, blocking=True):
+        if getattr(self.local, "depth", 0):
+            self.local.depth += 1
+            return True
+        f = open(self.path, "a+b")
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                if not blocking or time.monotonic() > deadline:
+                    f.close()
+                    if not blocking:
+                        return False
+                    raise TimeoutError(f"{self.path} is held by another instance") from None
+                time.sleep(0.01)
+        self.local.file = f
+        self.local.depth = 1
+        return True
+
+    def release(self):
+        self.local.depth -= 1
+        if self.local.depth:
+            return
+        f = self.local.file
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        f.close()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    # Only while held. Written in place rather than replaced, so the lock
+    # stays on the same file.
+    def read_stamp(self):
+        f = self.local.file
+        f.seek(0)
+        try:
+            return json.loads(f.read() or b"{}")
+        except ValueError:
+            return {}
+
+    def write_stamp(self, stamp):
+        f = self.local.file
+        f.seek(0)
+        f.truncate()
+        f.write(json.dumps(stamp).encode("utf-8"))
+        f.flush()
+
+    def touch(self):
+        open(self.path, "ab").close()
+        return self.path
+
+
+class JsonStream:
+    # Reads a JSON document through a window of LOAD_CHUNK characters, so
+    # only the values being decoded are ever held as text.
+    def __init__(self, f, size, progress=None, chunk_size=LOAD_CHUNK):
+        self.f = f
+        self.size = size
+        self.progress = progress
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.read = 0
+        self.eof = False
+
+    def fill(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        self.read += len(chunk)
+        if self.progress is not None:
+            self.progress(min(self.read / self.size, 1.0))
+        return True
+
+    def peek(self):
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise json.JSONDecodeError("Unexpected end of data", self.buffer, self.pos)
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise json.JSONDecodeError(f"Expecting one of {chars!r}", self.buffer, self.pos)
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Most likely the value runs past the window; a real syntax
+                # error is raised again once the file is exhausted.
+                if not self.fill():
+                    raise
+                continue
+            # A number is only whole once a delimiter follows it: cut at
+            # "1234." or "1e" the decoder stops at 1234 or 1.
+            if (self.buffer[self.pos] in NUMBER_START and not self.eof
+                    and (end == len(self.buffer) or self.buffer[end] not in NUMBER_END) and self.fill()):
+                continue
+            self.pos = end
+            return value
+
+    def batch(self):
+        # Whatever lies before one of the last two "}" in the window is most
+        # likely a run of whole array items. If the cut falls inside a
+        # string or a nested value the decode fails, since the brackets or
+        # quotes can't balance, and the caller falls back to single values.
+        end = len(self.buffer)
+        for _ in range(2):
+            end = self.buffer.rfind("}", self.pos, end) + 1
+            if end <= self.pos:
+                return None
+            try:
+                items = json.loads("[" + self.buffer[self.pos:end] + "]")
+            except json.JSONDecodeError:
+                end -= 1
+                continue
+            self.pos = end
+            return items
+        return None
+
+    def items(self):
+        # Yields the items of the array at the current position in batches
+        # of up to one window.
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            items = self.batch()
+            yield items if items is not None else [self.value()]
+            if self.expect(",]") == "]":
+                return
+
+
+def read_json_stream(path, progress=None, chunk_size=LOAD_CHUNK):
+    # Equivalent to json.load for a finances.json object without holding
+    # the whole text in memory. Repeated type, reason and date strings
+    # share one object, which is most of what a large ledger weighs.
+    finances = {}
+    strings = {}
+    with open(path, "r", encoding="utf-8") as f:
+        stream = JsonStream(f, max(os.fstat(f.fileno()).st_size, 1), progress, chunk_size)
+        stream.expect("{")
+        if stream.peek() == "}":
+            return finances
+        while True:
+            key = stream.value()
+            stream.expect(":")
+            if key != "events":
+                finances[key] = stream.value()
+            else:
+                finances[key] = events = []
+                for batch in stream.items():
+                    for event in batch:
+                        if event.__class__ is dict:
+                            for field in ("type", "reason", "date"):
+                                value = event.get(field)
+                                if value.__class__ is str:
+                                    event[field] = strings.setdefault(value, value)
+                    events.extend(batch)
+            if stream.expect(",}") == "}":
+                return finances
+
+
+def plain_event(event):
+    # Events that fit the binary columns exactly; anything else is stored
+    # as JSON alongside them so it round-trips unchanged.
+    keys = event.keys()
+    if not (EVENT_KEYS <= keys and keys - EVENT_KEYS <= OPTIONAL_KEYS):
+        return False
+    category_id = event.get("category_id", 0)
+    event_id = event.get("id", 0)
+    return (event["amount"].__class__ is float and category_id.__class__ is int and category_id >= 0
+            and event_id.__class__ is int and event_id >= 0
+            and event["type"].__class__ is str and event["reason"].__class__ is str and event["date"].__class__ is str
+            and event.get("account", "").__class__ is str and event.get("currency", "").__class__ is str)
+
+
+def write_binary_snapshot(path, finances):
+    events = finances["events"]
+    tables = ({}, {}, {}, {}, {})
+    columns = [array(typecode) for typecode in BINARY_COLUMNS]
+    amounts, types, reasons, dates, category_ids, accounts, currencies, ids = columns
+    types_table, reasons_table, dates_table, accounts_table, currencies_table = tables
+    extras = {}
+    missing_category = False
+    for index, event in enumerate(events):
+        if not plain_event(event):
+            extras[index] = event
+            event = {"type": "", "amount": 0.0, "reason": "", "date": ""}
+        amounts.append(event["amount"])
+        types.append(types_table.setdefault(event["type"], len(types_table)))
+        reasons.append(reasons_table.setdefault(event["reason"], len(reasons_table)))
+        dates.append(dates_table.setdefault(event["date"], len(dates_table)))
+        category_id = event.get("category_id", -1)
+        missing_category = missing_category or category_id == -1
+        category_ids.append(category_id)
+        account = event.get("account")
+        accounts.append(-1 if account is None else accounts_table.setdefault(account, len(accounts_table)))
+        currency = event.get("currency")
+        currencies.append(-1 if currency is None else currencies_table.setdefault(currency, len(currencies_table)))
+        ids.append(event.get("id", -1))
+
+    header = json.dumps({
+        "count": len(events),
+        "finances": {key: value for key, value in finances.items() if key != "events"},
+        "tables": [list(table) for table in tables],
+        "missing_category": missing_category,
+        "missing_id": -1 in ids,
+        "extras": extras,
+    }).encode("utf-8")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(BINARY_MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for column in columns:
+            if sys.byteorder == "big":
+                column.byteswap()
+            column.tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_dir(path)
+
+
+def read_binary_snapshot(path, progress=None):
+    with open(path, "rb") as f:
+        magic = f.read(len(BINARY_MAGIC))
+        if magic not in BINARY_VERSIONS:
+            raise ValueError(f"{path} is not a finance snapshot")
+        typecodes = BINARY_COLUMNS[:BINARY_VERSIONS[magic]]
+        try:
+            (length,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(length))
+            count = header["count"]
+            columns = []
+            for typecode in typecodes:
+                column = array(typecode)
+                column.fromfile(f, count)
+                if sys.byteorder == "big":
+                    column.byteswap()
+                columns.append(column)
+        except (struct.error, EOFError, ValueError) as e:
+            raise ValueError(f"{path} is damaged: {e}") from e
+    if progress is not None:
+        progress(0.5)
+
+    types, reasons, dates = header["tables"][:3]
+    if len(columns) > 7:
+        events = [
+            {"id": event_id, "type": types[t], "amount": amount, "reason": reasons[r], "date": dates[d], "category_id": category_id}
+            for amount, t, r, d, category_id, event_id in zip(*columns[:5], columns[7])
+        ]
+        if header["missing_id"]:
+            for event in events:
+                if event["id"] == -1:
+                    del event["id"]
+    else:
+        events = [
+            {"type": types[t], "amount": amount, "reason": reasons[r], "date": dates[d], "category_id": category_id}
+            for amount, t, r, d, category_id in zip(*columns[:5])
+        ]
+    if header["missing_category"]:
+        for event in events:
+            if event["category_id"] == -1:
+                del event["category_id"]
+    # Most ledgers have a single account, so these columns are usually all
+    # -1 and cost nothing more than the check.
+    for field, codes, table in zip(("account", "currency"), columns[5:], header["tables"][3:]):
+        if table:
+            for event, code in zip(events, codes):
+                if code != -1:
+                    event[field] = table[code]
+    for index, event in header["extras"].items():
+        events[int(index)] = event
+    if progress is not None:
+        progress(1.0)
+    return dict(header["finances"], events=events)
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def iso_date(date):
+    # "dd.MM.yyyy" -> "yyyy-MM-dd"
+    return f"{date[6:10]}-{date[3:5]}-{date[0:2]}"
+
+
+def display_date(date):
+    # "yyyy-MM-dd" -> "dd.MM.yyyy"
+    return f"{date[8:10]}.{date[5:7]}.{date[0:4]}"
+
+
+def journal_record(record):
+    op = record["op"]
+    if op == "add":
+        return {"op": op, "event": record["event"]}
+    if op == "extend":
+        # Settings ride along so materialized events and the rule state
+        # that produced them are written as one record.
+        if "settings" in record:
+            return {"op": op, "events": record["events"], "settings": record["settings"]}
+        return {"op": op, "events": record["events"]}
+    if op == "delete":
+        return {"op": op, "index": record["index"]}
+    if op == "settings":
+        return {"op": op, "settings": record["settings"]}
+    if op == "remove":
+        return {"op": op, "ids": record["ids"]}
+    if op == "restore":
+        return {"op": op, "events": record["events"]}
+    if op == "edit":
+        return {"op": op, "changes": record["changes"]}
+    return {"op": op, "index": record["index"], "fields": record["fields"]}
+
+
+def record_size(record):
+    op = record["op"]
+    if op in ("extend", "restore"):
+        return len(record["events"])
+    if op == "remove":
+        return len(record["ids"])
+    if op == "edit":
+        return len(record["changes"])
+    return 1
+
+
+def event_id(event):
+    return event.get("id", -1)
+
+
+def find_positions(events, ids):
+    # Positions of the events with these ids in a list. Ids grow as events
+    # are appended and undo puts an event back where it was, so the list is
+    # in id order and a few ids are found by bisection; many, or a list
+    # whose order was broken by hand, take one pass.
+    positions = {}
+    if len(ids) * 20 < len(events):
+        for wanted in ids:
+            i = bisect.bisect_left(events, wanted, key=event_id)
+            if i < len(events) and events[i].get("id") == wanted:
+                positions[wanted] = i
+    if len(positions) < len(ids):
+        wanted = set(ids)
+        positions = {event["id"]: i for i, event in enumerate(events) if event.get("id") in wanted}
+    return positions
+
+
+def merge_by_id(events, restored):
+    return list(heapq.merge(events, sorted(restored, key=event_id), key=event_id))
+
+
+def update_fields(event, fields):
+    # None removes a field, so an edit can be reverted on events that
+    # didn't have it.
+    for key, value in fields.items():
+        if value is None:
+            event.pop(key, None)
+        else:
+            event[key] = value
+
+
+def coalesce_records(records):
+    # Collapse runs of edits to the same event (one per keystroke) into one.
+    coalesced = []
+    for record in records:
+        previous = coalesced[-1] if coalesced else None
+        if (record["op"] == "edit" and previous is not None and previous["op"] == "edit"
+                and len(record["changes"]) == len(previous["changes"]) == 1
+                and previous["changes"][0][0] == record["changes"][0][0]):
+            (changed_id, fields), = previous["changes"]
+            coalesced[-1] = {"op": "edit", "changes": [[changed_id, {**fields, **record["changes"][0][1]}]]}
+        else:
+            coalesced.append(record)
+    return coalesced
+
+
+def apply_record(finances, record):
+    op = record["op"]
+    events = finances["events"]
+    # Instances sharing the files hand out ids from separate blocks, so an
+    # add can be journaled after a higher id from another instance; it goes
+    # where it belongs to keep the list in id order.
+    if op == "add":
+        event = record["event"]
+        if events and event_id(event) < event_id(events[-1]):
+            bisect.insort(events, event, key=event_id)
+        else:
+            events.append(event)
+    elif op == "extend":
+        if events and record["events"] and event_id(record["events"][0]) < event_id(events[-1]):
+            events[:] = merge_by_id(events, record["events"])
+        else:
+            events.extend(record["events"])
+    elif op == "delete":
+        del events[record["index"]]
+    elif op == "update":
+        events[record["index"]].update(record["fields"])
+    elif op == "remove":
+        ids = set(record["ids"])
+        events[:] = [event for event in events if event.get("id") not in ids]
+    elif op == "restore":
+        events[:] = merge_by_id(events, record["events"])
+    elif op == "edit":
+        # Another instance may have removed an event this one edited.
+        positions = find_positions(events, [change[0] for change in record["changes"]])
+        for changed_id, fields in record["changes"]:
+            if changed_id in positions:
+                update_fields(events[positions[changed_id]], fields)
+    elif op != "settings":
+        raise ValueError(f"Unknown journal operation: {op}")
+    if "settings" in record:
+        finances.update(record["settings"])
+
+
+class JsonStorage:
+    # The stamp field that moves whenever the snapshot file is rewritten.
+    REWRITTEN_BY = "version"
+
+    def __init__(self, path, category_path):
+        self.path = path
+        self.category_path = category_path
+        self.file_lock = FileLock(path + LOCK_SUFFIX)
+        # The version this instance last read or wrote; the stamp has the
+        # latest one any instance wrote.
+        self.seq = 0
+        # Records other instances wrote that the ledger hasn't merged yet,
+        # or, when resync is set, a sign that only reading everything again
+        # can tell what they changed.
+        self.external = []
+        self.resync = False
+        self.written = 0
+
+    def load_categories(self):
+        if not os.path.exists(self.category_path):
+            raise FileNotFoundError(f"{self.category_path} file not found. Creating a new one.")
+        with open(self.category_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_categories(self, categories):
+        atomic_write_json(self.category_path, categories, ensure_ascii=False, indent=4)
+
+    def categories_version(self):
+        try:
+            return os.stat(self.category_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def read_snapshot(self, progress=None):
+        return read_json_stream(self.path, progress)
+
+    def write_snapshot(self, finances, path=None):
+        atomic_write_json(path or self.path, finances)
+
+    def stage_snapshot(self, finances):
+        # Written beside the snapshot without the lock, which is then only
+        # held for swapping it in with install_snapshot.
+        path = f"{self.path}.{os.getpid()}-{threading.get_ident()}.new"
+        self.write_snapshot(finances, path)
+        return path
+
+    def install_snapshot(self, staged):
+        os.replace(staged, self.path)
+        fsync_dir(self.path)
+
+    def stamp(self):
+        with self.file_lock:
+            return self.file_lock.read_stamp()
+
+    def read(self, stamp, progress=None):
+        try:
+            finances = self.read_snapshot(progress)
+        except FileNotFoundError:
+            finances = empty_finances()
+        self.seq = stamp.get("version", 0)
+        return finances
+
+    def load(self, progress=None):
+        # Read without the lock, so a large file never holds up another
+        # instance. If one rewrote the snapshot meanwhile it is read again,
+        # the last time with the lock held.
+        self.external = []
+        self.resync = False
+        for _ in range(LOAD_ATTEMPTS):
+            stamp = self.stamp()
+            finances = self.read(stamp, progress)
+            if self.stamp().get(self.REWRITTEN_BY, 0) == stamp.get(self.REWRITTEN_BY, 0):
+                return finances
+        with self.file_lock:
+            return self.read(self.file_lock.read_stamp(), progress)
+
+    def save(self, finances):
+        self.write(finances, [])
+
+    def needs_snapshot(self, count):
+        return True
+
+    def file_sizes(self):
+        return {self.path: file_size(self.path), self.category_path: file_size(self.category_path)}
+
+    def write(self, finances, records):
+        staged = None if self.resync else self.stage_snapshot(finances)
+        with self.file_lock:
+            stamp = self.file_lock.read_stamp()
+            if self.moved(stamp) or self.resync:
+                # Another instance saved since this one last read the file:
+                # these changes go on top of its file rather than over it,
+                # until the ledger has merged what it wrote.
+                if staged is not None:
+                    os.remove(staged)
+                try:
+                    finances = self.read_snapshot()
+                except FileNotFoundError:
+                    finances = empty_finances()
+                for record in records:
+                    apply_record(finances, record)
+                self.resync = True
+                self.write_snapshot(finances)
+            else:
+                self.install_snapshot(staged)
+            self.seq = stamp.get("version", 0) + 1
+            self.written += 1
+            self.file_lock.write_stamp(dict(stamp, version=self.seq))
+
+    def reserve_ids(self, count, floor):
+        # Ids are handed out in blocks from a counter in the stamp, so
+        # instances on the same files never pick the same one.
+        with self.file_lock:
+            stamp = self.file_lock.read_stamp()
+            start = max(stamp.get("next_id", 1), floor)
+            self.file_lock.write_stamp(dict(stamp, next_id=start + count))
+        return start
+
+    def update_rule_progress(self, update):
+        # How far each recurring rule was expanded, kept in the stamp; update
+        # gets it and returns the new one with the lock held.
+        with self.file_lock:
+            stamp = self.file_lock.read_stamp()
+            self.file_lock.write_stamp(dict(stamp, rules=update(stamp.get("rules", {}))))
+
+    def moved(self, stamp):
+        return stamp.get("version", 0) != self.seq
+
+    def catch_up(self, stamp):
+        # Called with the lock held once the stamp has moved.
+        self.resync = True
+
+    def poll(self):
+        # What other instances wrote since the last call, or None if the
+        # lock is busy. Must not overlap a write of this instance.
+        if not self.file_lock.acquire(blocking=False):
+            return None
+        try:
+            stamp = self.file_lock.read_stamp()
+            if self.moved(stamp):
+                self.catch_up(stamp)
+            records, self.external = self.external, []
+        finally:
+            self.file_lock.release()
+        return records
+
+    def adopt(self, other):
+        # Takes over the position of a copy that read everything again.
+        self.seq = other.seq
+        self.external = []
+        self.resync = False
+
+    def watch_paths(self):
+        # Every write updates the stamp in place, so it is all there is to watch.
+        return [self.file_lock.touch()]
+
+    def close(self, finances):
+        pass
+
+
+class JournalStorage(JsonStorage):
+    REWRITTEN_BY = "compacted"
+
+    def __init__(self, path, category_path, compact_every=COMPACT_EVERY):
+        super().__init__(path, category_path)
+        self.journal_path = path + JOURNAL_SUFFIX
+        self.compact_every = compact_every
+        self.pending = 0
+        self.snapshot_size = 0
+        self.journal_offset = 0
+        self.compacted = 0
+
+    def read(self, stamp, progress=None):
+        finances = super().read(stamp, progress)
+        self.seq = finances.pop("journal_seq", 0)
+        self.compacted = stamp.get("compacted", 0)
+        self.pending = 0
+        self.snapshot_size = len(finances["events"])
+        self.journal_offset = 0
+        for record in self.read_journal(truncate=False):
+            try:
+                apply_record(finances, record)
+            except (IndexError, KeyError):
+                # Nothing half-replayed may be compacted over the snapshot on close.
+                self.pending = 0
+                raise
+            self.pending += record_size(record)
+        return finances
+
+    def read_journal(self, truncate):
+        # Whole records past journal_offset that are newer than seq. An
+        # incomplete last line is cut off only with the lock held (truncate):
+        # without it, another instance may still be writing it.
+        try:
+            f = open(self.journal_path, "rb+" if truncate else "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(self.journal_offset)
+            while True:
+                line = f.readline()
+                if not line:
+                    return
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("truncated record")
+                    record = json.loads(line)
+                except ValueError:
+                    if truncate:
+                        # A torn write from a crash; everything before it is intact.
+                        logging.error(f"Discarding damaged journal tail in {self.journal_path}")
+                        f.truncate(self.journal_offset)
+                    return
+                self.journal_offset = f.tell()
+                # Records already folded into the snapshot survive a crash
+                # between writing the snapshot and removing the journal.
+                if record["seq"] <= self.seq:
+                    continue
+                self.seq = record["seq"]
+                yield record
+
+    def moved(self, stamp):
+        # Bytes past the last whole record without a newer stamp were left by
+        # a writer that died before stamping them: catch_up merges its whole
+        # records and cuts off a torn last line before anything is appended.
+        return (stamp.get("version", 0) != self.seq or stamp.get("compacted", 0) != self.compacted
+                or file_size(self.journal_path) > self.journal_offset)
+
+    def catch_up(self, stamp):
+        if stamp.get("compacted", 0) != self.compacted:
+            # Another instance folded the journal into a new snapshot. If
+            # this one had read everything in it, reading goes on in the new
+            # journal; otherwise the records it missed are gone.
+            self.compacted = stamp["compacted"]
+            self.journal_offset = 0
+            if stamp.get("snapshot_seq") != self.seq:
+                self.resync = True
+                self.external = []
+                self.seq = max(self.seq, stamp.get("version", 0))
+                self.journal_offset = file_size(self.journal_path)
+                return
+        for record in self.read_journal(truncate=True):
+            self.external.append(record)
+            self.pending += record_size(record)
+
+    def adopt(self, other):
+        super().adopt(other)
+        self.compacted = other.compacted
+        self.journal_offset = other.journal_offset
+        self.pending = other.pending
+        self.snapshot_size = other.snapshot_size
+
+    def compact(self, finances):
+        # The snapshot is written without the lock. If anything was
+        # journaled meanwhile, by this instance or another, it is missing
+        # those records and is dropped; a later write folds the journal.
+        seq = self.seq
+        staged = self.stage_snapshot(dict(finances, journal_seq=seq))
+        with self.file_lock:
+            stamp = self.file_lock.read_stamp()
+            if self.moved(stamp) or self.seq != seq or self.external or self.resync:
+                os.remove(staged)
+                return False
+            self.install_snapshot(staged)
+            try:
+                os.remove(self.journal_path)
+            except FileNotFoundError:
+                pass
+            self.pending = 0
+            self.snapshot_size = len(finances["events"])
+            self.journal_offset = 0
+            self.compacted = stamp.get("compacted", 0) + 1
+            stamp.update(version=self.seq, compacted=self.compacted, snapshot_seq=self.seq)
+            self.file_lock.write_stamp(stamp)
+        return True
+
+    def save(self, finances):
+        with self.file_lock:
+            stamp = self.file_lock.read_stamp()
+            if self.moved(stamp):
+                self.catch_up(stamp)
+            # Records of other instances stay in the journal until merged:
+            # finances doesn't have them.
+            if self.external or self.resync:
+                return
+        self.compact(finances)
+
+    def file_sizes(self):
+        return dict(super().file_sizes(), **{self.journal_path: file_size(self.journal_path)})
+
+    def compaction_due(self, pending):
+        # Letting the journal grow with the snapshot keeps compaction cost
+        # amortized O(1) per event, even for large batch imports.
+        return pending >= max(self.compact_every, self.snapshot_size)
+
+    def needs_snapshot(self, count):
+        return self.compaction_due(self.pending + count)
+
+    def write(self, finances, records):
+        with self.file_lock:
+            stamp = self.file_lock.read_stamp()
+            if self.moved(stamp):
+                self.catch_up(stamp)
+            entries = []
+            for record in records:
+                self.seq += 1
+                entries.append(dict(journal_record(record), seq=self.seq))
+                self.pending += record_size(record)
+            # Records of other instances waiting to be merged come before
+            # these in the journal, so these are merged again after them.
+            if self.external:
+                self.external.extend(entries)
+            lines = [json.dumps(entry).encode("utf-8") + b"\n" for entry in entries]
+            with open(self.journal_path, "ab") as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+                self.journal_offset = f.tell()
+            self.written += 1
+            stamp["version"] = self.seq
+            self.file_lock.write_stamp(stamp)
+            # With records of other instances still to merge the snapshot
+            # passed in is missing them, so folding waits for a later write.
+            due = finances is not None and self.compaction_due(self.pending) and not self.external and not self.resync
+        if due:
+            self.compact(finances)
+
+    def close(self, finances):
+        # The writer has journaled everything by now. Folding it in on every
+        # close would rewrite the snapshot after each command-line change,
+        # so it only happens when a write would have done it as well.
+        if finances is not None and self.compaction_due(self.pending):
+            self.save(finances)
+
+
+class BinaryStorage(JournalStorage):
+    # The journal as usual, with snapshots as packed columns plus string
+    # tables instead of JSON.
+    def read_snapshot(self, progress=None):
+        return read_binary_snapshot(self.path, progress)
+
+    def write_snapshot(self, finances, path=None):
+        write_binary_snapshot(path or self.path, finances)
+
+
+# Events name their category through category_id when they have one, so a
+# renamed category shows up everywhere without touching the events table.
+EVENT_SELECT = (
+    "SELECT e.id, e.type, e.amount, COALESCE(c.name, e.reason), e.date, e.category_id, e.account, e.currency"
+    " FROM events e LEFT JOIN categories c ON c.id = e.category_id"
+)
+EVENT_INSERT = "INSERT INTO events (type, amount, reason, date, category_id, account, currency, id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+# Ids per DELETE ... IN (...), well under SQLite's variable limit.
+SQL_CHUNK = 500
+ID_FETCH = 10000
+# Changed ids up to this many are patched into the id list one by one;
+# more and the list is rebuilt in one pass.
+ID_PATCH_LIMIT = 64
+
+
+def event_row(event):
+    # A missing id lets SQLite pick the next one.
+    return (event["type"], event["amount"], event["reason"], iso_date(event["date"]), event.get("category_id"),
+            event.get("account"), event.get("currency"), event.get("id"))
+
+
+def row_to_event(row):
+    event = {"id": row[0], "type": row[1], "amount": row[2], "reason": row[3], "date": display_date(row[4])}
+    if row[5] is not None:
+        event["category_id"] = row[5]
+    if row[6] is not None:
+        event["account"] = row[6]
+    if row[7] is not None:
+        event["currency"] = row[7]
+    return event
+
+
+class SQLiteEvents:
+    PAGE_SIZE = 500
+
+    def __init__(self, connection, lock):
+        self.connection = connection
+        self.lock = lock
+        self.length = connection.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+        # Every id in order, read on first use: a page is fetched from its
+        # first id through the primary key instead of skipping the rows
+        # before it.
+        self.id_list = None
+        self.page_start = None
+        self.page = []
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def ids(self):
+        if self.id_list is None:
+            self.read_ids()
+        return self.id_list
+
+    def read_ids(self):
+        ids = array("q")
+        with self.lock:
+            cursor = self.connection.execute("SELECT id FROM events ORDER BY id")
+            for rows in iter(lambda: cursor.fetchmany(ID_FETCH), []):
+                ids.extend(row[0] for row in rows)
+        self.id_list = ids
+        self.length = len(ids)
+
+    def __getitem__(self, index):
+        ids = self.ids
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("event index out of range")
+        start = index - index % self.PAGE_SIZE
+        if start != self.page_start:
+            with self.lock:
+                rows = self.connection.execute(
+                    f"{EVENT_SELECT} WHERE e.id >= ? ORDER BY e.id LIMIT ?",
+                    (ids[start], self.PAGE_SIZE),
+                ).fetchall()
+            self.page = [row_to_event(row) for row in rows]
+            self.page_start = start
+        if index - start >= len(self.page):
+            # Another connection deleted rows since the ids were read.
+            raise IndexError("event index out of range")
+        return self.page[index - start]
+
+    def __iter__(self):
+        with self.lock:
+            cursor = self.connection.execute(f"{EVENT_SELECT} ORDER BY e.id")
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(self.PAGE_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield row_to_event(row)
+
+    # New events get their id from SQLite as they are inserted, which no
+    # other connection to the database can pick as well.
+    def append(self, event):
+        with self.lock:
+            cursor = self.connection.execute(EVENT_INSERT, event_row(event))
+        event["id"] = cursor.lastrowid
+        self.inserted([event["id"]])
+
+    def extend(self, events):
+        with self.lock:
+            for event in events:
+                event["id"] = self.connection.execute(EVENT_INSERT, event_row(event)).lastrowid
+        self.inserted([event["id"] for event in events])
+
+    def invalidate(self):
+        self.page_start = None
+
+    def refresh(self):
+        # After another connection committed.
+        with self.lock:
+            self.length = self.connection.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+        self.id_list = None
+        self.page_start = None
+
+    def positions(self, ids):
+        positions = self.ids
+        return [bisect.bisect_left(positions, event_id) for event_id in ids]
+
+    def find(self, ids):
+        # id -> (position, event); the rows come from one query per chunk of
+        # ids, and each position from a bisect of the id array.
+        found = {}
+        ids = list(ids)
+        positions = self.ids
+        with self.lock:
+            for start in range(0, len(ids), SQL_CHUNK):
+                chunk = ids[start:start + SQL_CHUNK]
+                rows = self.connection.execute(f"{EVENT_SELECT} WHERE e.id IN ({', '.join('?' * len(chunk))})", chunk).fetchall()
+                for row in rows:
+                    found[row[0]] = (bisect.bisect_left(positions, row[0]), row_to_event(row))
+        return found
+
+    # Each batch runs under one hold of the lock, so the writer never
+    # commits half of it.
+    def remove(self, ids):
+        ids = list(ids)
+        with self.lock:
+            for start in range(0, len(ids), SQL_CHUNK):
+                chunk = ids[start:start + SQL_CHUNK]
+                self.connection.execute(f"DELETE FROM events WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+        self.deleted(ids)
+
+    def restore(self, events):
+        with self.lock:
+            self.connection.executemany(EVENT_INSERT, (event_row(event) for event in events))
+        self.inserted([event["id"] for event in events])
+
+    def edit(self, changes):
+        with self.lock:
+            for changed_id, fields in changes:
+                columns = {key: iso_date(value) if key == "date" and value is not None else value for key, value in fields.items()}
+                assignments = ", ".join(f"{column} = ?" for column in columns)
+                self.connection.execute(f"UPDATE events SET {assignments} WHERE id = ?", (*columns.values(), changed_id))
+        # Rows keep their place, so the cached page is patched rather than
+        # read again.
+        if self.page_start is not None:
+            for changed_id, fields in changes:
+                offset = bisect.bisect_left(self.id_list, changed_id) - self.page_start
+                if 0 <= offset < len(self.page) and self.page[offset]["id"] == changed_id:
+                    update_fields(self.page[offset], fields)
+
+    def __delitem__(self, index):
+        event_id = self[index]["id"]
+        with self.lock:
+            self.connection.execute("DELETE FROM events WHERE id = ?", (event_id,))
+        self.deleted([event_id])
+
+    def inserted(self, new_ids):
+        if self.id_list is None:
+            self.length += len(new_ids)
+            self.page_start = None
+            return
+        new_ids = sorted(new_ids)
+        first = bisect.bisect_left(self.id_list, new_ids[0]) if new_ids else self.length
+        if first == len(self.id_list):
+            self.id_list.extend(new_ids)
+        elif len(new_ids) <= ID_PATCH_LIMIT:
+            for new_id in new_ids:
+                bisect.insort(self.id_list, new_id)
+        else:
+            self.id_list = array("q", heapq.merge(self.id_list, new_ids))
+        self.length = len(self.id_list)
+        self.moved(first)
+
+    def deleted(self, old_ids):
+        if self.id_list is None:
+            self.length -= len(old_ids)
+            self.page_start = None
+            return
+        ids = self.id_list
+        first = min((bisect.bisect_left(ids, old_id) for old_id in old_ids), default=len(ids))
+        if len(old_ids) <= ID_PATCH_LIMIT:
+            for old_id in old_ids:
+                position = bisect.bisect_left(ids, old_id)
+                if position < len(ids) and ids[position] == old_id:
+                    del ids[position]
+        else:
+            gone = set(old_ids)
+            self.id_list = array("q", (event_id for event_id in ids if event_id not in gone))
+        self.length = len(self.id_list)
+        self.moved(first)
+
+    def moved(self, position):
+        # Rows from position on have shifted; a page before it still holds.
+        if self.page_start is not None and position < self.page_start + self.PAGE_SIZE:
+            self.page_start = None
+
+class SQLiteStorage:
+    def __init__(self, path):
+        self.path = path
+        # Inserts and deletes run on the GUI thread, commits on the write-behind
+        # thread; self.lock serializes every use of the shared connection.
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY,
+                type TEXT NOT NULL,
+                amount REAL NOT NULL,
+                reason TEXT NOT NULL,
+                date TEXT NOT NULL,
+                category_id INTEGER,
+                account TEXT,
+                currency TEXT
+            );
+            CREATE INDEX IF NOT EXISTS events_date ON events (date);
+            CREATE INDEX IF NOT EXISTS events_type_date ON events (type, date);
+            CREATE INDEX IF NOT EXISTS events_reason_date ON events (reason, date);
+            CREATE INDEX IF NOT EXISTS events_category_date ON events (category_id, date);
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS rule_progress (
+                key TEXT PRIMARY KEY,
+                next TEXT
+            );
+            CREATE TABLE IF NOT EXISTS categories (
+                position INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                type TEXT NOT NULL,
+                id INTEGER,
+                deleted INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        # Databases created before categories had ids.
+        self.add_missing_column("events", "category_id", "INTEGER")
+        # ...and before events had accounts.
+        self.add_missing_column("events", "account", "TEXT")
+        self.add_missing_column("events", "currency", "TEXT")
+        self.add_missing_column("categories", "id", "INTEGER")
+        self.add_missing_column("categories", "deleted", "INTEGER NOT NULL DEFAULT 0")
+        self.connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS categories_id ON categories (id)")
+        self.connection.commit()
+        self.data_version = self.categories_version()
+        self.resync = False
+
+    def add_missing_column(self, table, column, definition):
+        columns = [row[1] for row in self.connection.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            self.connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def load_categories(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT name, type, id, deleted FROM categories ORDER BY position").fetchall()
+        categories = []
+        for name, category_type, category_id, deleted in rows:
+            category = {"name": name, "type": category_type}
+            if category_id is not None:
+                category["id"] = category_id
+            if deleted:
+                category["deleted"] = True
+            categories.append(category)
+        return categories
+
+    def save_categories(self, categories):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM categories")
+            self.connection.executemany(
+                "INSERT INTO categories (name, type, id, deleted) VALUES (?, ?, ?, ?)",
+                [(category["name"], category["type"], category.get("id"), int(category.get("deleted", False))) for category in categories],
+            )
+
+    def categories_version(self):
+        # Only moves when another connection commits, which is exactly the
+        # outside change a cached category list needs to notice.
+        with self.lock:
+            return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def load_settings(self):
+        with self.lock:
+            return {key: json.loads(value) for key, value in self.connection.execute("SELECT key, value FROM settings")}
+
+    def load(self, progress=None):
+        # Nothing to read up front: events are fetched from the table on demand.
+        return dict(self.load_settings(), income=0, expenses=0, events=SQLiteEvents(self.connection, self.lock))
+
+    def poll(self):
+        # SQLite does its own locking, and a commit by another connection
+        # moves data_version. What it changed isn't listed anywhere, so the
+        # ledger rebuilds its views (resync).
+        version = self.categories_version()
+        if version != self.data_version:
+            self.data_version = version
+            self.resync = True
+        return []
+
+    def watch_paths(self):
+        return [path for path in (self.path, self.path + "-wal") if os.path.exists(path)]
+
+    def save_settings(self, settings):
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+            [(key, json.dumps(value)) for key, value in settings.items()],
+        )
+
+    def update_rule_progress(self, update):
+        # BEGIN IMMEDIATE takes the database's write lock before the progress
+        # is read, so no other connection expands the same rule meanwhile.
+        with self.lock:
+            self.connection.commit()
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                progress = update(dict(self.connection.execute("SELECT key, next FROM rule_progress")))
+                self.connection.executemany("INSERT OR REPLACE INTO rule_progress (key, next) VALUES (?, ?)", progress.items())
+                self.connection.commit()
+            except BaseException:
+                self.connection.rollback()
+                raise
+
+    def save(self, finances):
+        with self.lock:
+            self.connection.commit()
+
+    def needs_snapshot(self, count):
+        return False
+
+    def file_sizes(self):
+        return {path: file_size(path) for path in (self.path, self.path + "-wal")}
+
+    def write(self, finances, records):
+        # Event changes were already executed by SQLiteEvents; settings are
+        # saved here, and everything is committed in one transaction.
+        with self.lock:
+            for record in records:
+                if "settings" in record:
+                    self.save_settings(record["settings"])
+            self.connection.commit()
+
+    def query(self, start=None, end=None, min_amount=None, max_amount=None, event_type=None,
+              category_ids=None, reasons=None, offset=0, limit=100):
+        # (total, ids) of one page of matches, in id order like the other
+        # backends' positions. A category is matched by id, through the
+        # (category_id, date) index; its name only matches events that were
+        # saved without one.
+        conditions = []
+        params = []
+        if start is not None:
+            conditions.append("e.date >= ?")
+            params.append(iso_date(start))
+        if end is not None:
+            conditions.append("e.date <= ?")
+            params.append(iso_date(end))
+        if min_amount is not None:
+            conditions.append("e.amount >= ?")
+            params.append(min_amount)
+        if max_amount is not None:
+            conditions.append("e.amount <= ?")
+            params.append(max_amount)
+        if event_type is not None:
+            conditions.append("e.type = ?")
+            params.append(event_type)
+        if category_ids is not None:
+            ids = ", ".join("?" * len(category_ids))
+            names = ", ".join("?" * len(reasons))
+            conditions.append(f"(e.category_id IN ({ids}) OR (e.category_id IS NULL AND e.reason IN ({names})))")
+            params.extend(category_ids)
+            params.extend(reasons)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self.lock:
+            total = self.connection.execute(f"SELECT COUNT(*) FROM events e{where}", params).fetchone()[0]
+            rows = self.connection.execute(
+                f"SELECT e.id FROM events e{where} ORDER BY e.id LIMIT ? OFFSET ?",
+                (*params, limit, offset),
+            ).fetchall()
+        return total, [row[0] for row in rows]
+
+    def close(self, finances):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+class WriteBehindWriter:
+    def __init__(self, storage, finances, debounce=WRITE_DEBOUNCE, max_delay=WRITE_MAX_DELAY):
+        self.storage = storage
+        self.finances = finances
+        self.debounce = debounce
+        self.max_delay = max_delay
+        # Callers hold this lock while they mutate finances and submit the
+        # matching record, so a flush never sees one without the other.
+        self.lock = threading.RLock()
+        self.condition = threading.Condition(self.lock)
+        self.queue = []
+        self.last_submit = 0
+        self.flushing = False
+        self.closing = False
+        self.flush_count = 0
+        self.last_flush_seconds = 0
+        self.max_flush_seconds = 0
+        self.thread = threading.Thread(target=self.run, name="finance-writer", daemon=True)
+        self.thread.start()
+
+    @property
+    def queue_depth(self):
+        return len(self.queue)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "flush_count": self.flush_count,
+            "last_flush_ms": round(self.last_flush_seconds * 1000, 2),
+            "max_flush_ms": round(self.max_flush_seconds * 1000, 2),
+        }
+
+    def submit(self, record):
+        with self.condition:
+            self.queue.append(record)
+            self.last_submit = time.monotonic()
+            self.condition.notify_all()
+
+    def set_finances(self, finances):
+        with self.lock:
+            self.finances = finances
+
+    def take_batch(self):
+        records = coalesce_records(self.queue)
+        self.queue = []
+        snapshot = None
+        if self.storage.needs_snapshot(sum(record_size(record) for record in records)):
+            # A shallow copy is enough: events are replaced or removed in the
+            # list, while in-place edits are idempotent when replayed.
+            snapshot = dict(self.finances, events=list(self.finances["events"]))
+        return records, snapshot
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closing:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                first_submit = self.last_submit
+                while not self.closing:
+                    wait = min(self.last_submit + self.debounce, first_submit + self.max_delay) - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self.condition.wait(wait)
+                records, snapshot = self.take_batch()
+                self.flushing = True
+
+            started = time.perf_counter()
+            try:
+                self.storage.write(snapshot, records)
+            except Exception:
+                logging.exception("Failed to write finance data")
+            elapsed = time.perf_counter() - started
+            metrics.observe("write", elapsed)
+
+            with self.condition:
+                self.flushing = False
+                self.flush_count += 1
+                self.last_flush_seconds = elapsed
+                self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+                self.condition.notify_all()
+
+    def flush(self):
+        with self.condition:
+            self.last_submit = 0
+            self.condition.notify_all()
+            while self.queue or self.flushing:
+                self.condition.wait()
+
+    def close(self):
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.storage.close(self.finances)
+
+
+def migrate_to_sqlite(data_path, category_path, db_path):
+    source = JournalStorage(data_path, category_path)
+    target = SQLiteStorage(db_path)
+    try:
+        categories = source.load_categories()
+    except (FileNotFoundError, json.JSONDecodeError):
+        logging.error(f"Could not read {category_path}; migrating events only.")
+        categories = []
+    finances = source.load()
+
+    with target.connection:
+        target.connection.executemany(EVENT_INSERT, (event_row(event) for event in finances["events"]))
+        target.save_settings({key: value for key, value in finances.items() if key not in ("income", "expenses", "events")})
+    target.save_categories(categories)
+    return target
+
+
+def binary_path(data_path):
+    return os.path.splitext(data_path)[0] + BINARY_SUFFIX
+
+
+def migrate_to_binary(data_path, category_path, path):
+    finances = JournalStorage(data_path, category_path).load()
+    target = BinaryStorage(path, category_path)
+    target.save(finances)
+    return target
+
+
+def create_storage(mode, data_path, category_path, db_path):
+    if mode == "json":
+        return JsonStorage(data_path, category_path)
+    if mode == "journal":
+        return JournalStorage(data_path, category_path)
+    if mode == "sqlite":
+        if not os.path.exists(db_path) and (os.path.exists(data_path) or os.path.exists(category_path)):
+            return migrate_to_sqlite(data_path, category_path, db_path)
+        return SQLiteStorage(db_path)
+    if mode == "binary":
+        path = binary_path(data_path)
+        if not os.path.exists(path) and os.path.exists(data_path):
+            return migrate_to_binary(data_path, category_path, path)
+        return BinaryStorage(path, category_path)
+    raise ValueError(f"Unknown storage mode: {mode}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate finances.json and categories.json into a SQLite database or a binary snapshot.")
+    parser.add_argument("--data", default="finances.json")
+    parser.add_argument("--categories", default="categories.json")
+    parser.add_argument("--db", default="finances.db")
+    parser.add_argument("--to", choices=("sqlite", "binary"), default="sqlite")
+    args = parser.parse_args()
+
+    target = args.db if args.to == "sqlite" else binary_path(args.data)
+    if os.path.exists(target):
+        parser.error(f"{target} already exists")
+    if args.to == "sqlite":
+        storage = migrate_to_sqlite(args.data, args.categories, target)
+    else:
+        storage = migrate_to_binary(args.data, args.categories, target)
+    count = len(storage.load()["events"])
+    storage.close(None)
+    print(f"Migrated {count} events into {target}")
@@ -0,0 +1,171 @@
+import json
+import time
+from datetime import date
+
+import pytest
+
+from finance_ledger import Ledger
+from finance_recurring import format_date
+
+
+@pytest.fixture
+def paths(tmp_path):
+    categories = [{"name": "Food", "type": "Expense", "id": 1}, {"name": "Rent", "type": "Expense", "id": 2},
+                  {"name": "Salary", "type": "Income", "id": 3}]
+    (tmp_path / "categories.json").write_text(json.dumps(categories), encoding="utf-8")
+    return str(tmp_path / "finances.json"), str(tmp_path / "categories.json"), str(tmp_path / "finances.db")
+
+
+def sync(ledger):
+    changed = ledger.sync_external()
+    while changed is None:
+        time.sleep(0.01)
+        changed = ledger.sync_external()
+    return changed
+
+
+@pytest.mark.parametrize("mode", ["journal", "json", "sqlite"])
+def test_recurring_occurrences_are_added_once(paths, mode):
+    today = date.today()
+    start = format_date(date(today.year - 1, today.month, 1))
+    rule = {"id": 1, "type": "expense", "amount": 900.0, "reason": "Rent", "category_id": 2, "frequency": "monthly",
+            "interval": 1, "start": start, "end": None, "next": start}
+    ledger = Ledger.open(mode, *paths, debounce=0)
+    ledger.update_settings({"recurring": [rule]})
+    ledger.close()
+
+    # Both open before either has written what it expanded.
+    first = Ledger.open(mode, *paths)
+    second = Ledger.open(mode, *paths)
+    first.flush()
+    second.flush()
+    for _ in range(2):
+        sync(first)
+        sync(second)
+    assert len(first.events) == len(second.events) == 13
+    first.close()
+    second.close()
+
+    ledger = Ledger.open(mode, *paths)
+    assert len(ledger.events) == 13
+    ledger.close()
+
+
+def test_sqlite_query_matches_search_index(paths):
+    ledgers = {}
+    # Opened first, so SQLite does not migrate the journal's events.
+    for mode in ("sqlite", "journal"):
+        ledger = Ledger.open(mode, *paths, debounce=0)
+        for day in range(1, 29):
+            ledger.add(-float(day), "Food" if day % 3 else "Rent", f"{day:02d}.02.2024")
+            ledger.add(float(day * 10), "Salary", f"{day:02d}.03.2024")
+        ledgers[mode] = ledger
+
+    for filters in ({"reason": "Food"}, {"reason": "Rent", "start": "10.02.2024"}, {"text": "a"},
+                    {"event_type": "income", "end": "15.03.2024"}, {"min_amount": 5.0, "max_amount": 150.0},
+                    {"reason": "Missing"}):
+        expected = ledgers["journal"].query(0, 500, **filters)
+        assert ledgers["sqlite"].query(0, 500, **filters) == expected
+        assert ledgers["sqlite"].query(3, 4, **filters) == (expected[0], expected[1][3:7])
+    for ledger in ledgers.values():
+        ledger.close()
+
+
+def test_search_index_follows_edits(paths):
+    from finance_search import EventIndex
+
+    ledger = Ledger.open("journal", *paths, debounce=0)
+    for day in range(1, 29):
+        ledger.add(-float(day % 5), "Food", f"{day:02d}.02.2024")
+        ledger.add(float(day % 7), "Salary", f"{day % 4 + 1:02d}.03.2024")
+    index = ledger.search_index
+    ids = [event["id"] for event in ledger.events]
+
+    ledger.update_amount(3, -4.0)
+    ledger.update_amount(10, -0.5)
+    ledger.shift_dates(ids[5:9], 20)
+    ledger.recategorize(ids[12:15], "Rent")
+    ledger.delete_events(ids[20:23])
+    ledger.delete_event(0)
+    ledger.undo()
+    ledger.undo()
+    ledger.redo()
+    ledger.undo()
+    ledger.undo()
+
+    assert ledger.search_index is index
+    rebuilt = EventIndex(ledger.columns)
+    for name in ("by_day", "day_keys", "by_amount", "amount_keys"):
+        assert getattr(index, name).tolist() == getattr(rebuilt, name).tolist()
+    assert {code: posting.tolist() for code, posting in index.postings.items()} == \
+        {code: posting.tolist() for code, posting in rebuilt.postings.items()}
+    ledger.close()
+
+
+def test_writer_stats_reach_the_gauges(paths, monkeypatch):
+    from finance_metrics import metrics
+
+    monkeypatch.setattr(metrics, "enabled", True)
+    ledger = Ledger.open("journal", *paths, debounce=0)
+    ledger.add(-5.0, "Food", "01.02.2024")
+    ledger.flush()
+    ledger.update_gauges()
+    gauges = metrics.snapshot()["gauges"]
+    assert gauges["write_flush_count"] >= 1
+    assert gauges["write_queue_depth"] == 0
+    assert gauges["write_max_flush_ms"] >= gauges["write_last_flush_ms"] > 0
+    ledger.close()
+
+
+@pytest.mark.parametrize("mode", ["journal", "json", "sqlite"])
+def test_concurrent_appends_are_merged(paths, mode):
+    first = Ledger.open(mode, *paths, debounce=0)
+    second = Ledger.open(mode, *paths, debounce=0)
+    for day in range(1, 11):
+        first.add(float(day), "Food", f"{day:02d}.02.2024")
+        second.add(float(day * 100), "Salary", f"{day:02d}.03.2024")
+    first.flush()
+    second.flush()
+    sync(first)
+    sync(second)
+
+    expected = sorted((event["id"], event["amount"]) for event in first.events)
+    assert len(expected) == 20
+    assert len({event_id for event_id, _ in expected}) == 20
+    assert sorted((event["id"], event["amount"]) for event in second.events) == expected
+    assert first.aggregates.balance == second.aggregates.balance == 5500.0 - 55.0
+    first.close()
+    second.close()
+
+    ledger = Ledger.open(mode, *paths)
+    assert sorted((event["id"], event["amount"]) for event in ledger.events) == expected
+    ledger.close()
+
+
+@pytest.mark.parametrize("mode", ["journal", "json", "sqlite"])
+def test_undo_redo_round_trip(paths, mode):
+    def state():
+        return [dict(event) for event in ledger.events]
+
+    ledger = Ledger.open(mode, *paths, debounce=0)
+    for day in range(1, 6):
+        ledger.add(float(day), "Food", f"{day:02d}.02.2024")
+    ids = [event["id"] for event in ledger.events]
+    states = [state()]
+    for step in (lambda: ledger.update_amount(1, 20.0), lambda: ledger.recategorize(ids[2:4], "Rent"),
+                 lambda: ledger.shift_dates(ids[:2], 3), lambda: ledger.delete_events(ids[1:3])):
+        step()
+        states.append(state())
+
+    for expected in reversed(states[:-1]):
+        assert ledger.undo() is not None
+        assert state() == expected
+    for expected in states[1:]:
+        assert ledger.redo() is not None
+        assert state() == expected
+    assert ledger.redo() is None
+    ledger.close()
+
+    ledger = Ledger.open(mode, *paths)
+    assert state() == states[-1]
+    ledger.close()
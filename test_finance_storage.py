@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from finance_storage import read_json_stream
+
+FINANCES = {
+    "income": 1234.5678,
+    "expenses": -1.5e-3,
+    "events": [
+        {"type": "income", "amount": 1234.5678, "reason": "Salary", "date": "01.02.2024", "id": 1},
+        {"type": "expense", "amount": 12e2, "reason": "Rent", "date": "03.02.2024", "id": 2},
+    ],
+    "journal_seq": 10,
+}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 6, 7, 10, 15, 30, 1 << 20])
+def test_read_json_stream_chunk_boundaries(tmp_path, chunk_size):
+    path = tmp_path / "finances.json"
+    path.write_text(json.dumps(FINANCES), encoding="utf-8")
+    assert read_json_stream(str(path), chunk_size=chunk_size) == FINANCES
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 6, 10, 15, 30])
+def test_read_json_stream_top_level_float(tmp_path, chunk_size):
+    path = tmp_path / "finances.json"
+    path.write_text('{"events": [], "income": 1234.5678}', encoding="utf-8")
+    assert read_json_stream(str(path), chunk_size=chunk_size) == {"events": [], "income": 1234.5678}
+
+
+@pytest.fixture
+def ledger_files(tmp_path):
+    categories = [{"name": "Food", "type": "Expense", "id": 1}, {"name": "Salary", "type": "Income", "id": 2}]
+    (tmp_path / "categories.json").write_text(json.dumps(categories), encoding="utf-8")
+    return str(tmp_path / "finances.json"), str(tmp_path / "categories.json")
+
+
+def open_ledger(files, mode="journal"):
+    from finance_ledger import Ledger
+    data_path, category_path = files
+    return Ledger.open(mode, data_path, category_path, data_path + ".db", debounce=0)
+
+
+def test_append_after_torn_journal_tail(ledger_files):
+    for amount in (1.0, 2.0):
+        ledger = open_ledger(ledger_files)
+        ledger.add(amount, "Food", "01.02.2024")
+        ledger.close()
+    with open(ledger_files[0] + ".journal", "ab") as f:
+        f.write(b'{"op": "add", "event": {"type": "exp')
+    ledger = open_ledger(ledger_files)
+    ledger.add(3.0, "Food", "01.02.2024")
+    ledger.close()
+
+    ledger = open_ledger(ledger_files)
+    assert [event["amount"] for event in ledger.events] == [1.0, 2.0, 3.0]
+    ledger.close()